@@ -0,0 +1,210 @@
+import os
+import math
+import time
+import uuid
+import asyncio
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is over its rate or no backend slot frees up in time"""
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class AdmissionController:
+    """Per-user token buckets and a global cap on concurrent backend work.
+
+    State lives in a small SQLite database so every worker process on the
+    host shares the same buckets and slots. A slot is a lease: if a process
+    dies while holding one, the slot is reclaimed after ``lease_seconds``.
+    Callers that find every slot taken wait up to their plan's queue time,
+    then get a rejection carrying a Retry-After estimate.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS slots (
+            slot INTEGER PRIMARY KEY,
+            holder TEXT,
+            acquired_at REAL
+        );
+    """
+
+    def __init__(self, path, max_concurrent=4, lease_seconds=900, poll_interval=0.05, clock=time.time):
+        self.path = path
+        self.max_concurrent = max_concurrent
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._average_hold = 10.0
+        self.stats = {'admitted': 0, 'queued': 0, 'rate_limited': 0, 'rejected': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(self.SCHEMA)
+        with self._transaction() as connection:
+            connection.executemany('INSERT OR IGNORE INTO slots (slot) VALUES (?)',
+                                   [(i,) for i in range(max_concurrent)])
+            connection.execute('DELETE FROM slots WHERE slot >= ? AND holder IS NULL', (max_concurrent,))
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def take_token(self, key, per_minute, burst, cost=1.0):
+        """Spend ``cost`` tokens from ``key``'s bucket or raise a 429 rejection"""
+        rate = per_minute / 60.0
+        now = self.clock()
+        with self._transaction() as connection:
+            row = connection.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+        if not allowed:
+            self._count('rate_limited')
+            raise AdmissionRejected('Too many requests, please slow down', 429, (cost - tokens) / rate)
+
+    def _try_acquire(self, holder):
+        now = self.clock()
+        with self._transaction() as connection:
+            return connection.execute(
+                """UPDATE slots SET holder = ?, acquired_at = ?
+                   WHERE slot = (SELECT slot FROM slots
+                                 WHERE slot < ? AND (holder IS NULL OR acquired_at < ?)
+                                 ORDER BY slot LIMIT 1)""",
+                (holder, now, self.max_concurrent, now - self.lease_seconds)
+            ).rowcount == 1
+
+    def _free(self, holder):
+        with self._transaction() as connection:
+            connection.execute('UPDATE slots SET holder = NULL, acquired_at = NULL WHERE holder = ?', (holder,))
+
+    def _release(self, holder, held_for):
+        self._free(holder)
+        with self._lock:
+            # Moving average of hold time, used for Retry-After estimates
+            self._average_hold = 0.8 * self._average_hold + 0.2 * held_for
+
+    @contextmanager
+    def slot(self, max_wait=0.0, keep_waiting=None):
+        """Hold one of the global backend slots for the duration of the block.
+
+        Waits up to ``max_wait`` seconds for a free slot (None waits
+        forever) and raises a 503 rejection if none frees up in time.
+        Once ``keep_waiting()`` returns true the wait is no longer bounded.
+        """
+        holder = uuid.uuid4().hex
+        started = time.monotonic()
+        delay = self.poll_interval
+        queued = False
+        while not self._try_acquire(holder):
+            waited = time.monotonic() - started
+            if keep_waiting is not None and keep_waiting():
+                max_wait = None
+            if max_wait is not None and waited >= max_wait:
+                self._count('rejected')
+                raise AdmissionRejected('Enhancement servers are busy, please retry shortly', 503,
+                                        self._average_hold)
+            if not queued:
+                queued = True
+                self._count('queued')
+            sleep = delay if max_wait is None else min(delay, max_wait - waited)
+            time.sleep(max(sleep, 0.001))
+            delay = min(delay * 2, 0.25)
+
+        self._count('admitted')
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(holder, time.monotonic() - acquired)
+
+    async def _try_acquire_async(self, holder):
+        attempt = asyncio.ensure_future(asyncio.to_thread(self._try_acquire, holder))
+        try:
+            return await asyncio.shield(attempt)
+        except asyncio.CancelledError:
+            # The attempt finishes on its thread regardless; free any slot it took
+            def forfeit(done):
+                if not done.cancelled() and done.exception() is None and done.result():
+                    asyncio.get_running_loop().run_in_executor(None, self._free, holder)
+            attempt.add_done_callback(forfeit)
+            raise
+
+    @asynccontextmanager
+    async def slot_async(self, max_wait=0.0):
+        """``slot`` for the event loop: waiting for a slot sleeps the task, not a thread.
+
+        The SQLite transactions run on the default executor, so a busy
+        database never stalls the loop.
+        """
+        holder = uuid.uuid4().hex
+        started = time.monotonic()
+        delay = self.poll_interval
+        queued = False
+        while not await self._try_acquire_async(holder):
+            waited = time.monotonic() - started
+            if max_wait is not None and waited >= max_wait:
+                self._count('rejected')
+                raise AdmissionRejected('Enhancement servers are busy, please retry shortly', 503,
+                                        self._average_hold)
+            if not queued:
+                queued = True
+                self._count('queued')
+            sleep = delay if max_wait is None else min(delay, max_wait - waited)
+            await asyncio.sleep(max(sleep, 0.001))
+            delay = min(delay * 2, 0.25)
+
+        self._count('admitted')
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self._release, holder, time.monotonic() - acquired)
+
+    def snapshot(self):
+        in_use = self._connection().execute(
+            'SELECT COUNT(*) FROM slots WHERE holder IS NOT NULL AND slot < ? AND acquired_at >= ?',
+            (self.max_concurrent, self.clock() - self.lease_seconds)
+        ).fetchone()[0]
+        with self._lock:
+            return dict(self.stats, in_use=in_use, max_concurrent=self.max_concurrent,
+                        average_hold_seconds=round(self._average_hold, 2))
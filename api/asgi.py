@@ -0,0 +1,411 @@
+import os
+import sys
+import json
+import asyncio
+import logging
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+# Long-lived routes; they get their own threads so watchers and chunked
+# enhancements (threaded end to end, like the job workers) never starve pages
+STREAM_PREFIXES = ('/api/progress/', '/api/enhance-chunked')
+
+
+def wsgi_environ(scope, body):
+    """A WSGI environ for an ASGI HTTP scope whose body is read from ``body`` as the app asks for it"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body ends where the ASGI server says, so chunked uploads are readable too
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name in ('content-length', 'content-type'):
+            environ[name.upper().replace('-', '_')] = value
+            continue
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def remove(path):
+    """Unlink ``path`` unless it is already gone"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def content_length(scope):
+    for name, value in scope['headers']:
+        if name == b'content-length':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class ReceiveStream:
+    """``wsgi.input`` that pulls body chunks off the ASGI ``receive`` channel as the app reads.
+
+    The view's thread blocks on the event loop for the next chunk, so the
+    body goes straight into whatever parses it (the upload spool) with no
+    copy in between, and a limit the view applies stops the upload there.
+    A client that disconnects, or sends nothing for ``timeout`` seconds,
+    reads as an OSError, which Werkzeug reports as ClientDisconnected.
+    """
+
+    def __init__(self, receive, loop, limit=None, timeout=60.0):
+        self._receive = receive
+        self._loop = loop
+        self.limit = limit
+        self.timeout = timeout
+        self.length = 0
+        self.disconnected = False
+        self._buffer = bytearray()
+        self._more = True
+
+    async def _next(self):
+        message = await self._receive()
+        if message['type'] == 'http.disconnect':
+            self.disconnected = True
+            return b'', False
+        return message.get('body', b''), message.get('more_body', False)
+
+    def _fill(self):
+        future = asyncio.run_coroutine_threadsafe(self._next(), self._loop)
+        try:
+            chunk, self._more = future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise ConnectionError(f'No request body for {self.timeout:.0f}s')
+        if self.disconnected:
+            raise ConnectionError('Client disconnected during upload')
+        self.length += len(chunk)
+        if self.limit is not None and self.length > self.limit:
+            raise RequestEntityTooLarge('Request body too large')
+        self._buffer += chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._more:
+                self._fill()
+            size = len(self._buffer)
+        while not self._buffer and self._more:
+            # A message at a time; callers handle short reads
+            self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def prefetch(self):
+        """Read the whole body on the event loop; for bodies small enough to hold in memory"""
+        while self._more and not self.disconnected:
+            chunk, self._more = await self._next()
+            self.length += len(chunk)
+            self._buffer += chunk
+
+    async def wait_disconnect(self):
+        """After the view is done with the body: discard what it left unread, then wait for the client to leave"""
+        while not self.disconnected:
+            await self._next()
+
+
+class RequestThread:
+    """Runs one request's blocking steps on a pool, all in one ``contextvars`` context.
+
+    A Flask request context pushed by one step is still current in the
+    next, even on another thread, so an async view can hop between the
+    event loop and Flask code that uses ``request`` and ``g``.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.context = contextvars.Context()
+
+    def __call__(self, fn, *args, **kwargs):
+        call = functools.partial(self.context.run, fn, *args, **kwargs)
+        return asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+
+class AsyncApp:
+    """ASGI server for the Flask app.
+
+    Async views (``route``) are coroutines: their CPU and disk steps hop
+    onto ``view_threads`` threads, but waiting for a backend slot and for
+    the Space suspends the task, so one process holds hundreds of slow
+    enhancements without a thread each. Every other route runs its Flask
+    view on a separate pool of ``threads``, so pages and health checks
+    never queue behind enhancement work. Request bodies stream straight
+    into the view as it parses them: each upload is written to disk once,
+    in its spool file, and the caller's plan limit cuts it off mid-stream.
+    Bodies up to ``buffer_bytes`` (upload chunks, forms) are read on the
+    loop first and hold no thread while they arrive; a larger upload holds
+    its view's thread, so ``view_threads`` also caps concurrent uploads.
+    The async views' own short blocking steps (``asyncio.to_thread``) get
+    a pool of their own, which a slow upload never ties up.
+    """
+
+    def __init__(self, flask_app, threads=16, view_threads=16, stream_threads=256, max_body_bytes=None,
+                 body_timeout=60.0, buffer_bytes=5 * 1024 * 1024):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+        self.view_executor = ThreadPoolExecutor(max_workers=view_threads, thread_name_prefix='asgi-view')
+        self.io_executor = ThreadPoolExecutor(max_workers=view_threads, thread_name_prefix='asgi-io')
+        self.stream_executor = ThreadPoolExecutor(max_workers=stream_threads, thread_name_prefix='asgi-stream')
+        self.max_body_bytes = max_body_bytes
+        self.body_timeout = body_timeout
+        self.buffer_bytes = buffer_bytes
+        self.views = {}
+        self._loop = None
+
+    def route(self, path, method='POST'):
+        """Register an async view; it is called with the request's ``RequestThread``"""
+        def register(view):
+            self.views[(method, path)] = view
+            return view
+        return register
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # asyncio.to_thread and the step drivers, called from async views, use the default executor
+            loop.set_default_executor(self.io_executor)
+            self._loop = loop
+
+        length = content_length(scope)
+        if self.max_body_bytes is not None and length is not None and length > self.max_body_bytes:
+            return await self._send_json(send, 413, {'success': False, 'error': 'Request body too large'})
+        body = ReceiveStream(receive, loop, self.max_body_bytes, self.body_timeout)
+        if length is not None and length <= self.buffer_bytes:
+            await body.prefetch()
+            if body.disconnected:
+                return
+        environ = wsgi_environ(scope, body)
+        view = self.views.get((scope['method'], scope['path']))
+        if view is not None:
+            await self._serve_view(view, environ, RequestThread(self.view_executor), send, body)
+        else:
+            stream = scope['path'].startswith(STREAM_PREFIXES)
+            thread = RequestThread(self.stream_executor if stream else self.executor)
+            await self._send_wsgi(self.flask_app.wsgi_app, environ, thread, send, body)
+
+    async def _serve_view(self, view, environ, thread, send, body):
+        # The request context stays pushed while the view awaits, so its uploads stay open
+        context = self.flask_app.request_context(environ)
+        await thread(context.push)
+        try:
+            rv = await thread(self.flask_app.preprocess_request)
+            if rv is None:
+                rv = await view(thread)
+            response = await thread(self.flask_app.finalize_request, rv)
+            if hasattr(response.response, '__aiter__'):
+                await self._send_async(response, thread, send, body)
+            else:
+                await self._send_wsgi(response, environ, thread, send, body)
+        finally:
+            await thread(context.pop)
+
+    @staticmethod
+    def _start_wsgi(wsgi_app, environ):
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+
+        iterable = wsgi_app(environ, start_response)
+        iterator = iter(iterable)
+        first = next(iterator, None)
+        return started, iterable, iterator, first
+
+    async def _send_wsgi(self, wsgi_app, environ, thread, send, body):
+        """Run a WSGI callable on the request's thread and stream its body chunk by chunk"""
+        started, iterable, iterator, chunk = await thread(self._start_wsgi, wsgi_app, environ)
+        # The view has read all it wants of the request body by now
+        disconnected = asyncio.ensure_future(body.wait_disconnect())
+        try:
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            while chunk is not None and not disconnected.done():
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await thread(next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            disconnected.cancel()
+            if hasattr(iterable, 'close'):
+                await thread(iterable.close)
+
+    @staticmethod
+    async def _send_async(response, thread, send, body):
+        """Send a response whose body is an async iterator; a disconnect cancels the step in progress"""
+        disconnected = asyncio.ensure_future(body.wait_disconnect())
+        chunks = response.response.__aiter__()
+        try:
+            await send({'type': 'http.response.start', 'status': response.status_code,
+                        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                    for name, value in response.headers.to_wsgi_list()]})
+            while True:
+                step = asyncio.ensure_future(chunks.__anext__())
+                await asyncio.wait({step, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if not step.done():
+                    step.cancel()
+                    await asyncio.gather(step, return_exceptions=True)
+                    return
+                try:
+                    chunk = step.result()
+                except StopAsyncIteration:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            disconnected.cancel()
+            await thread(response.close)
+
+    @staticmethod
+    async def _send_json(send, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]})
+        await send({'type': 'http.response.body', 'body': data})
+
+    @staticmethod
+    async def _lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_app():
+    """App factory for ASGI servers: ``uvicorn --app-dir api --factory asgi:create_app``"""
+    import index
+    from ingest import FORM_OVERHEAD_BYTES
+    from zipstream import ZipStream
+
+    threads = int(os.getenv('ASGI_THREADS', '16'))
+    largest_upload = max(plan['max_upload_mb'] for plan in index.PLANS.values()) * 1024 * 1024
+    app = AsyncApp(
+        index.app,
+        threads=threads,
+        view_threads=int(os.getenv('ASGI_VIEW_THREADS', '16')),
+        stream_threads=int(os.getenv('ASGI_STREAM_THREADS', '256')),
+        max_body_bytes=largest_upload * index.BATCH_MAX_FILES + FORM_OVERHEAD_BYTES,
+        body_timeout=float(os.getenv('ASGI_BODY_TIMEOUT_SECONDS', '60')),
+        buffer_bytes=int(os.getenv('ASGI_BUFFER_BODY_BYTES', str(5 * 1024 * 1024)))
+    )
+
+    @app.route('/api/enhance')
+    async def enhance_audio(thread):
+        """/api/enhance with the backend wait on the event loop (see index.enhance_audio)"""
+        try:
+            pending = await thread(index.begin_enhance)
+            if not isinstance(pending, dict):
+                return pending
+            try:
+                outcome = await index.enhance_cached_async(**pending['enhance'])
+            except Exception as e:
+                return await thread(index.finish_enhance, pending, error=e)
+            return await thread(index.finish_enhance, pending, outcome)
+        except Exception as e:
+            return await thread(index.enhance_error_response, e)
+
+    async def iterate(chunks):
+        # Each step of a sync generator (file reads, progress writes) runs off the loop
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    @app.route('/api/enhance-batch')
+    async def enhance_batch(thread):
+        """/api/enhance-batch with each file's backend wait on the event loop (see index.enhance_batch)"""
+        try:
+            batch = await thread(index.begin_batch)
+        except Exception as e:
+            return await thread(index.batch_error_response, e)
+        if not isinstance(batch, dict):
+            return batch
+
+        workers = asyncio.Semaphore(index.BATCH_WORKERS)
+        started = set()
+
+        async def enhance(entry, minutes, input_path, content_hash):
+            async with workers:
+                started.add(input_path)
+                try:
+                    # The response is already streaming by the time files queue, so they wait for a slot
+                    outcome = await index.enhance_cached_async(input_path, content_hash, batch['enhancement_type'],
+                                                               None, batch['output_format'], batch['kbps'])
+                    return entry, minutes, outcome, None
+                except Exception as e:
+                    return entry, minutes, None, e
+                finally:
+                    await asyncio.to_thread(remove, input_path)
+
+        tasks = {asyncio.ensure_future(enhance(*item)): item for item in batch['items']}
+
+        async def body():
+            archive = ZipStream()
+            try:
+                for done, finished in enumerate(asyncio.as_completed(list(tasks)), 1):
+                    entry, minutes, outcome, error = await finished
+                    async for chunk in iterate(index.batch_member(archive, batch, entry, minutes, done,
+                                                                  outcome, error)):
+                        yield chunk
+                async for chunk in iterate(index.batch_manifest(archive, batch)):
+                    yield chunk
+            finally:
+                # Client went away: files that never started are neither enhanced nor charged.
+                # Cancel them all before the first await, so none can start meanwhile
+                cancelled = any(not task.done() for task in tasks)
+                unstarted = [(task, item) for task, item in tasks.items()
+                             if not task.done() and item[2] not in started]
+                for task, _ in unstarted:
+                    task.cancel()
+                for _, (entry, minutes, input_path, _) in unstarted:
+                    await asyncio.to_thread(index.usage_store.refund, batch['user_id'], minutes)
+                    await asyncio.to_thread(remove, input_path)
+                if cancelled:
+                    await asyncio.to_thread(batch['report'], 'failed', error='Batch cancelled')
+
+        return index.batch_response(body(), batch)
+
+    logger.info(f"⚡ ASGI app ready with {threads} page threads")
+    return app
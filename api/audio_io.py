@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import shutil
+import subprocess
+from collections import namedtuple
+
+import numpy as np
+import soundfile as sf
+
+from formats import OUTPUT_FORMATS, DEFAULT_OPUS_KBPS, OPUS_SAMPLERATES
+
+# 64k frames is ~1.4 s at 48 kHz: 512 KB per stereo float32 block
+BLOCK_FRAMES = 65536
+
+AudioInfo = namedtuple('AudioInfo', ['samplerate', 'channels', 'frames', 'duration', 'codec'])
+
+
+class AudioDecodeError(Exception):
+    """Raised when an input cannot be decoded by libsndfile or ffmpeg"""
+
+
+def _ffprobe(path):
+    if not shutil.which('ffprobe'):
+        raise AudioDecodeError('Unsupported format and ffmpeg is not installed')
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+         '-show_entries', 'stream=sample_rate,channels,codec_name:format=duration',
+         '-of', 'json', path],
+        capture_output=True, text=True
+    )
+    try:
+        probe = json.loads(result.stdout)
+        stream = probe['streams'][0]
+        samplerate = int(stream['sample_rate'])
+        duration = float(probe['format']['duration'])
+    except (ValueError, KeyError, IndexError):
+        raise AudioDecodeError(f'ffprobe could not read the file: {result.stderr.strip()}')
+    return AudioInfo(samplerate, int(stream['channels']), int(round(duration * samplerate)), duration,
+                     stream.get('codec_name', 'unknown'))
+
+
+def audio_info(path):
+    """Sample rate, channels and length, via libsndfile or ffprobe"""
+    try:
+        info = sf.info(path)
+        return AudioInfo(info.samplerate, info.channels, info.frames, info.duration, info.format.lower())
+    except (RuntimeError, sf.SoundFileError):
+        return _ffprobe(path)
+
+
+def _ffmpeg_blocks(path, info, block_frames, start, stop):
+    if not shutil.which('ffmpeg'):
+        raise AudioDecodeError('Unsupported format and ffmpeg is not installed')
+    command = ['ffmpeg', '-v', 'error', '-nostdin']
+    if start:
+        command += ['-ss', f'{start / info.samplerate:.6f}']
+    command += ['-i', path]
+    if stop is not None:
+        command += ['-t', f'{(stop - start) / info.samplerate:.6f}']
+    command += ['-f', 'f32le', '-acodec', 'pcm_f32le', '-']
+
+    block_bytes = block_frames * info.channels * 4
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % (info.channels * 4)
+            yield np.frombuffer(data[:usable], dtype=np.float32).reshape(-1, info.channels)
+    finally:
+        process.stdout.close()
+        process.kill()
+        process.wait()
+
+
+def iter_blocks(path, block_frames=BLOCK_FRAMES, start=0, stop=None, info=None):
+    """Lazily yield (frames, channels) float32 blocks of decoded PCM.
+
+    Memory use is bounded by ``block_frames`` regardless of file length.
+    WAV/FLAC/OGG/MP3 decode through libsndfile; anything else (M4A, AAC,
+    WEBM...) is piped through ffmpeg when it is installed.
+    """
+    try:
+        reader = sf.SoundFile(path)
+    except (RuntimeError, sf.SoundFileError):
+        yield from _ffmpeg_blocks(path, info or _ffprobe(path), block_frames, start, stop)
+        return
+
+    with reader:
+        if start:
+            reader.seek(start)
+        remaining = None if stop is None else stop - start
+        while remaining is None or remaining > 0:
+            count = block_frames if remaining is None else min(block_frames, remaining)
+            block = reader.read(count, dtype='float32', always_2d=True)
+            if not len(block):
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            yield block
+
+
+def read_frames(path, start=0, stop=None, info=None):
+    """Decode the [start, stop) frame range into one array"""
+    info = info or audio_info(path)
+    blocks = list(iter_blocks(path, start=start, stop=stop, info=info))
+    if not blocks:
+        return np.zeros((0, info.channels), dtype=np.float32), info.samplerate
+    return np.concatenate(blocks), info.samplerate
+
+
+class BlockWriter:
+    """Incremental encoder: write blocks as they are produced, never the whole file"""
+
+    def __init__(self, path, samplerate, channels, format='WAV', subtype='PCM_16', compression_level=None):
+        self.path = path
+        self.channels = channels
+        # Ogg carries Opus or Vorbis; the other containers name their codec
+        self.codec = (subtype if format == 'OGG' else format).lower()
+        self.frames = 0
+        self.encode_seconds = 0.0
+        self._file = sf.SoundFile(path, 'w', samplerate=samplerate, channels=channels,
+                                  format=format, subtype=subtype, compression_level=compression_level)
+
+    def write(self, block):
+        started = time.perf_counter()
+        self._file.write(np.clip(block, -1.0, 1.0))
+        self.encode_seconds += time.perf_counter() - started
+        self.frames += len(block)
+
+    def close(self):
+        if not self._file.closed:
+            started = time.perf_counter()
+            self._file.close()
+            self.encode_seconds += time.perf_counter() - started
+
+    def report(self):
+        """Encode time, and size against the 16-bit WAV the same audio would take"""
+        size = os.path.getsize(self.path)
+        wav_bytes = 44 + self.frames * self.channels * 2
+        return {
+            'codec': self.codec,
+            'encode_seconds': round(self.encode_seconds, 3),
+            'bytes': size,
+            'compression_ratio': round(wav_bytes / size, 2) if size else 0.0
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def opus_compression_level(kbps, channels):
+    """libsndfile maps the compression level linearly onto 256..6 kbps per channel"""
+    per_channel = kbps * 1000 / channels
+    return min(max(1.0 - (per_channel - 6000) / 250000, 0.0), 1.0)
+
+
+class ResamplingWriter(BlockWriter):
+    """``BlockWriter`` that resamples each channel to ``samplerate`` on the way in"""
+
+    def __init__(self, path, from_rate, samplerate, channels, **kwargs):
+        from preprocess import PolyphaseResampler
+        super().__init__(path, samplerate, channels, **kwargs)
+        self.resamplers = [PolyphaseResampler(from_rate, samplerate) for _ in range(channels)]
+
+    def _resample(self, block, final=False):
+        return np.stack([resampler.process(block[:, channel], final=final)
+                         for channel, resampler in enumerate(self.resamplers)], axis=1)
+
+    def write(self, block):
+        super().write(self._resample(block))
+
+    def close(self):
+        if not self._file.closed:
+            super().write(self._resample(np.zeros((0, self.channels), np.float32), final=True))
+        super().close()
+
+
+def opus_samplerate(samplerate):
+    """The lowest rate Opus encodes that keeps the whole band of ``samplerate``"""
+    return next((rate for rate in OPUS_SAMPLERATES if rate >= samplerate), OPUS_SAMPLERATES[-1])
+
+
+def output_writer(path, samplerate, channels, output_format='wav', kbps=None):
+    """``BlockWriter`` for one of ``OUTPUT_FORMATS``.
+
+    Opus only encodes 8/12/16/24/48 kHz; audio at any other rate (44.1 kHz
+    most often) is resampled to the next rate up as it is written.
+    """
+    container, subtype = OUTPUT_FORMATS[output_format][:2]
+    if output_format != 'opus':
+        return BlockWriter(path, samplerate, channels, format=container, subtype=subtype)
+    level = opus_compression_level(kbps or DEFAULT_OPUS_KBPS, channels)
+    rate = opus_samplerate(samplerate)
+    if rate == samplerate:
+        return BlockWriter(path, samplerate, channels, format=container, subtype=subtype, compression_level=level)
+    return ResamplingWriter(path, samplerate, rate, channels, format=container, subtype=subtype,
+                            compression_level=level)
+
+
+def encode_file(input_path, output_path, output_format, kbps=None):
+    """Re-encode block by block, so memory stays bounded; returns the writer's report"""
+    info = audio_info(input_path)
+    with output_writer(output_path, info.samplerate, info.channels, output_format, kbps) as writer:
+        for block in iter_blocks(input_path, info=info):
+            writer.write(block)
+    return writer.report()
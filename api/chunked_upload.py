@@ -0,0 +1,275 @@
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+MAX_TOTAL_CHUNKS = 10000
+
+
+class UploadError(Exception):
+    """Raised for invalid or unknown chunked uploads"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ChunkedUploadStore:
+    """Disk-backed spool for resumable chunked uploads.
+
+    Every upload gets its own directory holding a ``meta.json`` file and one
+    ``<index>.part`` file per received chunk. Chunks are written to a temp
+    file and renamed into place, so they can arrive out of order, in
+    parallel, and be retried without corrupting the spool.
+
+    An upload belongs to the user who sent its first chunk; anyone else is
+    told it does not exist. The meta keeps a running byte total, updated
+    under a per-upload file lock, so an upload can be held to a size limit
+    however many chunks it is split into. Once assembled, the meta says so
+    and the upload reports itself complete, chunks or no chunks.
+
+    A request finalising an upload holds it with ``busy``: a concurrent
+    finalise is refused and ``expire`` leaves it alone, however long the
+    enhancement takes.
+    """
+
+    def __init__(self, root, ttl_seconds=3600, sweep_interval=60):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _upload_dir(self, upload_id):
+        if not upload_id or not UPLOAD_ID_PATTERN.match(upload_id):
+            raise UploadError('Invalid uploadId')
+        return os.path.join(self.root, upload_id)
+
+    def _chunk_path(self, upload_dir, index):
+        return os.path.join(upload_dir, f'{index:05d}.part')
+
+    def _read_meta(self, upload_dir, owner):
+        try:
+            with open(os.path.join(upload_dir, 'meta.json')) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise UploadError('Unknown uploadId', status=404)
+        # Someone else's upload id is answered exactly like an unknown one
+        if meta.get('owner') != owner:
+            raise UploadError('Unknown uploadId', status=404)
+        return meta
+
+    def _write_meta(self, upload_dir, meta):
+        fd, temp_path = tempfile.mkstemp(dir=upload_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(upload_dir, 'meta.json'))
+
+    @contextmanager
+    def _locked(self, upload_dir):
+        """Serialise meta.json updates across threads and worker processes"""
+        with open(os.path.join(upload_dir, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _open_meta(self, upload_dir, total_chunks, filename, owner):
+        """meta.json of the upload, created by its first chunk; call with the upload locked"""
+        if not os.path.exists(os.path.join(upload_dir, 'meta.json')):
+            meta = {
+                'filename': filename,
+                'total_chunks': total_chunks,
+                'owner': owner,
+                'bytes': 0,
+                'created_at': time.time()
+            }
+            self._write_meta(upload_dir, meta)
+            return meta
+        meta = self._read_meta(upload_dir, owner)
+        if meta['total_chunks'] != total_chunks:
+            raise UploadError('totalChunks does not match the existing upload', status=409)
+        return meta
+
+    def save_chunk(self, upload_id, chunk_index, total_chunks, filename, chunk_path, owner, max_bytes=None):
+        """Move one received chunk file into the spool and return the upload status.
+
+        ``owner`` is the uploading user; ``max_bytes`` caps the whole
+        upload and a chunk that would cross it is refused with a 413.
+        """
+        upload_dir = self._upload_dir(upload_id)
+
+        if total_chunks < 1 or total_chunks > MAX_TOTAL_CHUNKS:
+            raise UploadError('Invalid totalChunks')
+        if chunk_index < 0 or chunk_index >= total_chunks:
+            raise UploadError('chunkIndex out of range')
+
+        os.makedirs(upload_dir, exist_ok=True)
+        with self._locked(upload_dir):
+            meta = self._open_meta(upload_dir, total_chunks, filename, owner)
+            # A chunk retried after assembly (its response was lost) is already in
+            if not meta.get('assembled'):
+                self._store_chunk(upload_dir, meta, chunk_index, chunk_path, max_bytes)
+
+        # Touch the directory so expiry is based on the last activity
+        os.utime(upload_dir)
+        self.maybe_expire()
+        return self.status(upload_id, owner)
+
+    def _store_chunk(self, upload_dir, meta, chunk_index, chunk_path, max_bytes):
+        """Move a chunk into place and count its bytes; call with the upload locked"""
+        size = os.path.getsize(chunk_path)
+        part_path = self._chunk_path(upload_dir, chunk_index)
+        # A retried chunk replaces the earlier copy, so only the difference counts
+        replaced = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        total_bytes = meta['bytes'] - replaced + size
+        if max_bytes is not None and total_bytes > max_bytes:
+            raise UploadError(f'File too large (max {max_bytes // (1024 * 1024)}MB)', status=413)
+
+        fd, temp_path = tempfile.mkstemp(dir=upload_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            # Hard-link the already spooled request body when possible
+            os.unlink(temp_path)
+            try:
+                os.link(chunk_path, temp_path)
+            except OSError:
+                shutil.copyfile(chunk_path, temp_path)
+            os.replace(temp_path, part_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        meta['bytes'] = total_bytes
+        self._write_meta(upload_dir, meta)
+
+    def _status(self, upload_id, upload_dir, meta):
+        total_chunks = meta['total_chunks']
+        if meta.get('assembled'):
+            received = set(range(total_chunks))
+        else:
+            received = {int(name[:-5]) for name in os.listdir(upload_dir) if name.endswith('.part')}
+
+        missing = [i for i in range(total_chunks) if i not in received]
+        return {
+            'upload_id': upload_id,
+            'filename': meta['filename'],
+            'total_chunks': total_chunks,
+            'received_chunks': len(received),
+            'received_bytes': meta.get('bytes', 0),
+            'missing_chunks': missing,
+            'complete': not missing,
+            'assembled': bool(meta.get('assembled'))
+        }
+
+    def status(self, upload_id, owner):
+        """Return received/missing chunk indexes so clients can resume"""
+        upload_dir = self._upload_dir(upload_id)
+        return self._status(upload_id, upload_dir, self._read_meta(upload_dir, owner))
+
+    def assemble(self, upload_id, owner):
+        """Concatenate all chunks into one file and return its path"""
+        upload_dir = self._upload_dir(upload_id)
+        # Unknown and foreign ids are refused before anything is created in their directory
+        self._read_meta(upload_dir, owner)
+        with self._locked(upload_dir):
+            meta = self._read_meta(upload_dir, owner)
+            extension = os.path.splitext(meta['filename'])[1] or '.wav'
+            assembled_path = os.path.join(upload_dir, f'assembled{extension}')
+            # Already assembled by an earlier attempt, whose chunks are gone
+            if meta.get('assembled'):
+                if not os.path.exists(assembled_path):
+                    raise UploadError('Unknown uploadId', status=404)
+                return assembled_path
+
+            status = self._status(upload_id, upload_dir, meta)
+            if not status['complete']:
+                raise UploadError(f"Upload incomplete: {len(status['missing_chunks'])} chunks missing", status=409)
+
+            fd, temp_path = tempfile.mkstemp(dir=upload_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    for index in range(status['total_chunks']):
+                        with open(self._chunk_path(upload_dir, index), 'rb') as chunk:
+                            shutil.copyfileobj(chunk, out, 1024 * 1024)
+                os.replace(temp_path, assembled_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+            meta.update(assembled=True, assembled_at=time.time())
+            self._write_meta(upload_dir, meta)
+
+            # The chunks are no longer needed once the assembled file exists
+            for index in range(status['total_chunks']):
+                try:
+                    os.unlink(self._chunk_path(upload_dir, index))
+                except FileNotFoundError:
+                    pass
+
+        logger.info(f"📦 Assembled upload {upload_id} ({status['total_chunks']} chunks)")
+        return assembled_path
+
+    @contextmanager
+    def busy(self, upload_id, owner):
+        """Hold an upload while a request finalises it; a second finaliser gets a 409"""
+        upload_dir = self._upload_dir(upload_id)
+        self._read_meta(upload_dir, owner)
+        try:
+            lock = open(os.path.join(upload_dir, '.busy'), 'a')
+        except FileNotFoundError:
+            # Expired or discarded in the meantime
+            raise UploadError('Unknown uploadId', status=404)
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError('Upload is already being processed', status=409)
+            yield
+
+    def discard(self, upload_id):
+        shutil.rmtree(self._upload_dir(upload_id), ignore_errors=True)
+
+    def maybe_expire(self):
+        """Run expire() at most once per sweep interval"""
+        now = time.time()
+        if now - self._last_sweep < self.sweep_interval:
+            return 0
+        self._last_sweep = now
+        return self.expire(now)
+
+    def _remove_idle(self, upload_dir):
+        # Never under a request that holds it busy, however long that runs
+        try:
+            lock = open(os.path.join(upload_dir, '.busy'), 'a')
+        except FileNotFoundError:
+            return False
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            shutil.rmtree(upload_dir, ignore_errors=True)
+        return True
+
+    def expire(self, now=None):
+        """Remove uploads with no activity for longer than the TTL, unless one is busy"""
+        now = now or time.time()
+        removed = 0
+        for name in os.listdir(self.root):
+            upload_dir = os.path.join(self.root, name)
+            try:
+                idle = now - os.path.getmtime(upload_dir)
+            except OSError:
+                continue
+            if os.path.isdir(upload_dir) and idle > self.ttl_seconds and self._remove_idle(upload_dir):
+                removed += 1
+        if removed:
+            logger.info(f"🧹 Expired {removed} abandoned uploads")
+        return removed
@@ -0,0 +1,120 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ClientPool:
+    """Process-wide pool of reusable backend clients.
+
+    Creating a Gradio ``Client`` fetches the Space config and performs a
+    handshake, so clients are kept and handed out one per call. A client that
+    raises during use is dropped and replaced on the next checkout, and
+    clients idle for longer than ``health_interval`` are checked with
+    ``health_check`` before being reused.
+    """
+
+    def __init__(self, factory, size=4, health_check=None, health_interval=300, acquire_timeout=60):
+        self.factory = factory
+        self.size = size
+        self.health_check = health_check
+        self.health_interval = health_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = deque()
+        self._created = 0
+        self._cond = threading.Condition()
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0, 'health_failures': 0}
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    return None, 0.0
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('Timed out waiting for a backend client')
+                self._cond.wait(remaining)
+
+    def _release_slot(self):
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _connect(self):
+        try:
+            client = self.factory()
+        except Exception:
+            self._release_slot()
+            raise
+        self.stats['created'] += 1
+        return client
+
+    def _is_healthy(self, client):
+        try:
+            return bool(self.health_check(client))
+        except Exception as e:
+            logger.warning(f"⚠️ Backend client health check failed: {str(e)}")
+            return False
+
+    @contextmanager
+    def client(self):
+        """Check out a client for the duration of the ``with`` block"""
+        client, last_used = self._checkout()
+        if client is None:
+            client = self._connect()
+        elif (self.health_check and time.monotonic() - last_used > self.health_interval
+              and not self._is_healthy(client)):
+            # The stale client keeps its slot; only the session is replaced
+            self.stats['health_failures'] += 1
+            self.stats['discarded'] += 1
+            client = self._connect()
+        else:
+            self.stats['reused'] += 1
+
+        try:
+            yield client
+        except Exception:
+            # Reconnect on the next checkout rather than reuse a broken session
+            self.stats['discarded'] += 1
+            self._release_slot()
+            raise
+        with self._cond:
+            self._idle.append((client, time.monotonic()))
+            self._cond.notify()
+
+    def warm(self, count=None):
+        """Pre-create clients so the first requests skip the handshake"""
+        count = min(count or self.size, self.size)
+        warmed = 0
+        for _ in range(count):
+            with self._cond:
+                if self._created >= self.size:
+                    break
+                self._created += 1
+            try:
+                client = self._connect()
+            except Exception as e:
+                logger.error(f"Backend warm-up failed: {str(e)}")
+                break
+            with self._cond:
+                self._idle.append((client, time.monotonic()))
+                self._cond.notify()
+            warmed += 1
+        logger.info(f"🔥 Warmed {warmed} backend clients")
+        return warmed
+
+    def warm_in_background(self, count=None):
+        thread = threading.Thread(target=self.warm, args=(count,), name='client-pool-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self.stats, size=self.size, open=self._created, idle=len(self._idle))
@@ -0,0 +1,334 @@
+import os
+import math
+import shutil
+import asyncio
+import logging
+
+import numpy as np
+
+from audio_io import audio_info, iter_blocks, BlockWriter
+from steps import run_steps, run_steps_async
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class EnhancementBackend:
+    """An engine that turns one audio file into an enhanced WAV file"""
+
+    name = 'base'
+    label = 'Enhancement'
+
+    def enhance(self, input_path, output_path, upload_stats=None):
+        """Write the enhanced audio; remote backends record bytes uploaded into ``upload_stats``"""
+        raise NotImplementedError
+
+
+class DeepFilterBackend(EnhancementBackend):
+    """Remote DeepFilterNet2 running on a Gradio Space.
+
+    ``steps`` yields the one ``predict`` call, so the ASGI server can await
+    it instead of blocking a thread.
+    """
+
+    name = 'deepfilter'
+    label = 'DeepFilterNet2 Enhancement'
+
+    def __init__(self, predict, preparer=None):
+        self.predict = predict
+        self.preparer = preparer
+
+    def _prepare(self, input_path):
+        original_bytes = os.path.getsize(input_path)
+        if self.preparer is not None:
+            try:
+                return self.preparer.prepare(input_path)
+            except Exception as e:
+                logger.warning(f"⚠️ Upload preprocessing skipped: {str(e)}")
+        return input_path, None, {'original_bytes': original_bytes, 'sent_bytes': original_bytes}
+
+    def enhance(self, input_path, output_path, upload_stats=None):
+        return run_steps(self.steps(input_path, output_path, upload_stats), self.predict)
+
+    def steps(self, input_path, output_path, upload_stats=None):
+        upload_path, info, stats = self._prepare(input_path)
+        metrics.upload_bytes.inc(stats['original_bytes'], kind='original')
+        metrics.upload_bytes.inc(stats['sent_bytes'], kind='sent')
+        if upload_stats is not None:
+            upload_stats.update(stats)
+        try:
+            self._store_result((yield upload_path,), output_path)
+        finally:
+            if upload_path != input_path:
+                os.unlink(upload_path)
+        if info is not None:
+            # The model answers in mono; give the result the input's channel layout back
+            self.preparer.restore(output_path, info.channels)
+        return output_path
+
+    @staticmethod
+    def _store_result(result, output_path):
+        if isinstance(result, str) and os.path.exists(result):
+            # gradio_client downloads each result into its own directory and never
+            # cleans up, so take the file and drop the directory
+            with metrics.stage_seconds.time(stage='result_move'):
+                shutil.move(result, output_path)
+            try:
+                os.rmdir(os.path.dirname(result))
+            except OSError:
+                pass
+        elif isinstance(result, (bytes, bytearray)):
+            with open(output_path, 'wb') as output_file:
+                output_file.write(result)
+        else:
+            raise RuntimeError('DeepFilterNet2 returned no audio')
+
+        if os.path.getsize(output_path) <= 1000:
+            raise RuntimeError('DeepFilterNet2 returned an empty file')
+
+
+class SpectralGate:
+    """Vectorised, streaming STFT spectral gate.
+
+    The noise profile is the mean magnitude spectrum of the quietest frames.
+    Each frame is attenuated by a power-subtraction gain against that
+    profile, smoothed over neighbouring bins and frames, and floored so the
+    background is reduced rather than removed. Input arrives as blocks of
+    PCM; every block's frames go through the FFT as one matrix and the
+    overlap-add state is carried between blocks, so memory is bounded by the
+    block size rather than the file length.
+    """
+
+    def __init__(self, n_fft=1024, threshold_db=6.0, floor_db=-20.0, noise_percentile=15.0, block_frames=512):
+        self.n_fft = n_fft
+        self.hop = n_fft // 4
+        self.threshold = 10 ** (threshold_db / 20)
+        self.floor = 10 ** (floor_db / 20)
+        self.noise_percentile = noise_percentile
+        self.block_frames = block_frames
+        self.window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+        # Analysis and synthesis both use the window, so overlap-add sums window**2
+        self.norm = float(np.sum(self.window ** 2) / self.hop)
+
+    @classmethod
+    def for_samplerate(cls, samplerate, **kwargs):
+        """About 20 ms frames, rounded to a power of two"""
+        n_fft = 2 ** int(round(math.log2(max(samplerate, 8000) * 0.02)))
+        return cls(n_fft=n_fft, **kwargs)
+
+    def _mono_spectra(self, block):
+        """Magnitude spectra of the mono frames inside one block, in sub-blocks"""
+        mono = block.mean(axis=1, dtype=np.float32)
+        if len(mono) < self.n_fft:
+            return
+        frames = np.lib.stride_tricks.sliding_window_view(mono, self.n_fft)[::self.hop]
+        for first in range(0, len(frames), self.block_frames):
+            yield np.abs(np.fft.rfft(frames[first:first + self.block_frames] * self.window, axis=-1))
+
+    def noise_profile(self, blocks):
+        """Mean magnitude spectrum of the quietest frames.
+
+        ``blocks`` is a callable returning a fresh iterable of (frames,
+        channels) blocks; it is consumed twice (energies, then averaging).
+        """
+        energies = [np.mean(magnitude ** 2, axis=-1) for block in blocks() for magnitude in self._mono_spectra(block)]
+        if not energies:
+            return np.zeros(self.n_fft // 2 + 1, dtype=np.float32)
+        cutoff = np.percentile(np.concatenate(energies), self.noise_percentile)
+
+        profile = np.zeros(self.n_fft // 2 + 1, dtype=np.float64)
+        count = 0
+        for block in blocks():
+            for magnitude in self._mono_spectra(block):
+                quiet = np.mean(magnitude ** 2, axis=-1) <= cutoff
+                profile += magnitude[quiet].sum(axis=0)
+                count += int(quiet.sum())
+        return (profile / max(count, 1)).astype(np.float32)
+
+    def _gains(self, magnitude, threshold):
+        gain = np.sqrt(np.clip(1.0 - (threshold / (magnitude + 1e-10)) ** 2, self.floor ** 2, 1.0))
+        smoothed = gain.copy()
+        smoothed[..., 1:-1] = (gain[..., :-2] + gain[..., 1:-1] + gain[..., 2:]) / 3
+        return smoothed
+
+    def _advance(self, state, threshold, final):
+        """Synthesise every frame that no longer needs future input"""
+        buffer = state['buffer']
+        total = (buffer.shape[1] - self.n_fft) // self.hop + 1 if buffer.shape[1] >= self.n_fft else 0
+        # One frame of lookahead is kept back for the time smoothing
+        ready = total if final else total - 1
+        if ready <= 0:
+            return np.zeros((buffer.shape[0], 0), dtype=np.float32)
+
+        span = buffer[:, :(total - 1) * self.hop + self.n_fft]
+        frames = np.lib.stride_tricks.sliding_window_view(span, self.n_fft, axis=-1)[:, ::self.hop]
+        spectrum = np.fft.rfft(frames * self.window, axis=-1)
+        gain = self._gains(np.abs(spectrum), threshold)
+
+        previous = state['previous_gain'] if state['previous_gain'] is not None else gain[:, :1]
+        before = np.concatenate([previous, gain[:, :-1]], axis=1)
+        after = np.concatenate([gain[:, 1:], gain[:, -1:]], axis=1)
+        smoothed = (before + gain + after) / 3
+
+        synthesized = np.fft.irfft(spectrum[:, :ready] * smoothed[:, :ready], n=self.n_fft, axis=-1) * self.window
+        overlap = self.n_fft // self.hop
+        accumulator = np.zeros((buffer.shape[0], (ready - 1 + overlap) * self.hop), dtype=np.float32)
+        accumulator[:, :self.n_fft - self.hop] += state['tail']
+        # Frame f covers hop rows f .. f + overlap - 1
+        rows = accumulator.reshape(buffer.shape[0], -1, self.hop)
+        pieces = synthesized.reshape(buffer.shape[0], ready, overlap, self.hop)
+        for k in range(overlap):
+            rows[:, k:k + ready] += pieces[:, :, k]
+
+        state['buffer'] = buffer[:, ready * self.hop:]
+        state['previous_gain'] = gain[:, ready - 1:ready]
+        if final:
+            return accumulator / self.norm
+        state['tail'] = accumulator[:, ready * self.hop:]
+        return accumulator[:, :ready * self.hop] / self.norm
+
+    def stream(self, blocks, profile):
+        """Gate an iterable of (frames, channels) blocks, yielding output blocks"""
+        threshold = (profile * self.threshold)[np.newaxis, np.newaxis, :]
+        state = None
+        received = 0
+        # The output starts with the n_fft samples of left padding
+        position = -self.n_fft
+
+        def emit(output):
+            nonlocal position
+            start = max(-position, 0)
+            stop = min(output.shape[1], received - position)
+            position += output.shape[1]
+            if stop > start:
+                return output[:, start:stop].T
+            return None
+
+        for block in blocks:
+            channels = block.T.astype(np.float32, copy=False)
+            if state is None:
+                state = {
+                    'buffer': np.zeros((channels.shape[0], self.n_fft), dtype=np.float32),
+                    'tail': np.zeros((channels.shape[0], self.n_fft - self.hop), dtype=np.float32),
+                    'previous_gain': None
+                }
+            state['buffer'] = np.concatenate([state['buffer'], channels], axis=1)
+            received += channels.shape[1]
+            out = emit(self._advance(state, threshold, final=False))
+            if out is not None:
+                yield out
+
+        if state is None:
+            return
+        # Right padding so the last samples get their full overlap-add
+        padding = self.n_fft + (-state['buffer'].shape[1] % self.hop)
+        state['buffer'] = np.pad(state['buffer'], ((0, 0), (0, padding)))
+        out = emit(self._advance(state, threshold, final=True))
+        if out is not None:
+            yield out
+
+    def process(self, samples, profile=None, block_frames=65536):
+        """Gate a whole (frames, channels) array; convenience wrapper over stream()"""
+        def blocks():
+            return (samples[i:i + block_frames] for i in range(0, len(samples), block_frames))
+
+        if profile is None:
+            profile = self.noise_profile(blocks)
+        output = list(self.stream(blocks(), profile))
+        if not output:
+            return np.zeros_like(samples, dtype=np.float32)
+        return np.concatenate(output)
+
+
+class SpectralGateBackend(EnhancementBackend):
+    """In-process NumPy denoiser used when the remote model is unavailable"""
+
+    name = 'spectral_gate'
+    label = 'Local Spectral Gate Enhancement'
+
+    def __init__(self, **gate_options):
+        self.gate_options = gate_options
+
+    def enhance(self, input_path, output_path, upload_stats=None):
+        # Two decoding passes (noise profile, then gating), both block by block
+        info = audio_info(input_path)
+        gate = SpectralGate.for_samplerate(info.samplerate, **self.gate_options)
+        profile = gate.noise_profile(lambda: iter_blocks(input_path, info=info))
+        with BlockWriter(output_path, info.samplerate, info.channels) as writer:
+            for block in gate.stream(iter_blocks(input_path, info=info), profile):
+                writer.write(block)
+        return output_path
+
+
+class BackendChain:
+    """Try backends in order, falling through to the next one on failure.
+
+    Clips shorter than ``local_max_seconds`` go to the local backend first,
+    which avoids the remote round trip for short audio. A local result that
+    stood in for a failed remote call is flagged ``degraded`` in
+    ``upload_stats``.
+    """
+
+    def __init__(self, remote, local, local_max_seconds=0.0, mode='auto'):
+        self.remote = remote
+        self.local = local
+        self.local_max_seconds = local_max_seconds
+        self.mode = mode
+
+    def _order(self, input_path):
+        if self.mode == 'local':
+            return [self.local]
+        if self.mode == 'remote':
+            return [self.remote]
+        if self.local_max_seconds > 0:
+            try:
+                if audio_info(input_path).duration <= self.local_max_seconds:
+                    return [self.local, self.remote]
+            except Exception:
+                pass
+        return [self.remote, self.local]
+
+    def _succeeded(self, backend, attempt, upload_stats):
+        metrics.backend_calls.inc(backend=backend.name, outcome='success')
+        if attempt:
+            metrics.fallbacks.inc(to=backend.name)
+            if backend is self.local and upload_stats is not None:
+                # Stood in for the remote model: not a result worth keeping
+                upload_stats['degraded'] = True
+        return backend.label
+
+    def _failed(self, backend, error):
+        metrics.backend_calls.inc(backend=backend.name, outcome='failure')
+        logger.warning(f"⚠️ {backend.label} failed: {str(error)}")
+
+    def enhance(self, input_path, output_path, upload_stats=None):
+        """Enhance into ``output_path`` and return the label of the backend used"""
+        last_error = None
+        for attempt, backend in enumerate(self._order(input_path)):
+            try:
+                backend.enhance(input_path, output_path, upload_stats)
+            except Exception as e:
+                last_error = e
+                self._failed(backend, e)
+                continue
+            return self._succeeded(backend, attempt, upload_stats)
+        raise RuntimeError(f'All enhancement backends failed: {str(last_error)}')
+
+    async def enhance_async(self, input_path, output_path, upload_stats=None, predict=None):
+        """``enhance`` for the event loop: the remote call is awaited through ``predict``.
+
+        The local backend is CPU work and runs on the default executor.
+        """
+        last_error = None
+        for attempt, backend in enumerate(self._order(input_path)):
+            try:
+                if backend is self.remote:
+                    await run_steps_async(backend.steps(input_path, output_path, upload_stats), predict)
+                else:
+                    await asyncio.to_thread(backend.enhance, input_path, output_path, upload_stats)
+            except Exception as e:
+                last_error = e
+                self._failed(backend, e)
+                continue
+            return self._succeeded(backend, attempt, upload_stats)
+        raise RuntimeError(f'All enhancement backends failed: {str(last_error)}')
@@ -0,0 +1,258 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# A channel's stream ends after one of these
+TERMINAL_EVENTS = ('ready', 'failed')
+
+CHANNEL_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+class EventBusFull(Exception):
+    """Raised when a subscriber would open a channel beyond ``max_channels``"""
+
+
+class _Watch:
+    __slots__ = ('condition', 'latest', 'subscribers')
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.latest = 0
+        self.subscribers = 0
+
+
+class EventBus:
+    """Pub/sub for progress events, keyed by channel id, shared by every worker process.
+
+    Events live in a small SQLite database, like the admission state,
+    because the upload that publishes and the SSE stream that watches are
+    separate requests, which gunicorn or uvicorn may hand to different
+    worker processes; an in-process bus silently loses every event whose
+    watcher sits in another worker. A publish is one short WAL transaction
+    (synchronous=NORMAL, so no fsync; about 60 µs) and a request publishes
+    a handful, which is noise next to the enhancement itself. The last ``history`` events of each channel are kept and replayed to
+    subscribers that connect late or reconnect with a Last-Event-ID; event
+    ids are global and only grow, so a resumed stream never misses one.
+    Channels with no event for ``linger_seconds`` are swept lazily as new
+    channels are opened.
+
+    Within a process one poller thread checks for new events every
+    ``poll_interval`` (one indexed query, however many watchers there
+    are) and wakes only the subscribers of channels that changed, so an
+    idle subscriber is a thread parked in ``wait``. Each stream still
+    holds a thread: serve SSE from the ASGI server or a threaded worker,
+    never from a pool of sync workers.
+
+    Channels that requests publish to are bound to their owner with
+    ``claim``, so a caller cannot write into another user's stream.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS channels (
+            name TEXT PRIMARY KEY,
+            touched REAL NOT NULL,
+            owner TEXT
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            event TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS events_by_channel ON events (channel, id);
+    """
+
+    def __init__(self, path, history=32, linger_seconds=300, max_channels=10000, sweep_interval=30,
+                 poll_interval=0.2, clock=time.time):
+        self.path = path
+        self.history = history
+        self.linger_seconds = linger_seconds
+        self.max_channels = max_channels
+        self.sweep_interval = sweep_interval
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._watches = {}
+        self._poller = None
+        self._wake = threading.Event()
+        self._last_sweep = 0.0
+        self.stats = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(self.SCHEMA)
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(channels)')]
+        if 'owner' not in columns:
+            # Databases from before channels had owners
+            connection.execute('ALTER TABLE channels ADD COLUMN owner TEXT')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _sweep(self, connection, now):
+        self._last_sweep = now
+        connection.execute('DELETE FROM channels WHERE touched < ?', (now - self.linger_seconds,))
+        connection.execute('DELETE FROM events WHERE channel NOT IN (SELECT name FROM channels)')
+
+    def _has_room(self, connection, now):
+        if now - self._last_sweep > self.sweep_interval:
+            self._sweep(connection, now)
+        if connection.execute('SELECT COUNT(*) FROM channels').fetchone()[0] < self.max_channels:
+            return True
+        self._sweep(connection, now)
+        return connection.execute('SELECT COUNT(*) FROM channels').fetchone()[0] < self.max_channels
+
+    def claim(self, name, owner):
+        """Bind ``name`` to ``owner`` if it is free; False if another owner has it or the bus is full"""
+        now = self.clock()
+        with self._transaction() as connection:
+            row = connection.execute('SELECT owner FROM channels WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                if not self._has_room(connection, now):
+                    self._count('dropped')
+                    return False
+                connection.execute('INSERT INTO channels (name, touched, owner) VALUES (?, ?, ?)', (name, now, owner))
+                return True
+            if row[0] is None:
+                connection.execute('UPDATE channels SET owner = ?, touched = ? WHERE name = ?', (owner, now, name))
+                return True
+            return row[0] == owner
+
+    def publish(self, name, event, **data):
+        """Append an event to ``name`` and wake its subscribers; dropped if the bus is full"""
+        now = self.clock()
+        with self._transaction() as connection:
+            known = connection.execute('UPDATE channels SET touched = ? WHERE name = ?', (now, name)).rowcount
+            if not known:
+                if not self._has_room(connection, now):
+                    self._count('dropped')
+                    return
+                connection.execute('INSERT INTO channels (name, touched) VALUES (?, ?)', (name, now))
+            connection.execute('INSERT INTO events (channel, event, data) VALUES (?, ?, ?)',
+                               (name, event, json.dumps(data)))
+            connection.execute(
+                """DELETE FROM events WHERE channel = ? AND id <= (
+                       SELECT id FROM events WHERE channel = ? ORDER BY id DESC LIMIT 1 OFFSET ?)""",
+                (name, name, self.history))
+        self._count('published')
+        # Subscribers in this process need not wait for the next poll
+        self._wake.set()
+
+    def _events(self, name, after):
+        rows = self._connection().execute(
+            'SELECT id, event, data FROM events WHERE channel = ? AND id > ? ORDER BY id', (name, after)
+        ).fetchall()
+        return [(event_id, event, json.loads(data)) for event_id, event, data in rows]
+
+    def last_event(self, name):
+        row = self._connection().execute(
+            'SELECT id, event, data FROM events WHERE channel = ? ORDER BY id DESC LIMIT 1', (name,)
+        ).fetchone()
+        return None if row is None else (row[0], row[1], json.loads(row[2]))
+
+    def subscribe(self, name, last_event_id=0, heartbeat=15.0):
+        """Yield ``(id, event, data)`` after ``last_event_id`` as they are published.
+
+        Yields None whenever ``heartbeat`` seconds pass without an event, so
+        the caller can keep the connection alive; returns after a terminal
+        event. Raises EventBusFull, before anything is yielded, if the
+        channel does not exist and could not be opened.
+        """
+        connection = self._connection()
+        if connection.execute('SELECT 1 FROM channels WHERE name = ?', (name,)).fetchone() is None:
+            with self._transaction() as connection:
+                if not self._has_room(connection, self.clock()):
+                    raise EventBusFull('Too many progress channels')
+        return self._follow(name, last_event_id, heartbeat)
+
+    def _watch(self, name):
+        with self._lock:
+            watch = self._watches.get(name)
+            if watch is None:
+                watch = self._watches[name] = _Watch()
+            watch.subscribers += 1
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='event-poller', daemon=True)
+                self._poller.start()
+        self._wake.set()
+        return watch
+
+    def _unwatch(self, name, watch):
+        with self._lock:
+            watch.subscribers -= 1
+            if not watch.subscribers:
+                del self._watches[name]
+
+    def _poll(self):
+        cursor = self._connection().execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._lock:
+                if not self._watches:
+                    continue
+            changed = self._connection().execute(
+                'SELECT channel, MAX(id) FROM events WHERE id > ? GROUP BY channel', (cursor,)
+            ).fetchall()
+            for name, latest in changed:
+                cursor = max(cursor, latest)
+                with self._lock:
+                    watch = self._watches.get(name)
+                if watch is not None:
+                    with watch.condition:
+                        watch.latest = max(watch.latest, latest)
+                        watch.condition.notify_all()
+
+    def _follow(self, name, seen, heartbeat):
+        # Watch before reading, so nothing published in between is missed
+        watch = self._watch(name)
+        try:
+            while True:
+                pending = self._events(name, seen)
+                if not pending:
+                    with watch.condition:
+                        woken = watch.condition.wait_for(lambda: watch.latest > seen, heartbeat)
+                    if not woken:
+                        yield None
+                    continue
+                for entry in pending:
+                    seen = entry[0]
+                    self._count('delivered')
+                    yield entry
+                    if entry[1] in TERMINAL_EVENTS:
+                        return
+        finally:
+            self._unwatch(name, watch)
+
+    def snapshot(self):
+        """Channels across all workers; subscribers connected to this process"""
+        channels = self._connection().execute('SELECT COUNT(*) FROM channels').fetchone()[0]
+        with self._lock:
+            subscribers = sum(watch.subscribers for watch in self._watches.values())
+            return dict(self.stats, channels=channels, subscribers=subscribers)
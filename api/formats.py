@@ -0,0 +1,10 @@
+# Output formats offered to clients: (container, subtype, mimetype, extension).
+# Kept free of audio imports so the app can validate requests without loading them.
+OUTPUT_FORMATS = {
+    'wav': ('WAV', 'PCM_16', 'audio/wav', '.wav'),
+    'flac': ('FLAC', 'PCM_16', 'audio/flac', '.flac'),
+    'opus': ('OGG', 'OPUS', 'audio/ogg', '.opus'),
+}
+OPUS_BITRATES_KBPS = (32, 48, 64, 96, 128, 160)
+DEFAULT_OPUS_KBPS = 64
+OPUS_SAMPLERATES = (8000, 12000, 16000, 24000, 48000)
@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import uuid
+import base64
+import asyncio
+import logging
+import tempfile
+import mimetypes
+from urllib.parse import urljoin
+
+import httpx
+import websockets
+
+logger = logging.getLogger(__name__)
+
+HF_SPACE_HOST_URL = 'https://huggingface.co/api/spaces/{}/host'
+
+
+def gradio_version(config):
+    """``(major, minor)`` of the Gradio release serving ``config``; 2.0 when it does not say"""
+    parts = re.findall(r'\d+', str(config.get('version') or '2.0'))
+    return tuple(int(part) for part in (parts + ['0', '0'])[:2])
+
+
+class AsyncSpaceClient:
+    """Gradio 3.x ``/predict`` calls for one audio in, one audio out, on the event loop.
+
+    Speaks the same protocol gradio_client 0.8.1 uses with a 3.x Space
+    (base64 file payloads, ``/api/predict/`` or the ``/queue/join``
+    websocket when the queue is on, ``/file=`` downloads), over httpx and
+    websockets, so a call in flight is a suspended task rather than a
+    blocked thread. Results land in a fresh directory under ``output_dir``,
+    like gradio_client's, and ``predict`` returns the file's path.
+
+    Only Gradio 3.x Spaces are spoken to natively; ``supported`` is false
+    for anything else (Gradio 4 uses SSE and file uploads), and callers go
+    through gradio_client instead.
+    """
+
+    def __init__(self, src, hf_token=None, output_dir=None, timeout=120.0):
+        self.src = src
+        self.output_dir = output_dir or os.getenv('GRADIO_TEMP_DIR') or tempfile.gettempdir()
+        self.headers = {'Authorization': f'Bearer {hf_token}'} if hf_token else {}
+        self.http = httpx.AsyncClient(headers=self.headers, timeout=timeout, follow_redirects=True)
+        self.session_hash = uuid.uuid4().hex[:11]
+        self._root = None
+        self.native = None
+        self._setup_lock = asyncio.Lock()
+
+    async def _setup(self, api_name):
+        async with self._setup_lock:
+            if self.native is not None:
+                return
+            root = self.src
+            if not root.startswith(('http://', 'https://')):
+                response = await self.http.get(HF_SPACE_HOST_URL.format(root))
+                response.raise_for_status()
+                root = response.json()['host']
+            root = root if root.endswith('/') else root + '/'
+            response = await self.http.get(urljoin(root, 'config'))
+            response.raise_for_status()
+            config = response.json()
+            version = gradio_version(config)
+            if version[0] != 3 or config.get('protocol', 'ws').startswith('sse'):
+                logger.info(f"🔌 {self.src} runs Gradio {config.get('version')}, calls go through gradio_client")
+                self.native = False
+                return
+            dependency = next((d for d in config['dependencies'] if d.get('api_name') == api_name.lstrip('/')), None)
+            if dependency is None:
+                raise ValueError(f'{self.src} has no {api_name} endpoint')
+            self.fn_index = config['dependencies'].index(dependency)
+            # Same rule as gradio_client: the queue websocket arrived in 3.2
+            self.use_queue = (bool(config.get('enable_queue')) and version >= (3, 2)
+                              and dependency.get('queue', False) is not False)
+            self._root = root
+            self.native = True
+
+    async def supported(self, api_name='/predict'):
+        """Whether ``predict`` can call the Space itself; fetches its config the first time"""
+        await self._setup(api_name)
+        return self.native
+
+    async def _payload(self, audio_path):
+        # Encoding is CPU work on a file already on disk; keep it off the loop
+        def encode():
+            with open(audio_path, 'rb') as f:
+                encoded = base64.b64encode(f.read()).decode('ascii')
+            mimetype = mimetypes.guess_type(audio_path)[0] or 'audio/wav'
+            return {'name': audio_path, 'data': f'data:{mimetype};base64,{encoded}',
+                    'orig_name': os.path.basename(audio_path), 'size': os.path.getsize(audio_path)}
+        return {'data': [await asyncio.to_thread(encode)], 'fn_index': self.fn_index,
+                'session_hash': self.session_hash}
+
+    async def _post(self, payload):
+        # gradio_client 0.8.1 sends the payload JSON-encoded twice
+        response = await self.http.post(urljoin(self._root, 'api/predict/'), json=json.dumps(payload))
+        # The answer carries the whole result as base64
+        result = await asyncio.to_thread(response.json)
+        if 'data' not in result:
+            raise ValueError(result.get('error') or f'Space answered {response.status_code}')
+        return result['data']
+
+    async def _queue(self, payload):
+        url = urljoin(self._root.replace('http', 'ws', 1), 'queue/join')
+        hash_data = json.dumps({'fn_index': self.fn_index, 'session_hash': self.session_hash})
+        async with websockets.connect(url, open_timeout=10, extra_headers=self.headers,
+                                      max_size=1024 * 1024 * 1024) as websocket:
+            while True:
+                message = json.loads(await websocket.recv())
+                if message['msg'] == 'queue_full':
+                    raise RuntimeError('Space queue is full')
+                if message['msg'] == 'send_hash':
+                    await websocket.send(hash_data)
+                elif message['msg'] == 'send_data':
+                    await websocket.send(json.dumps(payload))
+                elif message['msg'] == 'process_completed':
+                    output = message.get('output', {})
+                    if not message.get('success', True) or 'data' not in output:
+                        raise ValueError(output.get('error') or 'Space prediction failed')
+                    return output['data']
+
+    async def _save(self, item):
+        # File and base64 work runs on the executor; the loop only moves bytes between sockets and threads
+        def create():
+            directory = tempfile.mkdtemp(dir=self.output_dir)
+            return os.path.join(directory, os.path.basename(item.get('orig_name') or 'result.wav'))
+
+        path = await asyncio.to_thread(create)
+        if item.get('is_file'):
+            async with self.http.stream('GET', urljoin(self._root, 'file=' + item['name'])) as response:
+                response.raise_for_status()
+                output = await asyncio.to_thread(open, path, 'wb')
+                try:
+                    pending = []
+                    async for chunk in response.aiter_bytes(64 * 1024):
+                        pending.append(chunk)
+                        # Writes go out up to a MiB at a time, not one thread hop per chunk
+                        if len(pending) >= 16:
+                            await asyncio.to_thread(output.writelines, pending)
+                            pending = []
+                    await asyncio.to_thread(output.writelines, pending)
+                finally:
+                    await asyncio.to_thread(output.close)
+        else:
+            data = item.get('data') if isinstance(item, dict) else item
+            if not data:
+                raise ValueError('Space returned no audio')
+
+            def decode():
+                with open(path, 'wb') as output:
+                    output.write(base64.b64decode(data.split(',', 1)[-1]))
+            await asyncio.to_thread(decode)
+        return path
+
+    async def predict(self, audio_path, api_name='/predict'):
+        if not await self.supported(api_name):
+            raise RuntimeError(f'{self.src} does not speak the Gradio 3.x protocol')
+        payload = await self._payload(audio_path)
+        data = await (self._queue(payload) if self.use_queue else self._post(payload))
+        if not data or data[0] is None:
+            raise ValueError('Space returned no audio')
+        return await self._save(data[0])
+
+    async def aclose(self):
+        await self.http.aclose()
@@ -1,21 +1,49 @@
-from flask import Flask, render_template, jsonify, request, send_file
-import os
 import time
+STARTED_AT = time.perf_counter()
+
+from flask import Flask, render_template, jsonify, request, send_file, g, Response
+import os
 import logging
-import io
 import tempfile
 import json
+import sys
+import asyncio
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
-from gradio_client import Client
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from chunked_upload import ChunkedUploadStore, UploadError
+from client_pool import ClientPool
+from result_cache import ResultCache, cache_key
+from ingest import StreamingRequest, UPLOAD_FORMATS, sniff_file
+from jobs import JobStore, JobQueue
+from results import ResultStore
+from probe import probe_duration, ProbeError
+from usage_store import MemoryUsageStore, SQLiteUsageStore
+from token_verify import TokenVerifier, TokenError
+from admission import AdmissionController, AdmissionRejected
+from resilience import ResilientCaller, Endpoint, CircuitBreaker
+import metrics
+from profiler import SamplingProfiler
+from pages import PageCache
+from lazy import Lazy
+from zipstream import ZipStream
+from formats import OUTPUT_FORMATS, OPUS_BITRATES_KBPS, DEFAULT_OPUS_KBPS
+from events import EventBus, EventBusFull, CHANNEL_ID, TERMINAL_EVENTS
+from steps import run_steps_async
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, template_folder='templates')
 app.config['MAX_CONTENT_LENGTH'] = None
-app.config['UPLOAD_FOLDER'] = '/tmp'
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', '/tmp')
 app.secret_key = os.getenv('SECRET_KEY', 'voiceclean-ai-secret-key-2024')
 
 # Add JSON filter for templates
@@ -44,87 +72,863 @@ APP_ENV = os.getenv('APP_ENV', 'production')
 
 # Subscription Plans
 PLANS = {
-    'free': {'name': 'Free Plan', 'daily_minutes': 10, 'price': 0},
-    'basic': {'name': 'Basic Plan', 'daily_minutes': 60, 'price': 1.00},
-    'unlimited': {'name': 'Unlimited Plan', 'daily_minutes': -1, 'price': 2.00}
+    'free': {'name': 'Free Plan', 'daily_minutes': 10, 'price': 0, 'max_upload_mb': 50,
+             'requests_per_minute': 6, 'burst': 3, 'max_queue_seconds': 2},
+    'basic': {'name': 'Basic Plan', 'daily_minutes': 60, 'price': 1.00, 'max_upload_mb': 100,
+              'requests_per_minute': 20, 'burst': 10, 'max_queue_seconds': 15},
+    'unlimited': {'name': 'Unlimited Plan', 'daily_minutes': -1, 'price': 2.00, 'max_upload_mb': 200,
+                  'requests_per_minute': 60, 'burst': 20, 'max_queue_seconds': 30}
 }
 
-# Simple user store for demo
-user_store = {}
+# Plans and daily usage, shared by every worker process through SQLite
+if os.getenv('USAGE_STORE', 'sqlite') == 'memory':
+    usage_store = MemoryUsageStore()
+else:
+    usage_store = SQLiteUsageStore(os.getenv('USAGE_DB_PATH', os.path.join(app.config['UPLOAD_FOLDER'], 'voiceclean_usage.sqlite3')))
+
+# ID tokens are verified in process against Google's cached signing keys
+token_verifier = TokenVerifier(
+    FIREBASE_CONFIG['projectId'],
+    cache_size=int(os.getenv('TOKEN_CACHE_SIZE', '4096'))
+)
+
+def claims_for_token(id_token):
+    """Verified claims of a Firebase ID token; raises TokenError if invalid"""
+    if not FIREBASE_ENABLED:
+        # Demo identity for local development without Firebase
+        return {'sub': f'user_{hash(id_token) % 10000}', 'email': 'demo@voiceclean.ai'}
+    return token_verifier.verify(id_token)
+
+def request_user_id():
+    """Verified uid of the caller, or None; resolved once per request"""
+    if 'user_id' not in g:
+        auth_header = request.headers.get('Authorization', '')
+        g.user_id = None
+        if auth_header.startswith('Bearer '):
+            try:
+                g.user_id = claims_for_token(auth_header[7:])['sub']
+            except TokenError as e:
+                logger.warning(f"🔒 Rejected token: {str(e)}")
+    return g.user_id
+
+def usage_summary(user):
+    plan_id = user.get('plan', 'free')
+    plan = PLANS[plan_id]
+    return {
+        'plan': plan_id,
+        'plan_name': plan['name'],
+        'daily_used': round(user['daily_minutes_used'], 1),
+        'daily_limit': plan['daily_minutes'],
+        'is_unlimited': plan['daily_minutes'] < 0,
+        'reset_date': user['last_reset_date']
+    }
+
+def audio_minutes(path, format=None):
+    """Billable minutes of an audio file, probed from its headers"""
+    with metrics.stage_seconds.time(stage='probe'):
+        return round(probe_duration(path, format) / 60, 2)
+
+def reserve_usage(user_id, minutes):
+    """Atomically charge ``minutes``; returns a 403 with upgrade details if over the daily limit.
+
+    Callers refund the minutes if the enhancement then fails.
+    """
+    user = usage_store.get_user(user_id)
+    limit = PLANS[user.get('plan', 'free')]['daily_minutes']
+    allowed, used = usage_store.try_consume(user_id, minutes, limit)
+    if allowed:
+        return None
+    user['daily_minutes_used'] = used
+    return jsonify({
+        'success': False,
+        'error': f'Daily limit reached: {max(limit - used, 0):.1f} of {limit} minutes left today',
+        'upgrade_required': True,
+        'estimated_minutes': round(minutes, 1),
+        'usage': usage_summary(user)
+    }), 403
+
+def current_plan():
+    """Plan of the authenticated caller (free if unknown)"""
+    user_id = request_user_id()
+    if user_id is None:
+        return PLANS['free']
+    return PLANS[usage_store.get_user(user_id).get('plan', 'free')]
+
+# Rate limits and the backend concurrency cap, shared by every worker process
+admission = AdmissionController(
+    os.getenv('ADMISSION_DB_PATH', os.path.join(app.config['UPLOAD_FOLDER'], 'voiceclean_admission.sqlite3')),
+    max_concurrent=int(os.getenv('BACKEND_MAX_CONCURRENT', os.getenv('ENHANCE_WORKERS', '4'))),
+    lease_seconds=int(os.getenv('ADMISSION_LEASE_SECONDS', '900'))
+)
+
+def backend_slots(max_queue_seconds=None, on_admit=None):
+    """``admission.slot`` for each backend call of one request.
 
-def enhance_with_deepfilter(file_stream, filename="audio.wav"):
-    """Use DeepFilterNet2 via Gradio"""
-    temp_file_path = None
+    Calls wait at most ``max_queue_seconds`` until the request's first
+    call gets a slot (``on_admit`` is called then); after that the request
+    is under way, and its other calls, such as further segments, queue for
+    as long as it takes.
+    """
+    admitted = threading.Event()
+    lock = threading.Lock()
+
+    @contextmanager
+    def slot():
+        with admission.slot(max_queue_seconds, keep_waiting=admitted.is_set):
+            with lock:
+                first = not admitted.is_set()
+                admitted.set()
+            if first and on_admit:
+                on_admit()
+            yield
+    return slot
+
+def admission_rejected_response(e):
+    return jsonify({'success': False, 'error': str(e), 'retry_after': e.retry_after}), e.status, \
+        {'Retry-After': str(e.retry_after)}
+
+def take_request_token(user_id, cost=1.0):
+    """Charge one request to the caller's bucket; returns a 429 response when it is empty"""
+    plan = current_plan()
     try:
-        logger.info("🎵 Starting DeepFilterNet2 Enhancement...")
-        
-        file_extension = os.path.splitext(filename)[1] or '.wav'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension, dir='/tmp') as temp_file:
-            file_stream.seek(0)
-            chunk_size = 8192
-            while True:
-                chunk = file_stream.read(chunk_size)
-                if not chunk:
-                    break
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
-        
-        # Connect to DeepFilterNet2
-        client = Client("drewThomasson/DeepFilterNet2_no_limit")
-        result = client.predict(audio=temp_file_path, api_name="/predict")
-        
-        enhanced_audio = None
-        if result:
-            if isinstance(result, str) and os.path.exists(result):
-                with open(result, 'rb') as enhanced_file:
-                    enhanced_audio = enhanced_file.read()
-            elif isinstance(result, (bytes, bytearray)):
-                enhanced_audio = bytes(result)
-        
-        if enhanced_audio and len(enhanced_audio) > 1000:
-            return enhanced_audio, "DeepFilterNet2 Enhancement"
+        admission.take_token(user_id, plan['requests_per_minute'], plan['burst'], cost)
+    except AdmissionRejected as e:
+        logger.warning(f"🚦 Rate limited {user_id}")
+        return admission_rejected_response(e)
+    return None
+
+class VoiceCleanRequest(StreamingRequest):
+    """Uploads are spooled, hashed and sniffed in one pass under the plan's size limit"""
+    spool_directory = app.config['UPLOAD_FOLDER']
+
+    def upload_limit(self):
+        return current_plan()['max_upload_mb'] * 1024 * 1024
+
+    @property
+    def max_content_length(self):
+        # Each file of a batch is held to the plan limit on its own
+        limit = super().max_content_length
+        if limit is not None and self.endpoint == 'enhance_batch':
+            return limit * BATCH_MAX_FILES
+        return limit
+
+    def _load_form_data(self):
+        # Multipart bodies are spooled here, so this is the upload stage
+        if 'form' in self.__dict__ or self.mimetype != 'multipart/form-data':
+            return super()._load_form_data()
+        with metrics.stage_seconds.time(stage='upload'):
+            super()._load_form_data()
+
+app.request_class = VoiceCleanRequest
+
+def file_too_large_response():
+    max_upload_mb = current_plan()['max_upload_mb']
+    return jsonify({'success': False, 'error': f'File too large (max {max_upload_mb}MB)'}), 413
+
+# Enhanced results keyed by input content + parameters
+result_cache = ResultCache(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'voiceclean_cache'),
+    max_bytes=int(os.getenv('RESULT_CACHE_MAX_MB', '512')) * 1024 * 1024,
+    ttl_seconds=int(os.getenv('RESULT_CACHE_TTL_SECONDS', '86400')),
+    degraded_ttl_seconds=int(os.getenv('RESULT_CACHE_DEGRADED_TTL_SECONDS', '300'))
+)
+
+# Enhanced outputs served from disk by download id (with Range/conditional GET)
+result_store = ResultStore(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'voiceclean_results'),
+    ttl_seconds=int(os.getenv('RESULT_TTL_SECONDS', '86400'))
+)
+
+def send_result(download_id, as_attachment=True):
+    """Stream a stored result straight from its file"""
+    meta = result_store.get(download_id)
+    if meta is None:
+        return jsonify({'success': False, 'error': 'Result not found or expired'}), 404
+    response = send_file(
+        meta['path'],
+        as_attachment=as_attachment,
+        download_name=meta['download_name'],
+        mimetype=meta['mimetype'],
+        conditional=True,
+        etag=True,
+        max_age=3600
+    )
+    # Download ids are per-user capabilities; keep them out of shared caches
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+def wants_url_delivery():
+    if request.is_json:
+        return (request.get_json(silent=True) or {}).get('delivery') == 'url'
+    return request.form.get('delivery') == 'url'
+
+def deliver_result(path, download_name, method_used, mimetype='audio/wav', move=False, headers=None):
+    """Persist a result under a download id and answer with the file or its URL"""
+    with metrics.stage_seconds.time(stage='result_store'):
+        download_id = result_store.put_file(path, download_name, mimetype, move=move)
+    download_url = f'/api/results/{download_id}'
+
+    if wants_url_delivery():
+        response = jsonify({
+            'success': True,
+            'download_id': download_id,
+            'download_url': download_url,
+            'download_name': download_name,
+            'method': method_used
+        })
+    else:
+        response = send_result(download_id)
+
+    response.headers['X-Enhancement-Method'] = method_used
+    response.headers['X-Download-Id'] = download_id
+    response.headers['X-Download-Url'] = download_url
+    for name, value in (headers or {}).items():
+        response.headers[name] = value
+    return response
+
+def deliver_original(path, filename, audio_format, move=False, headers=None):
+    """Fallback when enhancement fails: the upload as it was sent, named and typed for its real format"""
+    mimetype, extension = UPLOAD_FORMATS.get(audio_format, ('application/octet-stream', os.path.splitext(filename)[1]))
+    metrics.fallbacks.inc(to='original_audio')
+    return deliver_result(path, f'{os.path.splitext(filename)[0]}_original{extension}', "Original Audio",
+                          mimetype=mimetype, move=move, headers=headers)
+
+# Resumable chunked uploads (spooled to disk, expired after inactivity)
+upload_store = ChunkedUploadStore(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'voiceclean_uploads'),
+    ttl_seconds=int(os.getenv('UPLOAD_TTL_SECONDS', '3600'))
+)
+# Least share of a request token a chunk costs, however small it is
+CHUNK_MIN_COST = float(os.getenv('CHUNK_MIN_COST', '0.05'))
+
+DEEPFILTER_SPACE = os.getenv('DEEPFILTER_SPACE', 'drewThomasson/DeepFilterNet2_no_limit')
+# Extra Spaces running the same model, used for failover and hedged requests
+DEEPFILTER_SPACES = [DEEPFILTER_SPACE] + [
+    space.strip() for space in os.getenv('DEEPFILTER_EXTRA_SPACES', '').split(',') if space.strip()
+]
+
+def deepfilter_client(space):
+    # gradio_client pulls in httpx and huggingface_hub; load it with the first client
+    from gradio_client import Client
+    return Client(space)
+
+def deepfilter_health_check(client):
+    """Cheap liveness probe: the Space still serves its config"""
+    with urllib.request.urlopen(client.src.rstrip('/') + '/config', timeout=5) as response:
+        return response.status == 200
+
+# Reused Gradio clients per Space, so steady-state requests skip the config fetch and handshake
+deepfilter_pools = {
+    space: ClientPool(
+        lambda space=space: deepfilter_client(space),
+        size=int(os.getenv('DEEPFILTER_POOL_SIZE', os.getenv('ENHANCE_WORKERS', '4'))),
+        health_check=deepfilter_health_check,
+        health_interval=int(os.getenv('DEEPFILTER_HEALTH_INTERVAL', '300'))
+    )
+    for space in DEEPFILTER_SPACES
+}
+
+if os.getenv('DEEPFILTER_WARMUP', 'false').lower() == 'true':
+    for pool in deepfilter_pools.values():
+        pool.warm_in_background()
+
+def space_predictor(pool):
+    def predict(audio_path):
+        # Pool checkout includes the handshake when a new client has to be built
+        started = time.perf_counter()
+        with pool.client() as client:
+            metrics.stage_seconds.observe(time.perf_counter() - started, stage='connect')
+            with metrics.stage_seconds.time(stage='inference'):
+                return client.predict(audio_path, api_name="/predict")
+    return predict
+
+def deepfilter_client_async(space):
+    # httpx and websockets load with the first call from the ASGI server
+    from gradio_async import AsyncSpaceClient
+    return AsyncSpaceClient(space)
+
+def space_predictor_async(space, pool):
+    # One async client per Space; its connections are multiplexed, so no pool
+    client = Lazy(lambda: deepfilter_client_async(space))
+    fallback = space_predictor(pool)
+
+    async def predict(audio_path):
+        if not await client.supported():
+            # Not a Gradio 3.x Space: the pooled gradio_client call, on a thread
+            return await asyncio.to_thread(fallback, audio_path)
+        with metrics.stage_seconds.time(stage='inference'):
+            return await client.predict(audio_path)
+    return predict
+
+# Per-call deadlines, a circuit breaker per Space and optional p95 hedging.
+# An open breaker fails fast so BackendChain moves straight to the local engine.
+deepfilter_caller = ResilientCaller(
+    [
+        Endpoint(
+            space, space_predictor(pool),
+            CircuitBreaker(
+                failure_threshold=int(os.getenv('BREAKER_FAILURES', '5')),
+                reset_timeout=float(os.getenv('BREAKER_RESET_SECONDS', '30'))
+            ),
+            call_async=space_predictor_async(space, pool)
+        )
+        for space, pool in deepfilter_pools.items()
+    ],
+    deadline=float(os.getenv('DEEPFILTER_TIMEOUT_SECONDS', '120')),
+    hedge=os.getenv('HEDGE_REQUESTS', 'false').lower() == 'true',
+    hedge_min_delay=float(os.getenv('HEDGE_MIN_DELAY_SECONDS', '2')),
+    max_workers=sum(pool.size for pool in deepfilter_pools.values()) * 2
+)
+
+def predict_deepfilter(audio_path):
+    """Send one audio file to DeepFilterNet2 and return the raw result"""
+    return deepfilter_caller.call(audio_path)
+
+ENHANCEMENT_BACKEND = os.getenv('ENHANCEMENT_BACKEND', 'auto')
+
+PREPROCESS_UPLOADS = os.getenv('PREPROCESS_UPLOADS', 'true').lower() == 'true'
+
+def build_enhancement_backends():
+    from engines import BackendChain, DeepFilterBackend, SpectralGateBackend
+    from preprocess import UploadPreparer
+    # Uploads go out as mono 16-bit WAV at no more than the model's rate
+    preparer = UploadPreparer(
+        max_samplerate=int(os.getenv('PREPROCESS_MAX_SAMPLERATE', '48000')),
+        work_dir=app.config['UPLOAD_FOLDER']
+    ) if PREPROCESS_UPLOADS else None
+    return BackendChain(
+        DeepFilterBackend(predict_deepfilter, preparer=preparer),
+        SpectralGateBackend(),
+        local_max_seconds=float(os.getenv('LOCAL_ENGINE_MAX_SECONDS', '0')),
+        mode=ENHANCEMENT_BACKEND
+    )
+
+# Remote DeepFilterNet2 first; the in-process spectral gate keeps serving
+# during outages and can take short clips directly. Built on first use, so
+# numpy and soundfile stay out of cold starts that only serve pages.
+enhancement_backends = Lazy(build_enhancement_backends)
+
+VAD_ENABLED = os.getenv('VAD_ENABLED', 'true').lower() == 'true'
+
+def build_silence_skipper():
+    from vad import SilenceSkipper
+    return SilenceSkipper(
+        enhancement_backends.enhance,
+        min_silence_seconds=float(os.getenv('VAD_MIN_SILENCE_SECONDS', '1.0')),
+        floor_gain_db=float(os.getenv('VAD_FLOOR_DB', '-20')),
+        work_dir=app.config['UPLOAD_FOLDER']
+    )
+
+# Long silences are cut out before the backend call and refilled afterwards
+silence_skipper = Lazy(build_silence_skipper)
+
+def enhance_with_deepfilter(input_path, output_path, tally=None, slot=None):
+    """Enhance an audio file on disk into a WAV; returns the method used.
+
+    The backend call holds a slot from ``slot`` (see ``backend_slots``;
+    by default it waits as long as it takes). Each call's voice-activity
+    and upload-size stats are appended to ``tally`` when given.
+    """
+    logger.info("🎵 Starting DeepFilterNet2 Enhancement...")
+    upload_stats = {}
+    slot = slot or backend_slots()
+
+    def backend(path, result_path):
+        with slot():
+            return enhancement_backends.enhance(path, result_path, upload_stats)
+
+    with metrics.stage_seconds.time(stage='enhance'):
+        if VAD_ENABLED:
+            method_used, stats = silence_skipper.enhance(input_path, output_path, enhance_fn=backend)
+            metrics.vad_seconds.inc(stats['skipped_seconds'], kind='skipped')
+            metrics.vad_seconds.inc(stats['duration_seconds'] - stats['skipped_seconds'], kind='sent')
         else:
-            return None, "Enhancement failed"
-            
+            method_used, stats = backend(input_path, output_path), {}
+    if tally is not None:
+        tally.append(dict(stats, **upload_stats))
+    return method_used
+
+async def enhance_with_deepfilter_async(input_path, output_path, tally=None, max_queue_seconds=None,
+                                        on_admit=None):
+    """``enhance_with_deepfilter`` for the ASGI server: the slot and the remote call are awaited, holding no thread"""
+    logger.info("🎵 Starting DeepFilterNet2 Enhancement...")
+    upload_stats = {}
+
+    async def backend(path, result_path):
+        async with admission.slot_async(max_queue_seconds):
+            if on_admit:
+                on_admit()
+            return await enhancement_backends.enhance_async(path, result_path, upload_stats,
+                                                            predict=deepfilter_caller.call_async)
+
+    with metrics.stage_seconds.time(stage='enhance'):
+        if VAD_ENABLED:
+            method_used, stats = await run_steps_async(silence_skipper.steps(input_path, output_path), backend)
+            metrics.vad_seconds.inc(stats['skipped_seconds'], kind='skipped')
+            metrics.vad_seconds.inc(stats['duration_seconds'] - stats['skipped_seconds'], kind='sent')
+        else:
+            method_used, stats = await backend(input_path, output_path), {}
+    if tally is not None:
+        tally.append(dict(stats, **upload_stats))
+    return method_used
+
+def silence_report(tally):
+    """Share of a request's audio that never reached a backend"""
+    duration = sum(stats.get('duration_seconds', 0.0) for stats in tally)
+    skipped = sum(stats.get('skipped_seconds', 0.0) for stats in tally)
+    return {
+        'skipped_seconds': round(skipped, 2),
+        'skipped_fraction': round(skipped / duration, 4) if duration else 0.0
+    }
+
+def upload_report(tally):
+    """Bytes a request's backend calls would have uploaded, and actually uploaded; None if none went remote"""
+    uploads = [stats for stats in tally if 'sent_bytes' in stats]
+    if not uploads:
+        return None
+    return {
+        'original_bytes': sum(stats['original_bytes'] for stats in uploads),
+        'sent_bytes': sum(stats['sent_bytes'] for stats in uploads)
+    }
+
+def tally_headers(silence, upload):
+    headers = {}
+    if silence:
+        headers['X-Silence-Skipped'] = str(silence['skipped_fraction'])
+    if upload:
+        headers['X-Backend-Upload-Bytes'] = f"{upload['sent_bytes']}/{upload['original_bytes']}"
+    return headers
+
+def build_segmented_enhancer():
+    from segmented import SegmentedEnhancer
+    return SegmentedEnhancer(
+        enhance_with_deepfilter,
+        fatal_errors=(AdmissionRejected,),
+        max_workers=int(os.getenv('ENHANCE_WORKERS', '4')),
+        segment_seconds=float(os.getenv('SEGMENT_SECONDS', '30')),
+        overlap_seconds=float(os.getenv('SEGMENT_OVERLAP_SECONDS', '0.5')),
+        work_dir=app.config['UPLOAD_FOLDER']
+    )
+
+# Long files are split into overlapping segments and enhanced in parallel
+segmented_enhancer = Lazy(build_segmented_enhancer)
+
+def requested_output():
+    """Output format and Opus bitrate (kbps) asked for in the form or JSON body.
+
+    Raises ValueError naming the accepted values when either is unsupported.
+    """
+    source = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    output_format = str(source.get('format') or 'wav').lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format (choose {', '.join(OUTPUT_FORMATS)})")
+    if output_format != 'opus':
+        return output_format, None
+    try:
+        kbps = int(source.get('bitrate') or DEFAULT_OPUS_KBPS)
+    except (TypeError, ValueError):
+        kbps = None
+    if kbps not in OPUS_BITRATES_KBPS:
+        raise ValueError(f"Unsupported Opus bitrate (choose {', '.join(map(str, OPUS_BITRATES_KBPS))} kbps)")
+    return output_format, kbps
+
+def output_filename(filename, output_format='wav'):
+    return f'{os.path.splitext(filename)[0]}_enhanced{OUTPUT_FORMATS[output_format][3]}'
+
+def observe_encoding(output_format, report):
+    metrics.stage_seconds.observe(report['encode_seconds'], stage='encode')
+    metrics.compression_ratio.observe(report['compression_ratio'], format=output_format)
+
+def encoding_headers(output_format, report):
+    """Per-request encode report, sent with the result"""
+    headers = {'X-Output-Format': output_format}
+    if report:
+        headers['X-Output-Codec'] = report['codec']
+        headers['X-Encode-Seconds'] = str(report['encode_seconds'])
+        headers['X-Compression-Ratio'] = str(report['compression_ratio'])
+    return headers
+
+def no_progress(event, **data):
+    pass
+
+def enhance_long_file(input_path, output_path, progress=None, output_format='wav', kbps=None, report=no_progress,
+                      tally=None, slot=None):
+    """Segmented enhancement, or one backend call for formats the segmenter cannot decode.
+
+    Returns ``(method_used, stats, encoding)``; stats is None for the
+    single-call path and encoding is None for WAV output. ``report`` gets
+    the stage events of the single-call path, which has no segments, and
+    ``tally`` collects every backend call's voice-activity stats. Each
+    backend call, one per segment, takes its own slot from ``slot``; an
+    AdmissionRejected aborts the whole file.
+    """
+    slot = slot or backend_slots()
+    try:
+        stats = segmented_enhancer.enhance_file(
+            input_path, output_path, progress=progress, output_format=output_format, kbps=kbps,
+            enhance_fn=lambda segment_path, result_path: enhance_with_deepfilter(segment_path, result_path, tally,
+                                                                                 slot))
+    except AdmissionRejected:
+        raise
     except Exception as e:
-        logger.error(f"Enhancement error: {str(e)}")
-        return None, f"Enhancement failed: {str(e)}"
-        
-    finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-            except:
-                pass
+        logger.warning(f"⚠️ Segmented enhancement unavailable, using single request: {str(e)}")
+        report('segments', done=0, total=1)
+        if output_format == 'wav':
+            method_used = enhance_with_deepfilter(input_path, output_path, tally, slot)
+            report('segments', done=1, total=1)
+            return method_used, None, None
+        from audio_io import encode_file
+        wav_path = f'{output_path}.wav'
+        try:
+            method_used = enhance_with_deepfilter(input_path, wav_path, tally, slot)
+            report('segments', done=1, total=1)
+            report('encoding', format=output_format)
+            encoding = encode_file(wav_path, output_path, output_format, kbps)
+        finally:
+            if os.path.exists(wav_path):
+                os.unlink(wav_path)
+        observe_encoding(output_format, encoding)
+        return method_used, None, encoding
+
+    if stats['failed_segments'] == stats['segments']:
+        raise RuntimeError('Enhancement failed for every segment')
+    method_used = ' + '.join(stats['methods'])
+    if stats['failed_segments']:
+        method_used += " (partial)"
+    if output_format == 'wav':
+        return method_used, stats, None
+    observe_encoding(output_format, stats['encoding'])
+    return method_used, stats, stats['encoding']
+
+def enhancement_cache_keys(content_hash, enhancement_type, output_format, kbps):
+    """Cache keys of the enhanced WAV and of its encoding in ``output_format``"""
+    params = {
+        'type': enhancement_type,
+        'model': DEEPFILTER_SPACE,
+        'backend': ENHANCEMENT_BACKEND,
+        'vad': VAD_ENABLED,
+        'preprocess': PREPROCESS_UPLOADS
+    }
+    return cache_key(content_hash, params), cache_key(content_hash, dict(params, format=output_format, bitrate=kbps))
+
+def enhancement_meta(method_used, tally):
+    """Cache meta of an enhanced WAV; a local fallback's is flagged so the cache keeps it only briefly"""
+    meta = {'method': method_used, 'silence': silence_report(tally), 'upload': upload_report(tally)}
+    if any(stats.get('degraded') for stats in tally):
+        meta['degraded'] = True
+    return meta
+
+def encode_cached(wav_path, wav_meta, output_format, kbps, report=no_progress):
+    """Encode a cached WAV result; returns the encoded file and its meta for the cache"""
+    from audio_io import encode_file
+    fd, encoded_path = tempfile.mkstemp(suffix=OUTPUT_FORMATS[output_format][3], dir=app.config['UPLOAD_FOLDER'])
+    os.close(fd)
+    report('encoding', format=output_format)
+    try:
+        encoding = encode_file(wav_path, encoded_path, output_format, kbps)
+    except Exception:
+        os.unlink(encoded_path)
+        raise
+    observe_encoding(output_format, encoding)
+    return encoded_path, dict(wav_meta, encoding=encoding)
+
+def enhance_cached(input_path, content_hash, enhancement_type, max_queue_seconds, output_format='wav', kbps=None,
+                   report=no_progress):
+    """Enhance through the result cache; returns ``(cached_path, meta, cache_hit)``.
+
+    ``cached_path`` is the caller's own link to the cached file: it must be
+    moved (``deliver_result(..., move=True)``) or deleted once read.
+
+    Identical uploads with identical settings reuse the cached result, and
+    concurrent duplicates share one backend call. Only cache misses wait
+    (up to ``max_queue_seconds``, None for as long as it takes) for a
+    backend slot. FLAC and Opus results are cached too, encoded from the
+    cached WAV; their meta carries the encode report. ``report`` gets the
+    queued, segments and encoding stage events.
+    """
+    key, encoded_key = enhancement_cache_keys(content_hash, enhancement_type, output_format, kbps)
+
+    def run_enhancement():
+        output_fd, output_path = tempfile.mkstemp(suffix='.wav', dir=app.config['UPLOAD_FOLDER'])
+        os.close(output_fd)
+        report('queued')
+        tally = []
+        try:
+            method_used = enhance_with_deepfilter(
+                input_path, output_path, tally,
+                backend_slots(max_queue_seconds, on_admit=lambda: report('segments', done=0, total=1)))
+        except Exception:
+            os.unlink(output_path)
+            raise
+        report('segments', done=1, total=1)
+        return output_path, enhancement_meta(method_used, tally)
+
+    def run_encoding():
+        wav_path, wav_meta, _ = result_cache.get_or_compute(key, run_enhancement)
+        try:
+            return encode_cached(wav_path, wav_meta, output_format, kbps, report)
+        finally:
+            os.unlink(wav_path)
+
+    if output_format == 'wav':
+        cached_path, meta, cache_hit = result_cache.get_or_compute(key, run_enhancement)
+    else:
+        cached_path, meta, cache_hit = result_cache.get_or_compute(encoded_key, run_encoding)
+    metrics.cache_lookups.inc(result='hit' if cache_hit else 'miss')
+    return cached_path, meta, cache_hit
+
+async def enhance_cached_async(input_path, content_hash, enhancement_type, max_queue_seconds, output_format='wav',
+                               kbps=None, report=no_progress):
+    """``enhance_cached`` for the ASGI server.
+
+    Waiting for a backend slot and for the backend itself suspends the
+    task instead of holding a thread; encoding runs on the executor.
+    """
+    key, encoded_key = enhancement_cache_keys(content_hash, enhancement_type, output_format, kbps)
+
+    async def run_enhancement():
+        output_fd, output_path = tempfile.mkstemp(suffix='.wav', dir=app.config['UPLOAD_FOLDER'])
+        os.close(output_fd)
+        report('queued')
+        tally = []
+        try:
+            method_used = await enhance_with_deepfilter_async(
+                input_path, output_path, tally, max_queue_seconds,
+                on_admit=lambda: report('segments', done=0, total=1))
+        except Exception:
+            os.unlink(output_path)
+            raise
+        report('segments', done=1, total=1)
+        return output_path, enhancement_meta(method_used, tally)
+
+    async def run_encoding():
+        wav_path, wav_meta, _ = await result_cache.get_or_compute_async(key, run_enhancement)
+        try:
+            return await asyncio.to_thread(encode_cached, wav_path, wav_meta, output_format, kbps, report)
+        finally:
+            await asyncio.to_thread(os.unlink, wav_path)
+
+    if output_format == 'wav':
+        cached_path, meta, cache_hit = await result_cache.get_or_compute_async(key, run_enhancement)
+    else:
+        cached_path, meta, cache_hit = await result_cache.get_or_compute_async(encoded_key, run_encoding)
+    metrics.cache_lookups.inc(result='hit' if cache_hit else 'miss')
+    return cached_path, meta, cache_hit
+
+def job_channels(job):
+    """Watchers follow the job id, or the progress id the job was submitted with"""
+    progress_id = job.get('params', {}).get('progress')
+    return [job['id']] + ([progress_id] if progress_id else [])
+
+def fail_job(job, error):
+    """A job that failed or was abandoned: refund the minutes reserved at submission, drop any partial result"""
+    params = job.get('params', {})
+    if 'user_id' in params:
+        usage_store.refund(params['user_id'], params.get('minutes', 0))
+    try:
+        os.unlink(job_store.result_path(job['id']))
+    except FileNotFoundError:
+        pass
+    for channel in job_channels(job):
+        event_bus.publish(channel, 'failed', error=error)
+
+def process_job(job, progress):
+    """Background worker: enhance a queued job's input into its result file"""
+    result_path = job_store.result_path(job['id'])
+    params = job.get('params', {})
+    output_format = params.get('format', 'wav')
+
+    def report(event, **data):
+        for channel in job_channels(job):
+            event_bus.publish(channel, event, **data)
+
+    def segment_progress(done, total):
+        progress(done, total)
+        report('segments', done=done, total=total)
+
+    tally = []
+    # Queued jobs wait as long as it takes for each backend slot
+    method_used, _, encoding = enhance_long_file(job['input_path'], result_path, progress=segment_progress,
+                                                 output_format=output_format, kbps=params.get('bitrate'),
+                                                 report=report, tally=tally)
+    try:
+        os.unlink(job['input_path'])
+    except FileNotFoundError:
+        pass
+    download_id = result_store.put_file(result_path, output_filename(job['filename'], output_format),
+                                        OUTPUT_FORMATS[output_format][2], move=True)
+    report('ready', method=method_used, download_url=f'/api/results/{download_id}')
+    return {'method': method_used, 'download_id': download_id, 'encoding': encoding,
+            'silence': silence_report(tally), 'upload': upload_report(tally)}
+
+# Asynchronous enhancement jobs, persisted on disk so they survive a worker crash
+job_store = JobStore(os.path.join(app.config['UPLOAD_FOLDER'], 'voiceclean_jobs'))
+job_queue = JobQueue(
+    job_store,
+    process_job,
+    workers=int(os.getenv('JOB_WORKERS', '2')),
+    stale_after=int(os.getenv('JOB_STALE_SECONDS', '120')),
+    retention=int(os.getenv('JOB_RETENTION_SECONDS', '86400')),
+    on_failure=fail_job
+)
+job_queue.start()
+
+# Per-request metrics; the endpoint name keeps label cardinality bounded
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+def pipeline_gauges():
+    cache = result_cache.snapshot()
+    slots = admission.snapshot()
+    events = event_bus.snapshot()
+    return [
+        ('voiceclean_result_cache_bytes', 'Bytes held by the result cache', cache['bytes']),
+        ('voiceclean_result_cache_entries', 'Entries in the result cache', cache['entries']),
+        ('voiceclean_backend_slots_in_use', 'Backend slots held across all workers', slots['in_use']),
+        ('voiceclean_backend_slots_max', 'Backend slot limit', slots['max_concurrent']),
+        ('voiceclean_progress_channels', 'Open progress event channels', events['channels']),
+        ('voiceclean_progress_subscribers', 'Progress event streams connected to this worker', events['subscribers']),
+    ]
+
+metrics.registry.add_collector(pipeline_gauges)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.endpoint or 'unmatched'
+    g.metrics_started = time.perf_counter()
+    metrics.active_requests.inc(endpoint=g.metrics_endpoint)
+    metrics.bytes_in.inc(request.content_length or 0, endpoint=g.metrics_endpoint)
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = g.get('metrics_endpoint')
+    if endpoint is not None:
+        metrics.request_seconds.observe(time.perf_counter() - g.metrics_started,
+                                        endpoint=endpoint, status=response.status_code)
+        metrics.bytes_out.inc(response.content_length or 0, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is not None:
+        metrics.active_requests.dec(endpoint=endpoint)
+
+# Opt-in sampling profiler: a fraction of requests, plus any request whose
+# X-Profile header carries the admin token
+request_profiler = SamplingProfiler(
+    interval=float(os.getenv('PROFILE_INTERVAL_MS', '10')) / 1000,
+    sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+    admin_token=os.getenv('PROFILE_TOKEN', ''),
+    thread_prefixes=('backend-call', 'segment', 'batch')
+)
+
+@app.before_request
+def start_profiling():
+    if request_profiler.enabled and request_profiler.should_profile(request.headers.get('X-Profile')):
+        g.profile = request_profiler.start(f'{request.method} {request.endpoint or "unmatched"}')
+
+@app.teardown_request
+def stop_profiling(error=None):
+    token = g.pop('profile', None)
+    if token is not None:
+        request_profiler.stop(token)
+
+# Stage events for uploads and jobs, shared by every worker process. Each SSE
+# watcher holds a thread, so serve /api/progress from the ASGI server (its own
+# stream threads) or threaded workers, not gunicorn sync workers
+event_bus = EventBus(
+    os.getenv('PROGRESS_DB_PATH', os.path.join(app.config['UPLOAD_FOLDER'], 'voiceclean_progress.sqlite3')),
+    history=int(os.getenv('PROGRESS_HISTORY', '32')),
+    linger_seconds=int(os.getenv('PROGRESS_LINGER_SECONDS', '300')),
+    max_channels=int(os.getenv('PROGRESS_MAX_CHANNELS', '10000'))
+)
+PROGRESS_HEARTBEAT_SECONDS = float(os.getenv('PROGRESS_HEARTBEAT_SECONDS', '15'))
+
+def progress_reporter():
+    """Publisher for this request's progress channel; safe to call from worker threads"""
+    channel = g.get('progress')
+    if channel is None:
+        return no_progress
+    return lambda event, **data: event_bus.publish(channel, event, **data)
+
+@app.before_request
+def open_progress_channel():
+    # The client picks the id and subscribes to /api/progress/<id> before posting
+    channel = request.headers.get('X-Progress-Id', '')
+    if request.method != 'POST' or not CHANNEL_ID.match(channel):
+        return
+    # Only an authenticated caller publishes, and only to a channel of its own;
+    # job ids are never upload channels, whoever asks
+    user_id = request_user_id()
+    if user_id is None or job_store.load(channel) is not None or not event_bus.claim(channel, user_id):
+        logger.warning(f"🔒 Ignored progress id {channel} for {user_id or 'an anonymous caller'}")
+        return
+    g.progress = channel
+    event_bus.publish(channel, 'received', bytes=request.content_length)
+
+@app.after_request
+def close_progress_channel(response):
+    channel = g.pop('progress', None)
+    if channel is None:
+        return response
+    if response.status_code == 202:
+        # The job carries on under its own id and keeps publishing here too
+        payload = response.get_json(silent=True) or {}
+        event_bus.publish(channel, 'queued', job_id=payload.get('job_id'))
+    elif response.status_code < 400:
+        event_bus.publish(channel, 'ready', method=response.headers.get('X-Enhancement-Method'),
+                          download_url=response.headers.get('X-Download-Url'))
+    else:
+        payload = response.get_json(silent=True) or {}
+        event_bus.publish(channel, 'failed', status=response.status_code, error=payload.get('error'))
+    return response
+
+# The marketing and auth pages depend only on FIREBASE_CONFIG and PLANS, so
+# they are rendered and compressed once; the content hash replaces cache busting
+page_cache = PageCache(max_age=int(os.getenv('PAGE_MAX_AGE_SECONDS', '300')))
+
+def page_renderer(name, **context):
+    def render():
+        with app.app_context():
+            return render_template(f'{name}.html', firebase_config=FIREBASE_CONFIG, **context)
+    return render
+
+for page_name, page_context in [
+    ('index', {}),
+    ('login', {}),
+    ('signup', {}),
+    ('pricing', {'plans': PLANS}),
+    ('dashboard', {}),
+]:
+    page_cache.register(page_name, page_renderer(page_name, **page_context))
+
+# Serverless cold starts render each page on its first hit; long-lived
+# servers can pay for all of them at boot instead
+if os.getenv('PRERENDER_PAGES', 'false').lower() == 'true':
+    page_cache.prerender()
+    logger.info(f"📄 Pre-rendered {len(page_cache.pages)} pages")
 
 # Main Routes
 @app.route('/')
 def index():
-    logger.info("🏠 Main page accessed - LOGIN/SIGNUP BUTTONS SHOULD BE VISIBLE")
-    # Force template refresh by adding cache busting
-    return render_template('index.html', 
-                         firebase_config=FIREBASE_CONFIG,
-                         cache_bust=datetime.now().timestamp())
+    return page_cache.response('index', request)
 
 @app.route('/login')
 def login():
-    logger.info("🔐 Login page accessed")
-    return render_template('login.html', firebase_config=FIREBASE_CONFIG)
+    return page_cache.response('login', request)
 
 @app.route('/signup')
 def signup():
-    logger.info("📝 Signup page accessed")
-    return render_template('signup.html', firebase_config=FIREBASE_CONFIG)
+    return page_cache.response('signup', request)
 
 @app.route('/pricing')
 def pricing():
-    logger.info("💰 Pricing page accessed")
-    return render_template('pricing.html', plans=PLANS, firebase_config=FIREBASE_CONFIG)
+    return page_cache.response('pricing', request)
 
 @app.route('/dashboard')
 def dashboard():
-    logger.info("📊 Dashboard page accessed")
-    return render_template('dashboard.html', firebase_config=FIREBASE_CONFIG)
+    return page_cache.response('dashboard', request)
 
 # API Routes
 @app.route('/api/health')
@@ -135,6 +939,12 @@ def health_check():
         'firebase_project_id': FIREBASE_CONFIG['projectId'],
         'routes_working': True,
         'ready': True,
+        'backend_pool': {space: pool.snapshot() for space, pool in deepfilter_pools.items()},
+        'backend_calls': deepfilter_caller.snapshot(),
+        'token_cache': token_verifier.snapshot(),
+        'admission': admission.snapshot(),
+        'startup_seconds': STARTUP_SECONDS,
+        'enhancement_loaded': enhancement_backends.loaded,
         'timestamp': datetime.now().isoformat()
     })
 
@@ -253,76 +1063,700 @@ def verify_token():
         if not id_token:
             return jsonify({'success': False, 'error': 'No token provided'}), 400
         
-        # Simple demo verification - in production use Firebase Admin SDK
-        user_id = f'user_{hash(id_token) % 10000}'
-        email = 'demo@voiceclean.ai'
-        
-        if user_id not in user_store:
-            user_store[user_id] = {
-                'email': email,
-                'plan': 'free',
-                'daily_minutes_used': 0,
-                'last_reset_date': datetime.now().strftime('%Y-%m-%d')
-            }
+        try:
+            claims = claims_for_token(id_token)
+        except TokenError as e:
+            return jsonify({'success': False, 'error': str(e)}), 401
+        user_id = claims['sub']
+        email = claims.get('email')
+        user = usage_store.ensure_user(user_id, email)
         
         return jsonify({
             'success': True,
             'user': {
                 'uid': user_id,
-                'email': email,
-                'plan': user_store[user_id].get('plan', 'free'),
-                'daily_minutes_used': user_store[user_id].get('daily_minutes_used', 0),
-                'daily_limit': PLANS[user_store[user_id].get('plan', 'free')]['daily_minutes']
+                'email': user.get('email'),
+                'plan': user.get('plan', 'free'),
+                'daily_minutes_used': user.get('daily_minutes_used', 0),
+                'daily_limit': PLANS[user.get('plan', 'free')]['daily_minutes']
             }
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': 'Invalid token'}), 401
 
+@app.route('/api/user/usage', methods=['GET'])
+def user_usage():
+    """Today's metered minutes against the caller's plan"""
+    user_id = request_user_id()
+    if user_id is None:
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+
+    return jsonify({'success': True, 'usage': usage_summary(usage_store.get_user(user_id))})
+
+def begin_enhance():
+    """Front half of /api/enhance, up to the backend call.
+
+    Returns a response to send as it is, or the pending enhancement as a
+    dict: ``enhance`` holds the ``enhance_cached`` arguments and the rest
+    is what ``finish_enhance`` needs. Both servers share it.
+    """
+    # Check authentication
+    user_id = request_user_id()
+    if user_id is None:
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+
+    # Rate limited before the body is parsed, so rejected uploads are never spooled
+    rate_limited = take_request_token(user_id)
+    if rate_limited:
+        return rate_limited
+    
+    if 'audio' not in request.files:
+        return jsonify({'success': False, 'error': 'No audio file provided'}), 400
+    
+    file = request.files['audio']
+    if file.filename == '':
+        return jsonify({'success': False, 'error': 'No file selected'}), 400
+
+    try:
+        output_format, kbps = requested_output()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # The size limit, content hash and format were all handled while the
+    # body streamed into the spool file
+    spool = file.stream
+    report = progress_reporter()
+    report('spooled', bytes=spool.size, format=spool.format)
+    if spool.format is None:
+        return jsonify({'success': False, 'error': 'Unsupported or unrecognised audio format'}), 415
+
+    # Duration comes from the headers, so over-quota requests never reach a backend
+    try:
+        minutes = audio_minutes(spool.path, spool.format)
+    except ProbeError:
+        return jsonify({'success': False, 'error': 'Could not read audio duration'}), 415
+    over_quota = reserve_usage(user_id, minutes)
+    if over_quota:
+        return over_quota
+    
+    return {
+        'user_id': user_id,
+        'minutes': minutes,
+        'filename': secure_filename(file.filename),
+        'format': spool.format,
+        'enhance': {
+            'input_path': spool.path,
+            'content_hash': spool.sha256,
+            'enhancement_type': request.form.get('type', 'isolation'),
+            'max_queue_seconds': current_plan()['max_queue_seconds'],
+            'output_format': output_format,
+            'kbps': kbps,
+            'report': report
+        }
+    }
+
+def finish_enhance(pending, outcome=None, error=None):
+    """Back half of /api/enhance: the response for ``enhance_cached``'s outcome, or for the error it raised"""
+    if error is not None:
+        usage_store.refund(pending['user_id'], pending['minutes'])
+        if isinstance(error, AdmissionRejected):
+            return admission_rejected_response(error)
+        if not isinstance(error, RuntimeError):
+            raise error
+        logger.error(f"Enhancement error: {str(error)}")
+        return deliver_original(pending['enhance']['input_path'], pending['filename'], pending['format'],
+                                headers={'X-Cache': 'MISS'})
+
+    # The result's link is moved into the result store; nothing is read into memory
+    cached_path, meta, cache_hit = outcome
+    output_format = pending['enhance']['output_format']
+    headers = encoding_headers(output_format, meta.get('encoding'))
+    headers['X-Cache'] = 'HIT' if cache_hit else 'MISS'
+    headers.update(tally_headers(meta.get('silence'), meta.get('upload')))
+    return deliver_result(cached_path, output_filename(pending['filename'], output_format),
+                          meta.get('method', 'Enhancement'), mimetype=OUTPUT_FORMATS[output_format][2],
+                          move=True, headers=headers)
+
+def enhance_error_response(e):
+    if isinstance(e, RequestEntityTooLarge):
+        return file_too_large_response()
+    return jsonify({'success': False, 'error': f'Processing error: {str(e)}'}), 500
+
 @app.route('/api/enhance', methods=['POST'])
 def enhance_audio():
     """Audio enhancement with authentication"""
     try:
-        # Check authentication
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
+        pending = begin_enhance()
+        if not isinstance(pending, dict):
+            return pending
+        try:
+            outcome = enhance_cached(**pending['enhance'])
+        except Exception as e:
+            return finish_enhance(pending, error=e)
+        return finish_enhance(pending, outcome)
+    except Exception as e:
+        return enhance_error_response(e)
+
+# Batches fan out over their own pool; each file still needs an admission slot
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '20'))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', os.getenv('ENHANCE_WORKERS', '4')))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+def batch_member_name(filename, taken, output_format='wav'):
+    """``<stem>_enhanced.<ext>``, numbered when two uploads share a name"""
+    stem, extension = os.path.splitext(filename)[0], OUTPUT_FORMATS[output_format][3]
+    name, n = f'{stem}_enhanced{extension}', 1
+    while name in taken:
+        n += 1
+        name = f'{stem}_enhanced_{n}{extension}'
+    taken.add(name)
+    return name
+
+def enhance_batch_item(input_path, content_hash, enhancement_type, output_format, kbps):
+    """Batch worker: enhance one file, then drop the batch's link to its upload"""
+    try:
+        # The response is already streaming by the time files queue, so they wait for a slot
+        return enhance_cached(input_path, content_hash, enhancement_type, None, output_format, kbps)
+    finally:
+        os.unlink(input_path)
+
+def begin_batch():
+    """Front half of /api/enhance-batch, up to the backend calls.
+
+    Returns a response to send as it is, or the pending batch as a dict:
+    ``items`` holds ``(entry, minutes, input_path, content_hash)`` per file
+    to enhance, each with its own link to the upload. Both servers share it.
+    """
+    user_id = request_user_id()
+    if user_id is None:
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+
+    rate_limited = take_request_token(user_id)
+    if rate_limited:
+        return rate_limited
+
+    files = [file for file in request.files.getlist('audio') if file.filename]
+    if not files:
+        return jsonify({'success': False, 'error': 'No audio files provided'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'success': False, 'error': f'Too many files (max {BATCH_MAX_FILES} per batch)'}), 400
+
+    try:
+        output_format, kbps = requested_output()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    report = progress_reporter()
+    report('spooled', files=len(files), bytes=sum(file.stream.size for file in files))
+
+    manifest, items, taken = [], [], set()
+    for file in files:
+        spool = file.stream
+        entry = {'file': secure_filename(file.filename) or 'audio.wav', 'status': 'failed'}
+        manifest.append(entry)
+        if spool.format is None:
+            entry['error'] = 'Unsupported or unrecognised audio format'
+            continue
+        try:
+            minutes = audio_minutes(spool.path, spool.format)
+        except ProbeError:
+            entry['error'] = 'Could not read audio duration'
+            continue
+        if reserve_usage(user_id, minutes):
+            entry['error'] = 'Daily limit reached'
+            entry['upgrade_required'] = True
+            continue
+        entry['minutes'] = minutes
+        entry['output'] = batch_member_name(entry['file'], taken, output_format)
+        # Request teardown deletes the spool once the view returns, so the
+        # worker gets its own link to the upload
+        input_path = f'{spool.path}.batch'
+        os.link(spool.path, input_path)
+        items.append((entry, minutes, input_path, spool.sha256))
+
+    if not items:
+        status = 403 if any(entry.get('upgrade_required') for entry in manifest) else 415
+        return jsonify({'success': False, 'error': 'No file in the batch could be processed',
+                        'files': manifest}), status
+
+    logger.info(f"📦 Batch of {len(items)} files for {user_id}")
+    # The stream outlives the request, so the view (not the after_request
+    # hook) reports when the batch is ready
+    g.pop('progress', None)
+    report('queued')
+    return {
+        'user_id': user_id,
+        'manifest': manifest,
+        'items': items,
+        'enhancement_type': request.form.get('type', 'isolation'),
+        'output_format': output_format,
+        'kbps': kbps,
+        'report': report
+    }
+
+def batch_error_response(e):
+    if isinstance(e, RequestEntityTooLarge):
+        return file_too_large_response()
+    return jsonify({'success': False, 'error': f'Processing error: {str(e)}'}), 500
+
+def batch_member(archive, batch, entry, minutes, done, outcome=None, error=None):
+    """ZIP chunks for one finished file of ``batch``, or its failure noted in the manifest"""
+    try:
+        if error is not None:
+            raise error
+        cached_path, meta, cache_hit = outcome
+        try:
+            result = open(cached_path, 'rb')
+        finally:
+            # The open file keeps the data readable
+            os.unlink(cached_path)
+    except Exception as e:
+        logger.error(f"Batch item {entry['file']} failed: {str(e)}")
+        usage_store.refund(batch['user_id'], minutes)
+        del entry['output'], entry['minutes']
+        entry['error'] = str(e) or type(e).__name__
+    else:
+        entry.update(status='ok', method=meta.get('method', 'Enhancement'),
+                     cache='HIT' if cache_hit else 'MISS')
+        if meta.get('encoding'):
+            entry['encoding'] = meta['encoding']
+        for field in ('silence', 'upload'):
+            if meta.get(field):
+                entry[field] = meta[field]
+        with result:
+            yield from archive.add_file(entry['output'], result, os.fstat(result.fileno()).st_size)
+    batch['report']('segments', done=done, total=len(batch['items']))
+
+def batch_manifest(archive, batch):
+    """manifest.json and the end of the archive, once every file has finished"""
+    manifest = batch['manifest']
+    summary = {
+        'succeeded': sum(entry['status'] == 'ok' for entry in manifest),
+        'failed': sum(entry['status'] != 'ok' for entry in manifest),
+        'files': manifest
+    }
+    yield from archive.add_bytes('manifest.json', json.dumps(summary, indent=2).encode('utf-8'))
+    yield from archive.close()
+    batch['report']('ready', succeeded=summary['succeeded'], failed=summary['failed'])
+
+def batch_response(body, batch):
+    return Response(body, mimetype='application/zip', headers={
+        'Content-Disposition': 'attachment; filename=voiceclean_batch.zip',
+        'X-Batch-Files': str(len(batch['items'])),
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/enhance-batch', methods=['POST'])
+def enhance_batch():
+    """Enhance several files concurrently and stream them back as a ZIP.
+
+    Members are written in the order they finish; manifest.json, the last
+    member, lists every upload with its outcome, so one bad file never
+    fails the batch.
+    """
+    try:
+        batch = begin_batch()
+        if not isinstance(batch, dict):
+            return batch
+    except Exception as e:
+        return batch_error_response(e)
+
+    pending = {}
+    for entry, minutes, input_path, content_hash in batch['items']:
+        future = batch_executor.submit(enhance_batch_item, input_path, content_hash, batch['enhancement_type'],
+                                       batch['output_format'], batch['kbps'])
+        pending[future] = (entry, minutes, input_path)
+    remaining = dict(pending)
+
+    def generate():
+        archive = ZipStream()
+        for future in as_completed(pending):
+            entry, minutes, _ = remaining.pop(future)
+            try:
+                outcome, error = future.result(), None
+            except Exception as e:
+                outcome, error = None, e
+            yield from batch_member(archive, batch, entry, minutes, len(pending) - len(remaining), outcome, error)
+        yield from batch_manifest(archive, batch)
+
+    def cancel_unstarted():
+        # Client went away: files that never started are neither enhanced nor charged
+        for future, (entry, minutes, input_path) in remaining.items():
+            if future.cancel():
+                usage_store.refund(batch['user_id'], minutes)
+                os.unlink(input_path)
+        if remaining:
+            batch['report']('failed', error='Batch cancelled')
+
+    response = batch_response(generate(), batch)
+    response.call_on_close(cancel_unstarted)
+    return response
+
+def metrics_authorized():
+    """Ops routes need METRICS_TOKEN as the bearer token, when one is configured"""
+    return not METRICS_TOKEN or request.headers.get('Authorization', '') == f'Bearer {METRICS_TOKEN}'
+
+@app.route('/api/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint for this worker"""
+    if not metrics_authorized():
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profile', methods=['GET', 'DELETE'])
+def profile_dump():
+    """Collapsed stacks of profiled requests, for flamegraph.pl or speedscope"""
+    auth_header = request.headers.get('Authorization', '')
+    if not request_profiler.is_admin(auth_header[7:] if auth_header.startswith('Bearer ') else ''):
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+    if request.method == 'DELETE':
+        request_profiler.reset()
+        return jsonify({'success': True})
+    if request.args.get('format') == 'stats':
+        return jsonify({'success': True, 'profiler': request_profiler.snapshot()})
+    # e.g. ?endpoint=POST enhance_audio keeps one endpoint's stacks
+    return Response(request_profiler.collapsed(request.args.get('endpoint')), mimetype='text/plain')
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """Result cache counters for sizing the cache"""
+    if not metrics_authorized():
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+    return jsonify({'success': True, 'cache': result_cache.snapshot()})
+
+def job_progress_event(job):
+    """A job record as the stage event that describes it"""
+    if job['status'] == 'done':
+        return 'ready', {'method': job.get('method'), 'download_url': f"/api/results/{job['download_id']}"}
+    if job['status'] == 'failed':
+        return 'failed', {'error': job.get('error')}
+    if 'segments_total' in job:
+        return 'segments', {'done': job['segments_done'], 'total': job['segments_total']}
+    return 'queued', {}
+
+def sse_message(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+
+@app.route('/api/progress/<channel_id>')
+def progress_events(channel_id):
+    """Server-sent stage events for an upload (its X-Progress-Id) or a job id.
+
+    Progress ids are unguessable capabilities chosen by the client, like
+    download ids, since EventSource cannot send an Authorization header.
+    """
+    if not CHANNEL_ID.match(channel_id):
+        return jsonify({'success': False, 'error': 'Invalid progress id'}), 400
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('lastEventId') or 0)
+    except ValueError:
+        last_event_id = 0
+
+    # Jobs are also on disk, which covers jobs whose events were swept
+    job = job_store.load(channel_id)
+    last = event_bus.last_event(channel_id)
+    if last is None and job is not None:
+        event, data = job_progress_event(job)
+        event_bus.publish(channel_id, event, **data)
+        last = event_bus.last_event(channel_id)
+    if last is not None and last[1] in TERMINAL_EVENTS and last_event_id >= last[0]:
+        # Already delivered; 204 tells EventSource to stop reconnecting
+        return Response(status=204)
+
+    try:
+        subscription = event_bus.subscribe(channel_id, last_event_id, PROGRESS_HEARTBEAT_SECONDS)
+    except EventBusFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+
+    def generate():
+        yield 'retry: 3000\n\n'
+        for entry in subscription:
+            if entry is not None:
+                yield sse_message(*entry)
+                continue
+            if job is not None:
+                finished = job_store.load(channel_id)
+                if finished and finished['status'] in ('done', 'failed'):
+                    event, data = job_progress_event(finished)
+                    event_bus.publish(channel_id, event, **data)
+            yield ': keep-alive\n\n'
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/upload-chunk', methods=['POST'])
+def upload_chunk():
+    """Receive one chunk of a resumable upload"""
+    try:
+        user_id = request_user_id()
+        if user_id is None:
             return jsonify({'success': False, 'error': 'Authentication required'}), 401
-        
-        if 'audio' not in request.files:
-            return jsonify({'success': False, 'error': 'No audio file provided'}), 400
-        
-        file = request.files['audio']
-        if file.filename == '':
-            return jsonify({'success': False, 'error': 'No file selected'}), 400
-        
-        # Check file size
-        file.seek(0, 2)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > 50 * 1024 * 1024:
-            return jsonify({'success': False, 'error': 'File too large (max 50MB)'}), 413
-        
-        # Enhance audio
-        enhanced_audio, method_used = enhance_with_deepfilter(file, file.filename)
-        
-        if not enhanced_audio:
-            file.seek(0)
-            enhanced_audio = file.read()
-            method_used = "Original Audio"
-        
-        output_filename = f'{os.path.splitext(secure_filename(file.filename))[0]}_enhanced.wav'
-        
-        return send_file(
-            io.BytesIO(enhanced_audio),
-            as_attachment=True,
-            download_name=output_filename,
-            mimetype='audio/wav'
+
+        # Chunks share the request bucket, charged by size so that a whole
+        # upload at the plan limit costs about one request
+        max_bytes = current_plan()['max_upload_mb'] * 1024 * 1024
+        rate_limited = take_request_token(
+            user_id, min(max((request.content_length or 0) / max_bytes, CHUNK_MIN_COST), 1.0))
+        if rate_limited:
+            return rate_limited
+
+        if 'chunk' not in request.files:
+            return jsonify({'success': False, 'error': 'No chunk provided'}), 400
+
+        try:
+            chunk_index = int(request.form.get('chunkIndex', ''))
+            total_chunks = int(request.form.get('totalChunks', ''))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'chunkIndex and totalChunks must be integers'}), 400
+
+        filename = secure_filename(request.form.get('filename', '')) or 'audio.wav'
+        status = upload_store.save_chunk(
+            request.form.get('uploadId', ''),
+            chunk_index,
+            total_chunks,
+            filename,
+            request.files['chunk'].stream.path,
+            owner=user_id,
+            max_bytes=max_bytes
         )
-        
+
+        return jsonify({
+            'success': True,
+            'upload_id': status['upload_id'],
+            'received_chunks': status['received_chunks'],
+            'total_chunks': status['total_chunks'],
+            'missing_chunks': status['missing_chunks'],
+            'ready_for_processing': status['complete']
+        })
+
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except RequestEntityTooLarge:
+        return file_too_large_response()
+    except Exception as e:
+        logger.error(f"Chunk upload error: {str(e)}")
+        return jsonify({'success': False, 'error': f'Upload error: {str(e)}'}), 500
+
+@app.route('/api/upload-chunk/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Report which chunks are still missing so a client can resume"""
+    user_id = request_user_id()
+    if user_id is None:
+        return jsonify({'success': False, 'error': 'Authentication required'}), 401
+    try:
+        status = upload_store.status(upload_id, user_id)
+        return jsonify({
+            'success': True,
+            'upload_id': status['upload_id'],
+            'received_chunks': status['received_chunks'],
+            'total_chunks': status['total_chunks'],
+            'missing_chunks': status['missing_chunks'],
+            'ready_for_processing': status['complete']
+        })
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+
+@app.route('/api/enhance-chunked', methods=['POST'])
+def enhance_chunked():
+    """Enhance a fully uploaded chunked file as parallel segments"""
+    try:
+        user_id = request_user_id()
+        if user_id is None:
+            return jsonify({'success': False, 'error': 'Authentication required'}), 401
+
+        rate_limited = take_request_token(user_id)
+        if rate_limited:
+            return rate_limited
+
+        try:
+            output_format, kbps = requested_output()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        data = request.get_json(silent=True) or {}
+        upload_id = data.get('uploadId', '')
+        # Held for the whole enhancement: a second finalise gets a 409, expiry waits
+        with upload_store.busy(upload_id, user_id):
+            input_path = upload_store.assemble(upload_id, user_id)
+            filename = secure_filename(data.get('filename', '')) or os.path.basename(input_path)
+            report = progress_reporter()
+            report('spooled', bytes=os.path.getsize(input_path))
+
+            # The assembled upload is kept on rejection so it can be retried after an upgrade
+            try:
+                minutes = audio_minutes(input_path)
+            except ProbeError:
+                upload_store.discard(upload_id)
+                return jsonify({'success': False, 'error': 'Could not read audio duration'}), 415
+            over_quota = reserve_usage(user_id, minutes)
+            if over_quota:
+                return over_quota
+
+            output_fd, output_path = tempfile.mkstemp(suffix=OUTPUT_FORMATS[output_format][3],
+                                                      dir=app.config['UPLOAD_FOLDER'])
+            os.close(output_fd)
+            report('queued')
+            tally = []
+            try:
+                method_used, stats, encoding = enhance_long_file(
+                    input_path, output_path, output_format=output_format, kbps=kbps, report=report, tally=tally,
+                    progress=lambda done, total: report('segments', done=done, total=total),
+                    slot=backend_slots(current_plan()['max_queue_seconds']))
+            except AdmissionRejected as e:
+                # The first segment never got a slot, so the assembled upload is kept for the retry
+                os.unlink(output_path)
+                usage_store.refund(user_id, minutes)
+                return admission_rejected_response(e)
+            except RuntimeError as e:
+                logger.error(f"Enhancement error: {str(e)}")
+                usage_store.refund(user_id, minutes)
+                os.unlink(output_path)
+                # The original is sent back as it was uploaded
+                response = deliver_original(input_path, filename, sniff_file(input_path), move=True)
+                upload_store.discard(upload_id)
+                return response
+            except Exception:
+                usage_store.refund(user_id, minutes)
+                upload_store.discard(upload_id)
+                raise
+            upload_store.discard(upload_id)
+
+            headers = encoding_headers(output_format, encoding)
+            if stats:
+                enhanced = stats['segments'] - stats['failed_segments']
+                headers['X-Enhancement-Segments'] = f"{enhanced}/{stats['segments']}"
+            if tally:
+                headers.update(tally_headers(silence_report(tally), upload_report(tally)))
+            return deliver_result(output_path, output_filename(filename, output_format), method_used,
+                                  mimetype=OUTPUT_FORMATS[output_format][2], move=True, headers=headers)
+
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Processing error: {str(e)}'}), 500
+
+def job_status_payload(job):
+    payload = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'progress': job.get('progress', 0.0),
+        'filename': job['filename'],
+        'attempts': job.get('attempts', 0)
+    }
+    if 'segments_total' in job:
+        payload['segments_done'] = job['segments_done']
+        payload['segments_total'] = job['segments_total']
+    if job['status'] == 'done':
+        payload['method'] = job.get('method')
+        payload['result_url'] = f"/api/results/{job['download_id']}"
+        if job.get('encoding'):
+            payload['encoding'] = job['encoding']
+        for field in ('silence', 'upload'):
+            if job.get(field):
+                payload[field] = job[field]
+    if job['status'] == 'failed':
+        payload['error'] = job.get('error')
+    return payload
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue an enhancement and return immediately with a job id"""
+    try:
+        user_id = request_user_id()
+        if user_id is None:
+            return jsonify({'success': False, 'error': 'Authentication required'}), 401
+
+        rate_limited = take_request_token(user_id)
+        if rate_limited:
+            return rate_limited
+
+        params = {'type': request.form.get('type', 'isolation'), 'user_id': user_id}
+        try:
+            params['format'], params['bitrate'] = requested_output()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        if 'audio' in request.files:
+            file = request.files['audio']
+            if file.filename == '':
+                return jsonify({'success': False, 'error': 'No file selected'}), 400
+            filename = secure_filename(file.filename) or 'audio.wav'
+            input_path, upload_id = file.stream.path, None
+        else:
+            data = request.get_json(silent=True) or {}
+            upload_id = data.get('uploadId')
+            if not upload_id:
+                return jsonify({'success': False, 'error': 'No audio file or uploadId provided'}), 400
+            input_path = upload_store.assemble(upload_id, user_id)
+            filename = secure_filename(data.get('filename', '')) or os.path.basename(input_path)
+
+        progress_reporter()('spooled', bytes=os.path.getsize(input_path))
+        if 'progress' in g:
+            params['progress'] = g.progress
+
+        try:
+            params['minutes'] = audio_minutes(input_path)
+        except ProbeError:
+            return jsonify({'success': False, 'error': 'Could not read audio duration'}), 415
+        over_quota = reserve_usage(user_id, params['minutes'])
+        if over_quota:
+            return over_quota
+
+        try:
+            if upload_id:
+                job = job_queue.submit(input_path, filename, params, move=True)
+                upload_store.discard(upload_id)
+            else:
+                job = job_queue.submit(input_path, filename, params)
+        except Exception:
+            usage_store.refund(user_id, params['minutes'])
+            raise
+
+        event_bus.publish(job['id'], 'queued')
+        logger.info(f"📥 Queued job {job['id']} for {job['filename']}")
+        payload = job_status_payload(job)
+        payload['success'] = True
+        payload['status_url'] = f"/api/jobs/{job['id']}"
+        return jsonify(payload), 202
+
+    except UploadError as e:
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except RequestEntityTooLarge:
+        return file_too_large_response()
     except Exception as e:
         return jsonify({'success': False, 'error': f'Processing error: {str(e)}'}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status and progress; includes result_url when finished"""
+    job = job_store.load(secure_filename(job_id))
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    payload = job_status_payload(job)
+    payload['success'] = True
+    return jsonify(payload)
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Download the enhanced audio of a finished job"""
+    job = job_store.load(secure_filename(job_id))
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'success': False, 'error': f"Job is {job['status']}"}), 409
+
+    return send_result(job['download_id'])
+
+@app.route('/api/results/<download_id>', methods=['GET'])
+def get_result(download_id):
+    """Serve a stored result inline (seekable via Range) or as a download"""
+    return send_result(download_id, as_attachment=request.args.get('download') == '1')
+
+# benchmarks/import_time.py breaks this down per import
+STARTUP_SECONDS = round(time.perf_counter() - STARTED_AT, 3)
+logger.info(f"🚀 App module loaded in {STARTUP_SECONDS * 1000:.0f}ms")
+
 if __name__ == '__main__':
     print("🚀 VoiceClean AI Starting - Login/Signup buttons should be visible!")
     app.run(debug=True)
\ No newline at end of file
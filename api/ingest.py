@@ -0,0 +1,127 @@
+import os
+import hashlib
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Room for the multipart boundaries and small form fields around the file
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+# Mimetype and extension of each sniffed upload format, for sending an upload back as it came
+UPLOAD_FORMATS = {
+    'wav': ('audio/wav', '.wav'),
+    'flac': ('audio/flac', '.flac'),
+    'ogg': ('audio/ogg', '.ogg'),
+    'mp3': ('audio/mpeg', '.mp3'),
+    'm4a': ('audio/mp4', '.m4a'),
+    'webm': ('audio/webm', '.webm'),
+    'wma': ('audio/x-ms-wma', '.wma'),
+    'amr': ('audio/amr', '.amr'),
+    'aac': ('audio/aac', '.aac'),
+}
+
+
+def sniff_format(head):
+    """Identify the audio container from its first bytes; None if unknown"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[:3] == b'ID3':
+        return 'mp3'
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'
+    if head[:4] == b'\x30\x26\xb2\x75':
+        return 'wma'
+    if head[:5] == b'#!AMR':
+        return 'amr'
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0:
+        # MPEG frame sync; layer bits 00 mean an ADTS AAC stream
+        return 'aac' if head[1] & 0x06 == 0 else 'mp3'
+    return None
+
+
+def sniff_file(path):
+    """``sniff_format`` for a file already on disk"""
+    with open(path, 'rb') as f:
+        return sniff_format(f.read(SpoolFile.SNIFF_BYTES))
+
+
+class SpoolFile:
+    """Write-once upload spool that hashes, sniffs and enforces a size limit.
+
+    Werkzeug's multipart parser writes the file part into this object as it
+    streams off the socket, so the bytes are touched exactly once: they land
+    on disk, feed the SHA-256, and the parse aborts with 413 as soon as the
+    limit is crossed instead of after the whole body has been read.
+    """
+
+    SNIFF_BYTES = 64
+
+    def __init__(self, limit, directory, suffix='.upload'):
+        self.limit = limit
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._head = b''
+        fd, self.path = tempfile.mkstemp(suffix=suffix, dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            self.close()
+            raise RequestEntityTooLarge(f'File too large (max {self.limit // (1024 * 1024)}MB)')
+        if len(self._head) < self.SNIFF_BYTES:
+            self._head += bytes(data[:self.SNIFF_BYTES - len(self._head)])
+        self._digest.update(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    @property
+    def format(self):
+        return sniff_format(self._head)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush and friends go to the underlying file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class StreamingRequest(Request):
+    """Request that spools uploaded files through ``SpoolFile``.
+
+    Subclasses override ``upload_limit()`` to apply a per-request limit
+    (for example from the caller's plan); it is also used as the request's
+    ``max_content_length`` so oversized bodies are refused before reading.
+    """
+
+    spool_directory = tempfile.gettempdir()
+
+    def upload_limit(self):
+        return None
+
+    @property
+    def max_content_length(self):
+        limit = self.upload_limit()
+        return limit + FORM_OVERHEAD_BYTES if limit is not None else None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        extension = os.path.splitext(filename or '')[1]
+        suffix = extension if extension[1:].isalnum() and len(extension) <= 6 else '.upload'
+        return SpoolFile(self.upload_limit(), self.spool_directory, suffix=suffix)
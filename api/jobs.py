@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    """Durable job records and queue kept as plain files.
+
+    ``records/<id>.json`` holds the job state. A queued job has a marker in
+    ``queue/`` named so that lexical order is submission order; a worker
+    claims it by renaming the marker into ``claimed/``, which is atomic and
+    therefore safe across threads and processes sharing the directory. The
+    claimed marker's mtime is the heartbeat.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        for name in ('records', 'queue', 'claimed', 'inputs', 'results'):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    def _record_path(self, job_id):
+        return os.path.join(self.root, 'records', f'{job_id}.json')
+
+    def input_path(self, job_id, extension):
+        return os.path.join(self.root, 'inputs', f'{job_id}{extension}')
+
+    def result_path(self, job_id):
+        return os.path.join(self.root, 'results', f'{job_id}.wav')
+
+    def load(self, job_id):
+        try:
+            with open(self._record_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, job):
+        job['updated_at'] = time.time()
+        fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'records'), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job, f)
+        os.replace(temp_path, self._record_path(job['id']))
+
+    def update(self, job_id, **fields):
+        job = self.load(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        self.save(job)
+        return job
+
+    def enqueue(self, job_id):
+        marker = f'{time.time_ns():020d}-{job_id}'
+        open(os.path.join(self.root, 'queue', marker), 'w').close()
+
+    def claim_next(self):
+        """Atomically take the oldest queued job; returns its id or None"""
+        queue_dir = os.path.join(self.root, 'queue')
+        for marker in sorted(os.listdir(queue_dir)):
+            job_id = marker.split('-', 1)[1]
+            try:
+                os.rename(os.path.join(queue_dir, marker), os.path.join(self.root, 'claimed', job_id))
+            except FileNotFoundError:
+                # Claimed by another worker first
+                continue
+            return job_id
+        return None
+
+    def heartbeat(self, job_id):
+        try:
+            os.utime(os.path.join(self.root, 'claimed', job_id))
+        except FileNotFoundError:
+            pass
+
+    def release(self, job_id):
+        """Drop the claim on ``job_id``; False if another worker already had"""
+        try:
+            os.unlink(os.path.join(self.root, 'claimed', job_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def purge_finished(self, retention):
+        """Delete finished jobs (record and files) older than ``retention``"""
+        records_dir = os.path.join(self.root, 'records')
+        now = time.time()
+        purged = 0
+        for name in os.listdir(records_dir):
+            if not name.endswith('.json'):
+                continue
+            job = self.load(name[:-5])
+            if not job or job['status'] not in ('done', 'failed'):
+                continue
+            if now - job.get('finished_at', now) < retention:
+                continue
+            for path in (job.get('result_path'), job.get('input_path'), self._record_path(job['id'])):
+                if path and os.path.exists(path):
+                    os.unlink(path)
+            purged += 1
+        return purged
+
+    def stale_claims(self, stale_after):
+        claimed_dir = os.path.join(self.root, 'claimed')
+        now = time.time()
+        stale = []
+        for job_id in os.listdir(claimed_dir):
+            try:
+                if now - os.path.getmtime(os.path.join(claimed_dir, job_id)) > stale_after:
+                    stale.append(job_id)
+            except FileNotFoundError:
+                continue
+        return stale
+
+
+class JobQueue:
+    """Bounded pool of background workers draining a ``JobStore``.
+
+    ``handler(job, progress)`` does the work; it receives the job record and
+    a ``progress(done, total)`` callback and returns a dict merged into the
+    finished record. Jobs whose worker stops heartbeating (for example after
+    the process died) are put back on the queue up to ``max_attempts``.
+    ``on_failure(job, error)`` runs once for every job that ends failed,
+    whether its handler raised or it was abandoned.
+    """
+
+    def __init__(self, store, handler, workers=2, poll_interval=1.0, stale_after=120, max_attempts=3,
+                 retention=86400, on_failure=None):
+        self.store = store
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._wakeup = threading.Event()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True).start()
+        threading.Thread(target=self._maintain, name='job-maintenance', daemon=True).start()
+        logger.info(f"👷 Started {self.workers} job workers")
+
+    def submit(self, source_path, filename, params=None, move=False):
+        """Queue ``source_path`` for processing and return the job record"""
+        job_id = uuid.uuid4().hex
+        input_path = self.store.input_path(job_id, os.path.splitext(filename)[1] or '.wav')
+        if move:
+            shutil.move(source_path, input_path)
+        else:
+            try:
+                os.link(source_path, input_path)
+            except OSError:
+                shutil.copyfile(source_path, input_path)
+
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'filename': filename,
+            'params': params or {},
+            'input_path': input_path,
+            'progress': 0.0,
+            'attempts': 0,
+            'created_at': time.time()
+        }
+        self.store.save(job)
+        self.store.enqueue(job_id)
+        self._wakeup.set()
+        return job
+
+    def _work(self):
+        while True:
+            job_id = self.store.claim_next()
+            if job_id is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job_id)
+
+    def _run(self, job_id):
+        job = self.store.load(job_id)
+        if job is None:
+            self.store.release(job_id)
+            return
+
+        job = self.store.update(job_id, status='running', attempts=job.get('attempts', 0) + 1,
+                                started_at=time.time())
+        with self._lock:
+            self._running.add(job_id)
+
+        def progress(done, total):
+            self.store.heartbeat(job_id)
+            self.store.update(job_id, progress=round(done / total, 4) if total else 0.0,
+                              segments_done=done, segments_total=total)
+
+        try:
+            result = self.handler(job, progress) or {}
+            self.store.update(job_id, status='done', progress=1.0, finished_at=time.time(), **result)
+            logger.info(f"✅ Job {job_id} finished")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            self._fail(job_id, str(e))
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+            self.store.release(job_id)
+
+    def _fail(self, job_id, error):
+        job = self.store.update(job_id, status='failed', error=error, finished_at=time.time())
+        if job is not None and self.on_failure is not None:
+            try:
+                self.on_failure(job, error)
+            except Exception as e:
+                logger.error(f"Cleanup of failed job {job_id} failed: {str(e)}")
+
+    def _maintain(self):
+        interval = max(self.stale_after / 4, 1)
+        while True:
+            time.sleep(interval)
+            self._sweep()
+
+    def _sweep(self):
+        """Heartbeat our own running jobs, requeue abandoned ones, purge old ones"""
+        self.store.purge_finished(self.retention)
+        with self._lock:
+            running = list(self._running)
+        for job_id in running:
+            self.store.heartbeat(job_id)
+
+        for job_id in self.store.stale_claims(self.stale_after):
+            # Whoever drops the claim handles the job, so no two workers do
+            if job_id in running or not self.store.release(job_id):
+                continue
+            job = self.store.load(job_id)
+            if job is None:
+                continue
+            if job.get('attempts', 0) >= self.max_attempts:
+                logger.error(f"Job {job_id} abandoned after {job['attempts']} attempts")
+                self._fail(job_id, 'Worker stopped responding')
+            else:
+                self.store.update(job_id, status='queued')
+                self.store.enqueue(job_id)
+                self._wakeup.set()
+                logger.warning(f"⚠️ Requeued job {job_id} from a stopped worker")
@@ -0,0 +1,29 @@
+import threading
+
+
+class Lazy:
+    """Proxy for an object that ``factory`` builds on first attribute access.
+
+    Lets the app module define its enhancement objects without importing
+    numpy, soundfile or gradio_client at cold start: the factory does
+    those imports the first time a request actually needs the object.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
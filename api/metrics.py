@@ -0,0 +1,184 @@
+import os
+import time
+import resource
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a fast cache hit to a long segmented job
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_labels(self.labelnames, key)} {value}' for key, value in values]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram; one observe is a bisect and three adds"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    """All metrics of this process, rendered in the Prometheus text format.
+
+    Each worker process keeps its own registry, and a scrape sees the
+    worker that answered it; run one worker per scrape target, or sum the
+    workers' series in the query.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """``collect()`` returns gauges computed at scrape time: [(name, help, value)]"""
+        self.collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            for name, documentation, value in collect():
+                lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def process_metrics():
+    """Resident memory, CPU time and open files of this worker"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    metrics = [
+        ('process_cpu_seconds_total', 'User and system CPU time', usage.ru_utime + usage.ru_stime),
+        ('process_max_resident_memory_bytes', 'Peak resident set size', usage.ru_maxrss * 1024),
+    ]
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        metrics.append(('process_resident_memory_bytes', 'Resident set size', pages * os.sysconf('SC_PAGE_SIZE')))
+        metrics.append(('process_open_fds', 'Open file descriptors', len(os.listdir('/proc/self/fd'))))
+    except (OSError, ValueError):
+        pass
+    return metrics
+
+
+registry = Registry()
+registry.add_collector(process_metrics)
+
+# Pipeline instrumentation shared by the app and the engines
+stage_seconds = registry.register(Histogram(
+    'voiceclean_stage_seconds', 'Time spent in each enhancement pipeline stage', ['stage']))
+request_seconds = registry.register(Histogram(
+    'voiceclean_request_seconds', 'End-to-end request handling time', ['endpoint', 'status']))
+active_requests = registry.register(Gauge(
+    'voiceclean_active_requests', 'Requests currently being handled', ['endpoint']))
+bytes_in = registry.register(Counter(
+    'voiceclean_bytes_in_total', 'Request body bytes received', ['endpoint']))
+bytes_out = registry.register(Counter(
+    'voiceclean_bytes_out_total', 'Response body bytes sent', ['endpoint']))
+backend_calls = registry.register(Counter(
+    'voiceclean_backend_calls_total', 'Enhancement backend calls by outcome', ['backend', 'outcome']))
+fallbacks = registry.register(Counter(
+    'voiceclean_fallbacks_total', 'Requests served by a fallback path', ['to']))
+cache_lookups = registry.register(Counter(
+    'voiceclean_cache_lookups_total', 'Result cache lookups', ['result']))
+compression_ratio = registry.register(Histogram(
+    'voiceclean_output_compression_ratio', 'Size of a 16-bit WAV over the size of the encoded result', ['format'],
+    buckets=(1, 1.5, 2, 3, 4, 6, 8, 12, 16, 24, 32)))
+vad_seconds = registry.register(Counter(
+    'voiceclean_vad_audio_seconds_total', 'Audio seconds sent to a backend or skipped as silence', ['kind']))
+upload_bytes = registry.register(Counter(
+    'voiceclean_backend_upload_bytes_total', 'Input bytes before and after upload preprocessing', ['kind']))
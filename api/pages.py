@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import threading
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first; identity is always available
+ENCODINGS = ('br', 'gzip', 'identity')
+
+
+def compress(body, encoding):
+    if encoding == 'gzip':
+        # mtime=0 keeps the bytes, and so the ETag, stable across restarts
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(body, quality=11, mode=brotli.MODE_TEXT)
+    return None
+
+
+class PageCache:
+    """Pages rendered once and served from memory with strong validators.
+
+    Each page is stored as identity, gzip and (with the brotli package)
+    brotli bytes, compressed at the highest level when it is first
+    rendered: on its first request, or at startup via ``prerender``. Every
+    variant has its own strong ETag derived from the page's content hash,
+    so a conditional request is answered with a 304 before any body is
+    touched, and a deploy that changes a page changes its ETag.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.pages = {}
+        self.renderers = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, render):
+        """``render()`` returns the page's HTML; it runs at most once"""
+        self.renderers[name] = render
+
+    def prerender(self):
+        for name in self.renderers:
+            self._page(name)
+
+    def _page(self, name):
+        page = self.pages.get(name)
+        if page is None:
+            with self._lock:
+                if name not in self.pages:
+                    self.add(name, self.renderers[name]())
+                page = self.pages[name]
+        return page
+
+    def add(self, name, html, mimetype='text/html'):
+        body = html.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {'identity': (body, f'"{digest}"')}
+        for encoding in ('br', 'gzip'):
+            compressed = compress(body, encoding)
+            if compressed is not None and len(compressed) < len(body):
+                variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+        self.pages[name] = {'variants': variants, 'mimetype': mimetype, 'digest': digest}
+        return digest
+
+    def response(self, name, request):
+        page = self._page(name)
+        variants = page['variants']
+        encoding = request.accept_encodings.best_match([e for e in ENCODINGS if e in variants]) or 'identity'
+        body, etag = variants[encoding]
+
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=page['mimetype'])
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = f'public, max-age={self.max_age}'
+        return response
+
+    def snapshot(self):
+        return {
+            name: {encoding: len(body) for encoding, (body, _) in page['variants'].items()}
+            for name, page in self.pages.items()
+        }
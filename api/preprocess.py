@@ -0,0 +1,128 @@
+import os
+import math
+import logging
+import tempfile
+
+import numpy as np
+
+from audio_io import audio_info, iter_blocks, BlockWriter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# DeepFilterNet2 runs on mono 48 kHz; anything above that is resampled away
+MODEL_SAMPLERATE = 48000
+
+
+class PolyphaseResampler:
+    """Streaming rational resampler (``to_rate / from_rate`` reduced to ``up / down``).
+
+    The Kaiser-windowed sinc low-pass is split into ``up`` phases, so each
+    output sample is one short dot product against the input instead of a
+    pass over a zero-stuffed signal; a whole block of outputs is computed
+    at once from a strided view of the input. Feed blocks to ``process``
+    and finish with ``final=True``; the output has
+    ``round(frames * to_rate / from_rate)`` samples, aligned with the input.
+    """
+
+    def __init__(self, from_rate, to_rate, half_width=16, beta=8.0):
+        common = math.gcd(int(from_rate), int(to_rate))
+        self.up, self.down = int(to_rate) // common, int(from_rate) // common
+        length = 2 * half_width * max(self.up, self.down) + 1
+        cutoff = 1.0 / max(self.up, self.down)
+        t = np.arange(length) - (length - 1) / 2
+        h = cutoff * self.up * np.sinc(cutoff * t) * np.kaiser(length, beta)
+        self.taps = -(-length // self.up)
+        h = np.concatenate([h, np.zeros(self.taps * self.up - length)])
+        # phases[p, j] weights input (i - taps + 1 + j) for outputs of phase p
+        self.phases = h.reshape(self.taps, self.up).T[:, ::-1].astype(np.float32)
+        self.delay = (length - 1) // 2
+        self._buffer = np.zeros(self.taps - 1, dtype=np.float32)
+        self._offset = -(self.taps - 1)
+        self._received = 0
+        self._next = 0
+
+    def process(self, samples, final=False):
+        """Resample a 1-D block; returns every output sample its input completes"""
+        self._buffer = np.concatenate([self._buffer, np.asarray(samples, dtype=np.float32)])
+        self._received += len(samples)
+        if final:
+            end = int(round(self._received * self.up / self.down))
+            needed = ((end - 1) * self.down + self.delay) // self.up + 1 - self._offset
+            if needed > len(self._buffer):
+                self._buffer = np.concatenate([self._buffer, np.zeros(needed - len(self._buffer), np.float32)])
+        else:
+            end = max(-(-(self._received * self.up - self.delay) // self.down), self._next)
+        if end <= self._next:
+            return np.zeros(0, dtype=np.float32)
+
+        positions = np.arange(self._next, end) * self.down + self.delay
+        starts = positions // self.up - self._offset - self.taps + 1
+        windows = np.lib.stride_tricks.sliding_window_view(self._buffer, self.taps)
+        output = np.einsum('nk,nk->n', windows[starts], self.phases[positions % self.up])
+        self._next = end
+
+        keep = (end * self.down + self.delay) // self.up - self._offset - self.taps + 1
+        if keep > 0:
+            self._buffer = self._buffer[keep:]
+            self._offset += keep
+        return output
+
+
+class UploadPreparer:
+    """Shrink audio before it is uploaded to the remote model.
+
+    Inputs are downmixed to mono, resampled to at most ``max_samplerate``
+    and written as 16-bit WAV, block by block. Files the compact copy would
+    not make smaller (already mono at a low rate, or compressed) are sent
+    as they are. ``restore`` puts the original channel count back on the
+    model's mono result.
+    """
+
+    def __init__(self, max_samplerate=MODEL_SAMPLERATE, work_dir=None):
+        self.max_samplerate = max_samplerate
+        self.work_dir = work_dir
+
+    def prepare(self, input_path):
+        """Returns ``(upload_path, info, stats)``; ``upload_path`` is a temp file unless it is ``input_path``"""
+        original_bytes = os.path.getsize(input_path)
+        info = audio_info(input_path)
+        rate = min(info.samplerate, self.max_samplerate)
+        compact_bytes = 44 + int(round(info.frames * rate / info.samplerate)) * 2
+        if compact_bytes >= original_bytes:
+            return input_path, info, {'original_bytes': original_bytes, 'sent_bytes': original_bytes}
+
+        fd, upload_path = tempfile.mkstemp(suffix='_upload.wav', dir=self.work_dir or os.path.dirname(input_path))
+        os.close(fd)
+        resampler = PolyphaseResampler(info.samplerate, rate) if rate != info.samplerate else None
+        try:
+            with metrics.stage_seconds.time(stage='preprocess'):
+                with BlockWriter(upload_path, rate, 1) as writer:
+                    for block in iter_blocks(input_path, info=info):
+                        mono = block.mean(axis=1, dtype=np.float32)
+                        writer.write((resampler.process(mono) if resampler else mono)[:, np.newaxis])
+                    if resampler:
+                        writer.write(resampler.process(np.zeros(0, np.float32), final=True)[:, np.newaxis])
+        except Exception:
+            os.unlink(upload_path)
+            raise
+        stats = {'original_bytes': original_bytes, 'sent_bytes': os.path.getsize(upload_path)}
+        logger.info(f"📦 Upload shrunk from {original_bytes / 1e6:.2f} MB to {stats['sent_bytes'] / 1e6:.2f} MB "
+                    f"({info.channels} ch {info.samplerate} Hz → mono {rate} Hz 16-bit)")
+        return upload_path, info, stats
+
+    @staticmethod
+    def restore(result_path, channels):
+        """Copy a mono result onto ``channels`` channels, in place"""
+        result = audio_info(result_path)
+        if channels <= 1 or result.channels != 1:
+            return
+        restored_path = result_path + '.restored.wav'
+        try:
+            with BlockWriter(restored_path, result.samplerate, channels) as writer:
+                for block in iter_blocks(result_path, info=result):
+                    writer.write(np.repeat(block, channels, axis=1))
+            os.replace(restored_path, result_path)
+        finally:
+            if os.path.exists(restored_path):
+                os.unlink(restored_path)
@@ -0,0 +1,337 @@
+import os
+import struct
+import logging
+
+from ingest import sniff_format
+
+logger = logging.getLogger(__name__)
+
+# MPEG audio header tables, indexed [version][layer]
+MPEG_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MPEG_SAMPLERATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+
+# How far into an MP3 to look for the first frame, past junk and tags
+MP3_SYNC_SEARCH_BYTES = 64 * 1024
+# How far back from the end of an Ogg file to look for the last page
+OGG_TAIL_BYTES = 64 * 1024
+
+# Highest bitrates real streams reach (lossless: 96 kHz/24-bit stereo plus
+# framing). A header claiming less time than the file's bytes take at
+# these rates is not believed: ffmpeg plays the frames, not the header
+LOSSLESS_MAX_KBPS = 5000
+VORBIS_MAX_KBPS = 640
+OPUS_MAX_KBPS = 512
+AAC_MAX_KBPS = 640
+MP4_CODEC_MAX_KBPS = {b'mp4a': AAC_MAX_KBPS, b'Opus': OPUS_MAX_KBPS}
+
+# WAV fmt format tags that are plain samples
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class ProbeError(Exception):
+    """Raised when a file's duration cannot be read from its headers"""
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    return f.read(size)
+
+
+def _wav_duration(f, file_size):
+    header = f.read(12)
+    if len(header) < 12 or header[:4] not in (b'RIFF', b'RF64') or header[8:12] != b'WAVE':
+        raise ProbeError('Not a RIFF/WAVE file')
+
+    fmt = ds64_data_size = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ProbeError('WAV has no data chunk')
+        chunk_id, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+        if chunk_id == b'ds64':
+            body = f.read(size)
+            ds64_data_size = struct.unpack('<Q', body[8:16])[0]
+            f.seek(size % 2, os.SEEK_CUR)
+        elif chunk_id == b'fmt ':
+            fmt = f.read(size)
+            if len(fmt) < 16:
+                raise ProbeError('Truncated fmt chunk')
+            f.seek(size % 2, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if ds64_data_size is not None and size == 0xFFFFFFFF:
+                size = ds64_data_size
+            # Streamed writers leave the size at 0 or 0xFFFFFFFF
+            data_size = min(size, file_size - f.tell()) if size not in (0, 0xFFFFFFFF) else file_size - f.tell()
+            break
+        else:
+            f.seek(size + size % 2, os.SEEK_CUR)
+
+    if fmt is None:
+        raise ProbeError('WAV has no fmt chunk')
+    format_tag, channels, samplerate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        format_tag = struct.unpack('<H', fmt[24:26])[0]
+    if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        # ADPCM, GSM and friends: byte_rate is only advisory, so let the decoder say
+        raise ProbeError(f'Compressed WAV (format {format_tag:#06x})')
+    # Billing must follow what the decoder plays, which is samplerate and
+    # block_align; the advisory byte_rate only has to agree with them
+    if not samplerate or not channels or block_align != channels * ((bits + 7) // 8):
+        raise ProbeError('WAV fmt chunk is inconsistent')
+    if byte_rate != samplerate * block_align:
+        raise ProbeError('WAV byte rate does not match its sample rate and block size')
+    return data_size / (samplerate * block_align)
+
+
+def _shortest(audio_bytes, max_kbps):
+    """Least time ``audio_bytes`` can take to play at ``max_kbps``"""
+    return max(audio_bytes, 0) * 8 / (max_kbps * 1000)
+
+
+def _skip_id3(f):
+    """Offset of the first byte after any ID3v2 tag"""
+    header = _read_at(f, 0, 10)
+    if header[:3] != b'ID3' or len(header) < 10:
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _flac_duration(f, file_size):
+    offset = _skip_id3(f)
+    if _read_at(f, offset, 4) != b'fLaC':
+        raise ProbeError('Not a FLAC file')
+    offset += 4
+    duration = None
+    while True:
+        block_header = _read_at(f, offset, 4)
+        if len(block_header) < 4:
+            raise ProbeError('Truncated FLAC metadata')
+        kind, size = block_header[0] & 0x7F, int.from_bytes(block_header[1:4], 'big')
+        # STREAMINFO is always the first metadata block
+        if duration is None:
+            if kind != 0:
+                raise ProbeError('FLAC has no STREAMINFO')
+            info = f.read(34)
+            if len(info) < 34:
+                raise ProbeError('Truncated STREAMINFO')
+            packed = int.from_bytes(info[10:18], 'big')
+            samplerate = packed >> 44
+            total_samples = packed & 0xFFFFFFFFF
+            if not samplerate or not total_samples:
+                raise ProbeError('FLAC STREAMINFO has no sample count')
+            duration = total_samples / samplerate
+        offset += 4 + size
+        if block_header[0] & 0x80:
+            break
+    # Frames start after the metadata (which may hold cover art)
+    return max(duration, _shortest(file_size - offset, LOSSLESS_MAX_KBPS))
+
+
+def _parse_mpeg_header(header):
+    """(version, layer, bitrate_kbps, samplerate, padding, mono) or None"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x03
+    layer_bits = (header[1] >> 1) & 0x03
+    bitrate_index = header[2] >> 4
+    samplerate_index = (header[2] >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or samplerate_index == 3:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}[version_bits]
+    layer = 4 - layer_bits
+    bitrate = MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index]
+    samplerate = MPEG_SAMPLERATES[version][samplerate_index]
+    return version, layer, bitrate, samplerate, (header[2] >> 1) & 0x01, header[3] >> 6 == 3
+
+
+def _mpeg_frame_length(version, layer, bitrate, samplerate, padding):
+    if layer == 1:
+        return (12 * bitrate * 1000 // samplerate + padding) * 4
+    if layer == 3 and version != 1:
+        return 72 * bitrate * 1000 // samplerate + padding
+    return 144 * bitrate * 1000 // samplerate + padding
+
+
+def _mp3_duration(f, file_size):
+    start = _skip_id3(f)
+    data = _read_at(f, start, MP3_SYNC_SEARCH_BYTES)
+
+    # The first sync word is only trusted if the next frame follows where it should
+    position = 0
+    header = None
+    while position < len(data) - 4:
+        position = data.find(b'\xff', position)
+        if position < 0 or position > len(data) - 4:
+            break
+        header = _parse_mpeg_header(data[position:position + 4])
+        if header:
+            following = position + _mpeg_frame_length(*header[:5])
+            if following + 4 > len(data) or _parse_mpeg_header(data[following:following + 4]):
+                break
+        header = None
+        position += 1
+    if header is None:
+        raise ProbeError('No MPEG audio frame found')
+
+    version, layer, bitrate, samplerate, padding, mono = header
+    samples_per_frame = 384 if layer == 1 else (1152 if layer == 2 or version == 1 else 576)
+    frame = data[position:position + _mpeg_frame_length(version, layer, bitrate, samplerate, padding)]
+
+    audio_bytes = file_size - start - position
+    if file_size >= 128 and _read_at(f, file_size - 128, 3) == b'TAG':
+        audio_bytes -= 128
+    # A frame count cannot claim less time than the bytes take at the top bitrate
+    max_bitrate = MPEG_BITRATES[(1 if version == 1 else 2, layer)][-1]
+    shortest = audio_bytes * 8 / (max_bitrate * 1000)
+
+    # VBR files carry a frame count in a Xing/Info or VBRI header in the first frame
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    xing = frame[4 + side_info:4 + side_info + 12]
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 0x01:
+        frames = struct.unpack('>I', xing[8:12])[0]
+        return max(frames * samples_per_frame / samplerate, shortest)
+    vbri = frame[36:36 + 18]
+    if vbri[:4] == b'VBRI':
+        frames = struct.unpack('>I', vbri[14:18])[0]
+        return max(frames * samples_per_frame / samplerate, shortest)
+
+    # Otherwise assume constant bitrate over the audio bytes
+    return audio_bytes * 8 / (bitrate * 1000)
+
+
+def _ogg_duration(f, file_size):
+    first_page = _read_at(f, 0, 27 + 255)
+    if first_page[:4] != b'OggS' or len(first_page) < 27:
+        raise ProbeError('Not an Ogg file')
+    serial = first_page[14:18]
+    segments = first_page[26]
+    packet = _read_at(f, 27 + segments, 64)
+
+    pre_skip = 0
+    if packet[:7] == b'\x01vorbis':
+        samplerate = struct.unpack('<I', packet[12:16])[0]
+        max_kbps = VORBIS_MAX_KBPS
+    elif packet[:8] == b'OpusHead':
+        # Opus granule positions always count 48 kHz samples
+        samplerate = 48000
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+        max_kbps = OPUS_MAX_KBPS
+    elif packet[:5] == b'\x7fFLAC':
+        samplerate = int.from_bytes(packet[27:30], 'big') >> 4
+        max_kbps = LOSSLESS_MAX_KBPS
+    else:
+        raise ProbeError('Unsupported Ogg codec')
+    if not samplerate:
+        raise ProbeError('Ogg stream has no sample rate')
+
+    # The granule position of the last page of our stream is its length in samples
+    tail_start = max(0, file_size - OGG_TAIL_BYTES)
+    tail = _read_at(f, tail_start, OGG_TAIL_BYTES)
+    position = tail.rfind(b'OggS')
+    while position >= 0:
+        page = tail[position:position + 27]
+        if len(page) == 27 and page[14:18] == serial:
+            granule = struct.unpack('<q', page[6:14])[0]
+            if granule >= 0:
+                return max(max(granule - pre_skip, 0) / samplerate, _shortest(file_size, max_kbps))
+        position = tail.rfind(b'OggS', 0, position)
+    raise ProbeError('No final Ogg page found')
+
+
+def _mp4_duration(f, file_size):
+    """Walk boxes to moov/mvhd and the first track's codec; moov may sit at either end of the file"""
+    def boxes(start, end):
+        offset = start
+        while offset + 8 <= end:
+            header = _read_at(f, offset, 16)
+            size, kind = struct.unpack('>I4s', header[:8])
+            header_size = 8
+            if size == 1:
+                size = struct.unpack('>Q', header[8:16])[0]
+                header_size = 16
+            elif size == 0:
+                size = end - offset
+            if size < header_size:
+                raise ProbeError('Corrupt MP4 box')
+            yield kind, offset + header_size, offset + size
+            offset += size
+
+    def child(start, end, kind):
+        for found, body, found_end in boxes(start, end):
+            if found == kind:
+                return body, found_end
+        return None
+
+    def codec(start, end):
+        # First sample entry of the first track: moov/trak/mdia/minf/stbl/stsd
+        for kind in (b'trak', b'mdia', b'minf', b'stbl', b'stsd'):
+            found = child(start, end, kind)
+            if found is None:
+                return None
+            start, end = found
+        return _read_at(f, start + 12, 4)
+
+    moov = child(0, file_size, b'moov')
+    if moov is None:
+        raise ProbeError('MP4 has no movie header')
+    mvhd = child(moov[0], moov[1], b'mvhd')
+    if mvhd is None:
+        raise ProbeError('MP4 has no movie header')
+    mvhd = _read_at(f, mvhd[0], 32)
+    if mvhd[0] == 1:
+        timescale, duration = struct.unpack('>IQ', mvhd[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', mvhd[12:20])
+    if not timescale:
+        raise ProbeError('MP4 timescale is zero')
+    # ALAC, FLAC or an unknown codec: hold it to the lossless rate
+    max_kbps = MP4_CODEC_MAX_KBPS.get(codec(*moov), LOSSLESS_MAX_KBPS)
+    return max(duration / timescale, _shortest(file_size, max_kbps))
+
+
+HEADER_PROBES = {
+    'wav': _wav_duration,
+    'flac': _flac_duration,
+    'mp3': _mp3_duration,
+    'ogg': _ogg_duration,
+    'm4a': _mp4_duration,
+}
+
+
+def probe_duration(path, format=None):
+    """Audio duration in seconds, read from headers without decoding.
+
+    WAV, FLAC, MP3, Ogg and MP4 are parsed directly (a few KB of reads at
+    most); other formats fall back to libsndfile/ffprobe metadata. A
+    compressed file is never billed for less time than its bytes take at
+    its codec's highest bitrate, whatever its header claims.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if format is None:
+            format = sniff_format(f.read(64))
+        probe = HEADER_PROBES.get(format)
+        if probe:
+            try:
+                f.seek(0)
+                return probe(f, file_size)
+            except (ProbeError, struct.error, IndexError, KeyError) as e:
+                logger.warning(f"⚠️ Header probe failed for {format}: {str(e)}")
+
+    # Decoder fallback; imported here so header probes never load numpy/soundfile
+    from audio_io import AudioDecodeError, audio_info
+    try:
+        return audio_info(path).duration
+    except (AudioDecodeError, RuntimeError) as e:
+        raise ProbeError(f'Could not determine audio duration: {str(e)}')
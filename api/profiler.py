@@ -0,0 +1,168 @@
+import os
+import sys
+import time
+import random
+import hmac
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for selected request threads.
+
+    A single daemon thread wakes every ``interval`` seconds while at least
+    one request is being profiled, reads every thread's current frame with
+    ``sys._current_frames()`` and counts the collapsed stacks of the
+    profiled threads. Worker pool threads whose name starts with one of
+    ``thread_prefixes`` are sampled too while a profiled request is running,
+    since the backend call and segment work happen there. Stacks are
+    aggregated in the collapsed format that flamegraph.pl and speedscope
+    read: ``root;caller;callee count``.
+
+    Nothing runs while no request is profiled, so the cost of the profiler
+    being off is the sampling decision in ``should_profile``.
+    """
+
+    def __init__(self, interval=0.01, sample_rate=0.0, admin_token='', max_stacks=20000, max_depth=96,
+                 thread_prefixes=('backend-call', 'segment'), idle_timeout=1.0):
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.thread_prefixes = tuple(thread_prefixes)
+        self.idle_timeout = idle_timeout
+        self._parked = False
+        self._active = {}
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self.stats = {'profiled_requests': 0, 'samples': 0, 'dropped_samples': 0,
+                      'profiled_seconds': 0.0, 'sampling_seconds': 0.0}
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.admin_token)
+
+    def is_admin(self, token):
+        return bool(self.admin_token) and bool(token) and hmac.compare_digest(token, self.admin_token)
+
+    def should_profile(self, header_token=None):
+        """Profile this request? Admin-flagged requests always are, others at ``sample_rate``"""
+        if header_token and self.is_admin(header_token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _ensure_sampler(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+            self._thread.start()
+
+    def start(self, label):
+        """Start sampling the calling thread under ``label``; returns a token for ``stop``"""
+        ident = threading.get_ident()
+        with self._wake:
+            self._active[ident] = label
+            self._ensure_sampler()
+            if self._parked:
+                self._wake.notify()
+        return ident, time.perf_counter()
+
+    def stop(self, token):
+        ident, started = token
+        with self._lock:
+            self._active.pop(ident, None)
+            self.stats['profiled_requests'] += 1
+            self.stats['profiled_seconds'] += time.perf_counter() - started
+
+    @contextmanager
+    def profile(self, label):
+        token = self.start(label)
+        try:
+            yield
+        finally:
+            self.stop(token)
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            name = getattr(code, 'co_qualname', code.co_name)
+            names.append(f'{name} ({os.path.basename(code.co_filename)})'.replace(';', ':'))
+            frame = frame.f_back
+        names.reverse()
+        return ';'.join(names)
+
+    def _pool_threads(self):
+        if not self.thread_prefixes:
+            return {}
+        return {
+            thread.ident: 'thread:' + thread.name.rsplit('_', 1)[0]
+            for thread in threading.enumerate()
+            if thread.name.startswith(self.thread_prefixes)
+        }
+
+    def _sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            targets = dict(self._active)
+        targets.update(self._pool_threads())
+        stacks = []
+        for ident, label in targets.items():
+            frame = frames.get(ident)
+            if frame is not None:
+                stacks.append(f'{label};{self._collapse(frame)}')
+        del frames
+        with self._lock:
+            for stack in stacks:
+                if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                    self._stacks[stack] += 1
+                else:
+                    self.stats['dropped_samples'] += 1
+            self.stats['samples'] += len(stacks)
+
+    def _run(self):
+        last_active = time.monotonic()
+        while True:
+            with self._wake:
+                # Keep ticking through short gaps between profiled requests, so
+                # back-to-back requests do not each pay for waking this thread
+                if self._active:
+                    last_active = time.monotonic()
+                elif time.monotonic() - last_active >= self.idle_timeout:
+                    self._parked = True
+                    while not self._active:
+                        self._wake.wait()
+                    self._parked = False
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            started = time.perf_counter()
+            self._sample()
+            with self._lock:
+                self.stats['sampling_seconds'] += time.perf_counter() - started
+
+    def collapsed(self, prefix=None):
+        """Aggregated stacks as ``stack count`` lines, hottest first"""
+        with self._lock:
+            items = self._stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in items
+                       if prefix is None or stack.startswith(prefix))
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            for name in self.stats:
+                self.stats[name] = 0.0 if isinstance(self.stats[name], float) else 0
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats, stacks=len(self._stacks), active=len(self._active))
+        # Share of profiled wall time the sampler spent walking stacks
+        stats['overhead_ratio'] = round(stats['sampling_seconds'] / stats['profiled_seconds'], 4) \
+            if stats['profiled_seconds'] else 0.0
+        stats['sampling_seconds'] = round(stats['sampling_seconds'], 3)
+        stats['profiled_seconds'] = round(stats['profiled_seconds'], 3)
+        return stats
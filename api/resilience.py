@@ -0,0 +1,269 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the backend while every endpoint's breaker is open"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when no endpoint answered within the per-call deadline"""
+
+
+class CircuitBreaker:
+    """Closed -> open after ``failure_threshold`` consecutive failures.
+
+    While open, calls are refused for ``reset_timeout`` seconds; then one
+    trial call is let through (half-open) and its outcome closes or reopens
+    the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._trial_running = False
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning(f"🔌 Circuit opened after {self._failures} failures")
+                self.state = 'open'
+                self._opened_at = self.clock()
+                self._trial_running = False
+
+
+class LatencyTracker:
+    """Recent successful call latencies: percentile and moving average"""
+
+    def __init__(self, window=200, initial=10.0):
+        self._samples = deque(maxlen=window)
+        self.average = initial
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.average = 0.8 * self.average + 0.2 * seconds
+
+    def percentile(self, q, min_samples=20):
+        """The q-th percentile, or None until there are enough samples"""
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(len(ordered) * q / 100), len(ordered) - 1)]
+
+
+class Endpoint:
+    """One backend (e.g. one Gradio Space) with its own breaker and latency stats.
+
+    ``call_async``, when given, is the same call as a coroutine function,
+    used by ``ResilientCaller.call_async``.
+    """
+
+    def __init__(self, name, call, breaker=None, latency=None, call_async=None):
+        self.name = name
+        self.call = call
+        self.call_async = call_async
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self.stats = {'calls': 0, 'failures': 0, 'timeouts': 0}
+
+    def snapshot(self):
+        return dict(self.stats, state=self.breaker.state, average_seconds=round(self.latency.average, 3),
+                    p95_seconds=self.latency.percentile(95))
+
+
+class ResilientCaller:
+    """Call one of several equivalent endpoints with deadlines, breakers and hedging.
+
+    The primary endpoint is picked at random weighted by inverse average
+    latency, among endpoints whose breaker is closed. With hedging on, if
+    the primary has not answered after its p95 latency, the same call is
+    sent to a second endpoint and the first success wins. Calls run on a
+    bounded executor, so a hung backend costs an executor thread until it
+    returns, never the request thread past its deadline.
+    """
+
+    def __init__(self, endpoints, deadline=120.0, hedge=False, hedge_min_delay=2.0,
+                 hedge_percentile=95, max_workers=8):
+        self.endpoints = endpoints
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_percentile = hedge_percentile
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='backend-call')
+        self._lock = threading.Lock()
+        self.stats = {'hedges': 0, 'hedge_wins': 0, 'short_circuited': 0, 'deadline_exceeded': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _pick(self, exclude=()):
+        candidates = [e for e in self.endpoints if e not in exclude]
+        # Weighted order first; breakers are consulted only for the endpoint actually chosen
+        while candidates:
+            weights = [1.0 / max(e.latency.average, 0.001) for e in candidates]
+            endpoint = random.choices(candidates, weights=weights)[0]
+            if endpoint.breaker.allow():
+                return endpoint
+            candidates.remove(endpoint)
+        return None
+
+    def _run(self, endpoint, args, kwargs):
+        started = time.monotonic()
+        endpoint.stats['calls'] += 1
+        try:
+            result = endpoint.call(*args, **kwargs)
+        except Exception:
+            endpoint.stats['failures'] += 1
+            endpoint.breaker.record_failure()
+            raise
+        endpoint.latency.add(time.monotonic() - started)
+        endpoint.breaker.record_success()
+        return result
+
+    async def _run_async(self, endpoint, args, kwargs):
+        started = time.monotonic()
+        endpoint.stats['calls'] += 1
+        try:
+            result = await endpoint.call_async(*args, **kwargs)
+        except Exception:
+            endpoint.stats['failures'] += 1
+            endpoint.breaker.record_failure()
+            raise
+        endpoint.latency.add(time.monotonic() - started)
+        endpoint.breaker.record_success()
+        return result
+
+    def _hedge_delay(self, endpoint):
+        p = endpoint.latency.percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, p) if p is not None else None
+
+    def call(self, *args, **kwargs):
+        primary = self._pick()
+        if primary is None:
+            self._count('short_circuited')
+            raise CircuitOpenError('All backend endpoints are unavailable (circuit open)')
+
+        deadline = time.monotonic() + self.deadline
+        pending = {self.executor.submit(self._run, primary, args, kwargs): primary}
+        tried = {primary}
+        hedges = set()
+        hedge_at = None
+        if self.hedge and len(self.endpoints) > 1:
+            delay = self._hedge_delay(primary)
+            hedge_at = time.monotonic() + delay if delay is not None else None
+
+        last_error = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake = min(deadline, hedge_at) if hedge_at else deadline
+            done, _ = wait(list(pending), timeout=max(wake - now, 0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"⚠️ Backend {endpoint.name} failed: {str(e)}")
+                    continue
+                if endpoint in hedges:
+                    self._count('hedge_wins')
+                return result
+
+            launch = None
+            if not pending:
+                # Fail over to an endpoint that has not been tried yet
+                launch = self._pick(exclude=tried)
+            elif hedge_at and time.monotonic() >= hedge_at:
+                hedge_at = None
+                launch = self._pick(exclude=tried)
+                if launch is not None:
+                    hedges.add(launch)
+                    self._count('hedges')
+                    logger.info(f"🪁 Hedging slow call to {primary.name} with {launch.name}")
+            if launch is not None:
+                tried.add(launch)
+                pending[self.executor.submit(self._run, launch, args, kwargs)] = launch
+
+        if pending:
+            # The stuck calls keep running; count them against their endpoints now
+            self._count('deadline_exceeded')
+            for endpoint in pending.values():
+                endpoint.stats['timeouts'] += 1
+                endpoint.breaker.record_failure()
+            raise DeadlineExceeded(f'Backend did not answer within {self.deadline:.0f}s')
+        raise last_error
+
+    async def call_async(self, *args, **kwargs):
+        """``call`` awaited on the event loop, for endpoints with a ``call_async``.
+
+        Same endpoint choice, breakers, failover and overall deadline, but
+        without hedging; a call past the deadline is cancelled rather than
+        left running.
+        """
+        deadline = time.monotonic() + self.deadline
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._pick(exclude=tried)
+            if endpoint is None:
+                if last_error is None:
+                    self._count('short_circuited')
+                    raise CircuitOpenError('All backend endpoints are unavailable (circuit open)')
+                raise last_error
+            tried.add(endpoint)
+            try:
+                return await asyncio.wait_for(self._run_async(endpoint, args, kwargs),
+                                              max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                self._count('deadline_exceeded')
+                endpoint.stats['timeouts'] += 1
+                endpoint.breaker.record_failure()
+                raise DeadlineExceeded(f'Backend did not answer within {self.deadline:.0f}s')
+            except Exception as e:
+                last_error = e
+                logger.warning(f"⚠️ Backend {endpoint.name} failed: {str(e)}")
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['endpoints'] = {e.name: e.snapshot() for e in self.endpoints}
+        return stats
@@ -0,0 +1,271 @@
+import os
+import json
+import uuid
+import asyncio
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(content_hash, params):
+    """Combine the input content hash with the enhancement parameters"""
+    encoded = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f'{content_hash}:{encoded}'.encode()).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.shares = []
+
+
+class ResultCache:
+    """Content-addressed, disk-backed LRU cache of enhanced audio.
+
+    Entries are files named by their key, with a small JSON sidecar for
+    metadata such as the backend that produced them and when it was
+    written. An entry expires ``ttl_seconds`` after it was written, however
+    often it is read; entries flagged ``degraded`` in their metadata (a
+    local fallback standing in for the remote model) expire after
+    ``degraded_ttl_seconds``. Reads bump the file mtime, which orders
+    eviction.
+
+    All state lives in the directory, so worker processes sharing it share
+    one cache: each store rescans the directory and evicts the least
+    recently read entries until the total fits ``max_bytes``.
+
+    Paths handed out are private hard links into the cache directory, so
+    an entry evicted meanwhile (by any process) stays readable. The caller
+    owns the path and must move or delete it; links left behind by a
+    crashed caller are swept after ``stale_seconds``. Concurrent requests
+    for the same key share a single backend call through ``get_or_compute``.
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, ttl_seconds=86400, degraded_ttl_seconds=300,
+                 stale_seconds=3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.degraded_ttl_seconds = degraded_ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._usage = (0, 0)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'coalesced': 0}
+        os.makedirs(self.root, exist_ok=True)
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.root, f'{key}.bin')
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, f'{key}.json')
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _drop(self, key):
+        for path in (self._path(key), self._meta_path(key)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _link(self, source_path):
+        """A new private link to ``source_path`` (a copy where links are unsupported)"""
+        path = os.path.join(self.root, f'{uuid.uuid4().hex}.pin')
+        try:
+            os.link(source_path, path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(source_path, path)
+        return path
+
+    def _read_sidecar(self, key):
+        try:
+            with open(self._meta_path(key)) as f:
+                sidecar = json.load(f)
+            return float(sidecar['created_at']), sidecar.get('meta') or {}
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return None
+
+    def get(self, key):
+        """Return ``(path, meta)`` for ``key``, or None on a miss; the caller owns ``path``"""
+        sidecar = self._read_sidecar(key)
+        if sidecar is None:
+            self._count('misses')
+            return None
+
+        created_at, meta = sidecar
+        ttl = self.degraded_ttl_seconds if meta.get('degraded') else self.ttl_seconds
+        if time.time() - created_at > ttl:
+            self._drop(key)
+            self._count('expirations')
+            self._count('misses')
+            return None
+
+        try:
+            path = self._link(self._path(key))
+        except FileNotFoundError:
+            # Evicted by another worker between the two reads
+            self._count('misses')
+            return None
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+        self._count('hits')
+        return path, meta
+
+    def put(self, key, source_path, meta=None):
+        """Move the file at ``source_path`` into the cache; returns a path the caller owns"""
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'created_at': time.time(), 'meta': meta or {}}, f)
+        os.replace(temp_path, self._meta_path(key))
+        path = self._link(source_path)
+        os.replace(source_path, self._path(key))
+        self._evict(keep=key)
+        return path
+
+    def _evict(self, keep=None):
+        # Sizes come from the directory, so entries written by every worker count
+        now = time.time()
+        entries, total = [], 0
+        for entry in os.scandir(self.root):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.endswith('.bin'):
+                entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+                total += st.st_size
+            elif entry.name.endswith(('.pin', '.tmp')) and now - st.st_mtime > self.stale_seconds:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+
+        # Least recently read first; never the entry just written
+        evicted = 0
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._drop(key)
+            total -= size
+            evicted += 1
+        with self._lock:
+            self.stats['evictions'] += evicted
+            self._usage = (len(entries) - evicted, total)
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self.stats['coalesced'] += 1
+        return flight, leader
+
+    def _land(self, key, flight):
+        # No caller can join once the flight is gone, so every waiter gets a link
+        with self._lock:
+            del self._inflight[key]
+        if flight.error is None:
+            try:
+                flight.shares = [self._link(flight.result[0]) for _ in range(flight.waiters)]
+            except Exception as e:
+                flight.error = e
+        flight.done.set()
+
+    def _share(self, flight):
+        if flight.error:
+            raise flight.error
+        with self._lock:
+            return flight.shares.pop(), flight.result[1], False
+
+    def get_or_compute(self, key, compute):
+        """Return ``(path, meta, hit)``, running ``compute`` once per key at a time.
+
+        ``compute`` writes the result to a file on the same filesystem and
+        returns ``(path, meta)``; the file is moved into the cache. Every
+        caller gets its own ``path`` to move or delete.
+        """
+        cached = self.get(key)
+        if cached:
+            return cached[0], cached[1], True
+
+        flight, leader = self._join(key)
+        if not leader:
+            flight.done.wait()
+            return self._share(flight)
+
+        try:
+            path, meta = compute()
+            flight.result = (self.put(key, path, meta), meta)
+            return flight.result[0], flight.result[1], False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+
+    async def get_or_compute_async(self, key, compute):
+        """``get_or_compute`` with a coroutine function ``compute``.
+
+        Shares in-flight computations with the threaded callers; a task
+        waiting on another caller's computation polls instead of parking
+        a thread. Lookups and stores (disk I/O) run on the default executor.
+        """
+        cached = await asyncio.to_thread(self.get, key)
+        if cached:
+            return cached[0], cached[1], True
+
+        flight, leader = self._join(key)
+        if not leader:
+            delay = 0.01
+            while not flight.done.is_set():
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.25)
+            return self._share(flight)
+
+        try:
+            path, meta = await compute()
+            flight.result = (await asyncio.to_thread(self.put, key, path, meta), meta)
+            return flight.result[0], flight.result[1], False
+        except asyncio.CancelledError:
+            flight.error = RuntimeError('Enhancement cancelled')
+            raise
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            # Completes even if this task is cancelled meanwhile, so waiters are never stranded
+            await asyncio.shield(asyncio.to_thread(self._land, key, flight))
+
+    def snapshot(self):
+        """Counters for this process; entries and bytes as of the last store, across all workers"""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            entries, total = self._usage
+            return dict(
+                self.stats,
+                entries=entries,
+                bytes=total,
+                max_bytes=self.max_bytes,
+                hit_ratio=round(self.stats['hits'] / lookups, 4) if lookups else 0.0
+            )
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class ResultStore:
+    """Enhanced outputs persisted on disk under an unguessable download id.
+
+    Results are linked or moved into the store rather than copied, and are
+    served straight from their file so responses never hold the audio in
+    memory. ``<id>.json`` next to each ``<id>.bin`` keeps the download name
+    and mimetype.
+    """
+
+    def __init__(self, root, ttl_seconds=86400, sweep_interval=300):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    def _paths(self, download_id):
+        base = os.path.join(self.root, download_id)
+        return f'{base}.bin', f'{base}.json'
+
+    def put_file(self, source_path, download_name, mimetype, move=False):
+        """Store ``source_path`` and return its download id"""
+        download_id = uuid.uuid4().hex
+        data_path, meta_path = self._paths(download_id)
+
+        if move:
+            shutil.move(source_path, data_path)
+        else:
+            try:
+                os.link(source_path, data_path)
+            except OSError:
+                shutil.copyfile(source_path, data_path)
+
+        meta = {
+            'download_name': download_name,
+            'mimetype': mimetype,
+            'size': os.path.getsize(data_path),
+            'created_at': time.time()
+        }
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, meta_path)
+
+        self.maybe_expire()
+        return download_id
+
+    def get(self, download_id):
+        """Return the metadata (with ``path``) for a download id, or None"""
+        if not download_id or not download_id.isalnum():
+            return None
+        data_path, meta_path = self._paths(download_id)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(data_path):
+            return None
+        meta['path'] = data_path
+        return meta
+
+    def maybe_expire(self):
+        now = time.time()
+        if now - self._last_sweep < self.sweep_interval:
+            return 0
+        self._last_sweep = now
+        return self.expire(now)
+
+    def expire(self, now=None):
+        """Delete results older than the TTL"""
+        now = now or time.time()
+        removed = 0
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.root, name)
+            try:
+                if now - os.path.getmtime(meta_path) <= self.ttl_seconds:
+                    continue
+            except FileNotFoundError:
+                continue
+            for path in self._paths(name[:-5]):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        if removed:
+            logger.info(f"🧹 Expired {removed} stored results")
+        return removed
@@ -0,0 +1,197 @@
+import os
+import time
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+from audio_io import audio_info, read_frames, output_writer
+
+logger = logging.getLogger(__name__)
+
+
+def plan_segments(total_frames, segment_frames, overlap_frames):
+    """Split [0, total_frames) into overlapping (start, end) windows"""
+    if total_frames <= segment_frames:
+        return [(0, total_frames)]
+
+    stride = segment_frames - overlap_frames
+    segments = []
+    start = 0
+    while True:
+        end = min(start + segment_frames, total_frames)
+        segments.append((start, end))
+        if end >= total_frames:
+            break
+        start += stride
+
+    # Fold a tiny trailing window into its predecessor to avoid a sliver
+    # segment that is mostly crossfade
+    if len(segments) > 1 and segments[-1][1] - segments[-1][0] <= overlap_frames * 2:
+        segments.pop()
+        segments[-1] = (segments[-1][0], total_frames)
+    return segments
+
+
+def conform(data, samplerate, target_samplerate, target_channels):
+    """Bring a (frames, channels) block to the target rate and channel count"""
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+
+    if data.shape[1] != target_channels:
+        if target_channels == 1:
+            data = data.mean(axis=1, keepdims=True)
+        else:
+            data = np.repeat(data[:, :1], target_channels, axis=1)
+
+    if samplerate != target_samplerate and len(data):
+        target_frames = int(round(len(data) * target_samplerate / samplerate))
+        source_positions = np.arange(target_frames) * (samplerate / target_samplerate)
+        data = np.stack([
+            np.interp(source_positions, np.arange(len(data)), data[:, c])
+            for c in range(data.shape[1])
+        ], axis=1)
+    return data.astype(np.float32, copy=False)
+
+
+def fit_length(data, frames):
+    """Trim or zero-pad a block to exactly ``frames`` rows"""
+    if len(data) >= frames:
+        return data[:frames]
+    padding = np.zeros((frames - len(data), data.shape[1]), dtype=data.dtype)
+    return np.concatenate([data, padding])
+
+
+class SegmentedEnhancer:
+    """Enhance long files as overlapping segments on a shared worker pool.
+
+    ``enhance_fn(segment_path, output_path)`` enhances one WAV segment into
+    ``output_path`` and returns a label naming the backend that did it. Segments are submitted through a sliding window so only a
+    few are held in memory, and each is stitched to its neighbour with a
+    linear crossfade across the overlap. A failed segment is retried and
+    then left unenhanced, except for ``fatal_errors``, which abort the file.
+    """
+
+    def __init__(self, enhance_fn, max_workers=4, segment_seconds=30.0,
+                 overlap_seconds=0.5, max_retries=2, work_dir='/tmp', fatal_errors=()):
+        self.enhance_fn = enhance_fn
+        self.fatal_errors = fatal_errors
+        self.max_workers = max_workers
+        self.segment_seconds = segment_seconds
+        self.overlap_seconds = overlap_seconds
+        self.max_retries = max_retries
+        self.work_dir = work_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='segment')
+
+    def _enhance_segment(self, input_path, info, start, end, enhance_fn):
+        """Enhance one window, retrying only this window on failure"""
+        original, samplerate = read_frames(input_path, start, end, info=info)
+
+        fd, segment_path = tempfile.mkstemp(suffix='.wav', dir=self.work_dir)
+        os.close(fd)
+        result_path = segment_path[:-4] + '_enhanced.wav'
+        try:
+            sf.write(segment_path, original, samplerate, subtype='PCM_16')
+            last_error = None
+            for attempt in range(self.max_retries + 1):
+                try:
+                    label = enhance_fn(segment_path, result_path)
+                    enhanced, enhanced_rate = read_frames(result_path)
+                    return enhanced, enhanced_rate, label
+                except self.fatal_errors:
+                    raise
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"⚠️ Segment {start}-{end} attempt {attempt + 1} failed: {str(e)}")
+                    if attempt < self.max_retries:
+                        time.sleep(min(2 ** attempt, 8) * 0.5)
+
+            logger.error(f"Segment {start}-{end} gave up after retries: {str(last_error)}")
+            return original, samplerate, None
+        finally:
+            for path in (segment_path, result_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def enhance_file(self, input_path, output_path, progress=None, output_format='wav', kbps=None, enhance_fn=None):
+        """Enhance ``input_path`` into ``output_path``; returns stats.
+
+        Stitched audio is encoded as it is written, so a FLAC or Opus result
+        costs no second pass over the file. ``enhance_fn`` overrides the
+        constructor's for this file's segments.
+        """
+        enhance_fn = enhance_fn or self.enhance_fn
+        info = audio_info(input_path)
+        segment_frames = int(self.segment_seconds * info.samplerate)
+        overlap_frames = int(self.overlap_seconds * info.samplerate)
+        segments = plan_segments(info.frames, segment_frames, overlap_frames)
+        total = len(segments)
+        logger.info(f"✂️ Enhancing {info.duration:.1f}s as {total} segments on {self.max_workers} workers")
+
+        started = time.time()
+        window = deque()
+        next_to_submit = 0
+        failed = 0
+        methods = set()
+        writer = None
+        tail = None
+        out_rate = out_channels = None
+
+        def to_out(frame):
+            return int(round(frame * out_rate / info.samplerate))
+
+        try:
+            while next_to_submit < total or window:
+                # Keep a bounded number of segments in flight
+                while next_to_submit < total and len(window) < self.max_workers * 2:
+                    start, end = segments[next_to_submit]
+                    window.append(self.executor.submit(self._enhance_segment, input_path, info, start, end, enhance_fn))
+                    next_to_submit += 1
+
+                index = next_to_submit - len(window)
+                data, rate, label = window.popleft().result()
+                if label is None:
+                    failed += 1
+                else:
+                    methods.add(label)
+
+                if writer is None:
+                    out_rate = rate
+                    out_channels = data.shape[1]
+                    writer = output_writer(output_path, out_rate, out_channels, output_format, kbps)
+
+                start, end = segments[index]
+                data = fit_length(conform(data, rate, out_rate, out_channels), to_out(end) - to_out(start))
+
+                if tail is not None:
+                    fade = np.linspace(0.0, 1.0, len(tail), dtype=np.float32)[:, np.newaxis]
+                    data[:len(tail)] = tail * (1.0 - fade) + data[:len(tail)] * fade
+
+                if index + 1 < total:
+                    keep = to_out(end) - to_out(segments[index + 1][0])
+                    tail = data[len(data) - keep:].copy()
+                    writer.write(data[:len(data) - keep])
+                else:
+                    writer.write(data)
+
+                if progress:
+                    progress(index + 1, total)
+        finally:
+            for future in window:
+                future.cancel()
+            if writer is not None:
+                writer.close()
+
+        elapsed = time.time() - started
+        logger.info(f"✅ Segmented enhancement finished in {elapsed:.1f}s ({failed}/{total} segments failed)")
+        return {
+            'segments': total,
+            'failed_segments': failed,
+            'methods': sorted(methods),
+            'duration_seconds': info.duration,
+            'elapsed_seconds': elapsed,
+            'encoding': writer.report() if writer is not None else None
+        }
@@ -0,0 +1,48 @@
+import asyncio
+
+# Enhancement pipelines are written as generators that yield a tuple of
+# arguments whenever they need the backend and get its answer sent back
+# (or its exception thrown in). The same pipeline then runs with a blocking
+# backend call under WSGI, or an awaited one under the ASGI server.
+
+
+def _advance(steps, value, error):
+    """Resume ``steps``; returns ``(finished, request_or_result)``"""
+    try:
+        if error is not None:
+            return False, steps.throw(error)
+        return False, steps.send(value)
+    except StopIteration as done:
+        return True, done.value
+
+
+def run_steps(steps, call):
+    """Drive ``steps`` to completion with a blocking ``call``"""
+    value, error = None, None
+    while True:
+        finished, request = _advance(steps, value, error)
+        if finished:
+            return request
+        try:
+            value, error = call(*request), None
+        except Exception as e:
+            value, error = None, e
+
+
+async def run_steps_async(steps, call):
+    """Drive ``steps`` with an awaitable ``call``.
+
+    The pipeline's own work between backend calls is CPU and disk bound,
+    so it is resumed on the loop's default executor; the backend wait
+    holds no thread.
+    """
+    loop = asyncio.get_running_loop()
+    value, error = None, None
+    while True:
+        finished, request = await loop.run_in_executor(None, _advance, steps, value, error)
+        if finished:
+            return request
+        try:
+            value, error = await call(*request), None
+        except Exception as e:
+            value, error = None, e
@@ -0,0 +1,199 @@
+import re
+import time
+import json
+import hashlib
+import logging
+import threading
+import urllib.request
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Public certificates for Firebase Auth ID tokens, rotated by Google every few hours
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+class TokenError(Exception):
+    """Raised when an ID token is malformed, expired or not signed by a known key"""
+
+
+def fetch_certificates(url, timeout=10):
+    """Return ``({kid: pem}, max_age_seconds)`` from a Google x509 key endpoint"""
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        certificates = json.loads(response.read().decode('utf-8'))
+        match = MAX_AGE_PATTERN.search(response.headers.get('Cache-Control', ''))
+    return certificates, int(match.group(1)) if match else 3600
+
+
+class KeyCache:
+    """Signing keys cached for as long as the endpoint's Cache-Control allows.
+
+    A token signed with an unknown ``kid`` means the keys rotated early, so
+    it triggers a refresh; refreshes are rate limited so a stream of forged
+    kids cannot hammer the endpoint. One caller at a time fetches, outside
+    the lock: the others keep using the keys they have, and wait only when
+    they have no key for their ``kid``. A failed fetch keeps the old keys
+    and is not retried for ``min_refresh_interval``.
+    """
+
+    def __init__(self, url=GOOGLE_CERTS_URL, fetch=fetch_certificates, min_refresh_interval=60, clock=time.time):
+        self.url = url
+        self.fetch = fetch
+        self.min_refresh_interval = min_refresh_interval
+        self.clock = clock
+        self._keys = {}
+        self._expires_at = 0.0
+        self._last_fetch = None
+        self._fetching = None
+        self._lock = threading.Lock()
+        self.stats = {'refreshes': 0, 'refresh_failures': 0}
+
+    def _refresh(self, started):
+        try:
+            certificates, max_age = self.fetch(self.url)
+            from cryptography.x509 import load_pem_x509_certificate
+            keys = {
+                kid: load_pem_x509_certificate(pem.encode('utf-8')).public_key()
+                for kid, pem in certificates.items()
+            }
+        except Exception as e:
+            with self._lock:
+                self.stats['refresh_failures'] += 1
+            logger.warning(f"⚠️ Could not refresh token signing keys, retrying in {self.min_refresh_interval}s: {str(e)}")
+            return
+        with self._lock:
+            self._keys = keys
+            self._expires_at = started + max_age
+            self.stats['refreshes'] += 1
+        logger.info(f"🔑 Loaded {len(keys)} token signing keys (valid {max_age}s)")
+
+    def _due(self, kid, now):
+        if self._last_fetch is not None and now - self._last_fetch < self.min_refresh_interval:
+            return False
+        return now >= self._expires_at or kid not in self._keys
+
+    def get(self, kid):
+        """Public key for ``kid``, or None if no current key has that id"""
+        with self._lock:
+            now = self.clock()
+            fetching = self._fetching
+            if fetching is None and not self._due(kid, now):
+                return self._keys.get(kid)
+            leader = fetching is None
+            if leader:
+                fetching = self._fetching = threading.Event()
+                self._last_fetch = now
+            key = self._keys.get(kid)
+
+        if leader:
+            try:
+                self._refresh(now)
+            finally:
+                with self._lock:
+                    self._fetching = None
+                fetching.set()
+        elif key is not None:
+            # Stale keys are still Google's; no need to queue behind the fetch
+            return key
+        else:
+            fetching.wait()
+        with self._lock:
+            return self._keys.get(kid)
+
+
+class TokenVerifier:
+    """Verify Firebase ID tokens in process, memoising verified claims.
+
+    Signatures are checked against ``KeyCache`` keys with PyJWT; the claims
+    of a verified token are kept in a bounded LRU keyed by the token's hash
+    until the token expires, so repeat requests skip the RSA check.
+    """
+
+    def __init__(self, project_id, keys=None, cache_size=4096, leeway=60, clock=time.time):
+        self.project_id = project_id
+        self.issuer = f'https://securetoken.google.com/{project_id}'
+        self.keys = keys or KeyCache(clock=clock)
+        self.cache_size = cache_size
+        self.leeway = leeway
+        self.clock = clock
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'failures': 0}
+
+    def _cached(self, digest):
+        with self._lock:
+            entry = self._verified.get(digest)
+            if entry is None:
+                return None
+            claims, expires_at = entry
+            if self.clock() >= expires_at:
+                del self._verified[digest]
+                return None
+            self._verified.move_to_end(digest)
+            self.stats['hits'] += 1
+            return claims
+
+    def _remember(self, digest, claims):
+        with self._lock:
+            self._verified[digest] = (claims, claims['exp'])
+            self._verified.move_to_end(digest)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+
+    def verify(self, token):
+        """Return the token's claims or raise TokenError"""
+        if not token:
+            raise TokenError('No token provided')
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        claims = self._cached(digest)
+        if claims is not None:
+            return claims
+
+        with self._lock:
+            self.stats['misses'] += 1
+        try:
+            claims = self._decode(token)
+        except TokenError:
+            with self._lock:
+                self.stats['failures'] += 1
+            raise
+        self._remember(digest, claims)
+        return claims
+
+    def _decode(self, token):
+        # PyJWT and cryptography load on the first uncached token, not at app start
+        import jwt
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise TokenError(f'Malformed token: {str(e)}')
+        if header.get('alg') != 'RS256':
+            raise TokenError('Token must be signed with RS256')
+
+        key = self.keys.get(header.get('kid'))
+        if key is None:
+            raise TokenError('Token signed with an unknown key')
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=['RS256'],
+                audience=self.project_id,
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={'require': ['exp', 'iat', 'sub']}
+            )
+        except jwt.PyJWTError as e:
+            raise TokenError(f'Invalid token: {str(e)}')
+
+        if not claims['sub'] or len(claims['sub']) > 128:
+            raise TokenError('Token has an invalid subject')
+        if claims.get('auth_time', 0) > self.clock() + self.leeway:
+            raise TokenError('Token auth_time is in the future')
+        return claims
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._verified), **self.keys.stats)
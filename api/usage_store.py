@@ -0,0 +1,350 @@
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def today():
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def default_user(user_id, day):
+    return {
+        'user_id': user_id,
+        'email': 'demo@voiceclean.ai',
+        'plan': 'free',
+        'daily_minutes_used': 0,
+        'last_reset_date': day
+    }
+
+
+class UsageStore:
+    """Per-user plan and daily minute usage.
+
+    ``try_consume`` is the only way minutes are charged: it checks the
+    limit and adds the minutes as one atomic step, so concurrent requests
+    cannot both slip under the quota. Usage from a previous day counts as
+    zero; ``rollover`` resets stale rows in bulk.
+    """
+
+    def get_user(self, user_id):
+        """User record with today's usage; defaults if the user is unknown"""
+        raise NotImplementedError
+
+    def ensure_user(self, user_id, email=None):
+        raise NotImplementedError
+
+    def set_plan(self, user_id, plan):
+        raise NotImplementedError
+
+    def try_consume(self, user_id, minutes, limit):
+        """Add ``minutes`` unless that passes ``limit`` (negative means unlimited).
+
+        Returns ``(allowed, minutes_used)``.
+        """
+        raise NotImplementedError
+
+    def refund(self, user_id, minutes):
+        raise NotImplementedError
+
+    def rollover(self, day=None):
+        """Zero the usage of every user last reset before ``day``"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryUsageStore(UsageStore):
+    """Process-local store for development and tests"""
+
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def _current(self, user_id, day):
+        user = self._users.get(user_id)
+        if user and user['last_reset_date'] != day:
+            user['daily_minutes_used'] = 0
+            user['last_reset_date'] = day
+        return user
+
+    def get_user(self, user_id):
+        day = today()
+        with self._lock:
+            user = self._current(user_id, day)
+            return dict(user) if user else default_user(user_id, day)
+
+    def ensure_user(self, user_id, email=None):
+        with self._lock:
+            user = self._users.setdefault(user_id, default_user(user_id, today()))
+            if email:
+                user['email'] = email
+            return dict(user)
+
+    def set_plan(self, user_id, plan):
+        self.ensure_user(user_id)
+        with self._lock:
+            self._users[user_id]['plan'] = plan
+
+    def try_consume(self, user_id, minutes, limit):
+        day = today()
+        with self._lock:
+            user = self._current(user_id, day) or self._users.setdefault(user_id, default_user(user_id, day))
+            used = user['daily_minutes_used'] + minutes
+            if 0 <= limit < used:
+                return False, user['daily_minutes_used']
+            user['daily_minutes_used'] = used
+            return True, used
+
+    def refund(self, user_id, minutes):
+        with self._lock:
+            user = self._current(user_id, today())
+            if user:
+                user['daily_minutes_used'] = max(user['daily_minutes_used'] - minutes, 0)
+
+    def rollover(self, day=None):
+        day = day or today()
+        with self._lock:
+            stale = [u for u in self._users.values() if u['last_reset_date'] < day]
+            for user in stale:
+                user['daily_minutes_used'] = 0
+                user['last_reset_date'] = day
+            return len(stale)
+
+
+class _Write:
+    __slots__ = ('statement', 'args', 'done', 'result', 'error')
+
+    def __init__(self, statement, args):
+        self.statement = statement
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SQLiteUsageStore(UsageStore):
+    """Durable store shared by every worker process on the host.
+
+    The database runs in WAL mode so reads never wait on writers. Writes go
+    through one writer thread per process that group-commits whatever has
+    queued up: under load many quota checks share a single transaction and
+    fsync, and each one is still an atomic conditional UPDATE. Across
+    processes, SQLite's write lock serialises the batches.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            email TEXT,
+            plan TEXT NOT NULL DEFAULT 'free',
+            minutes_used REAL NOT NULL DEFAULT 0,
+            reset_date TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_reset_date ON users (reset_date);
+    """
+
+    def __init__(self, path, max_batch=256, rollover_interval=300, write_timeout=60):
+        self.path = path
+        self.max_batch = max_batch
+        self.write_timeout = write_timeout
+        self.rollover_interval = rollover_interval
+        self._last_rollover = 0.0
+        self._local = threading.local()
+        self._writes = queue.Queue()
+        self.stats = {'writes': 0, 'batches': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(self.SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name='usage-writer', daemon=True)
+        self._writer.start()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Autocommit mode; transactions are opened explicitly by the writer
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA busy_timeout=30000')
+            self._local.connection = connection
+        return connection
+
+    def _write(self, statement, *args):
+        """Queue a write for the next group commit and wait for its result.
+
+        Raises TimeoutError if the writer has not answered within
+        ``write_timeout`` seconds; the write may still be applied later.
+        """
+        write = _Write(statement, args)
+        self._writes.put(write)
+        if not write.done.wait(self.write_timeout):
+            raise TimeoutError(f'Usage write not committed within {self.write_timeout}s')
+        if write.error:
+            raise write.error
+        return write.result
+
+    def _reconnect(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except sqlite3.Error:
+                pass
+
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            # Everything that queued up during the previous commit joins this one,
+            # so batches grow with load without delaying a lone write
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit(self._connection(), batch)
+            except Exception as e:
+                # A disk or connection error mid-batch: fail the batch, keep the writer alive
+                logger.error(f"❌ Usage write batch failed: {str(e)}")
+                for write in batch:
+                    write.error = write.error or e
+                self._reconnect()
+            finally:
+                for write in batch:
+                    write.done.set()
+
+    def _commit(self, connection, batch):
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            for write in batch:
+                write.error = e
+            return
+
+        for write in batch:
+            # A savepoint per write keeps one failure from undoing the rest of the batch
+            connection.execute('SAVEPOINT item')
+            try:
+                write.result = write.statement(connection, *write.args)
+                connection.execute('RELEASE item')
+            except Exception as e:
+                connection.execute('ROLLBACK TO item')
+                connection.execute('RELEASE item')
+                write.error = e
+        try:
+            connection.execute('COMMIT')
+        except sqlite3.Error as e:
+            connection.execute('ROLLBACK')
+            for write in batch:
+                write.error = write.error or e
+        self.stats['writes'] += len(batch)
+        self.stats['batches'] += 1
+
+    def _row(self, user_id, day):
+        row = self._connection().execute(
+            'SELECT email, plan, minutes_used, reset_date FROM users WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        email, plan, used, reset_date = row
+        return {
+            'user_id': user_id,
+            'email': email,
+            'plan': plan,
+            'daily_minutes_used': used if reset_date == day else 0,
+            'last_reset_date': day
+        }
+
+    def get_user(self, user_id):
+        self.maybe_rollover()
+        day = today()
+        return self._row(user_id, day) or default_user(user_id, day)
+
+    @staticmethod
+    def _insert(connection, user_id, email, day):
+        connection.execute(
+            'INSERT OR IGNORE INTO users (user_id, email, reset_date) VALUES (?, ?, ?)',
+            (user_id, email or 'demo@voiceclean.ai', day)
+        )
+
+    def ensure_user(self, user_id, email=None):
+        day = today()
+        row = self._row(user_id, day)
+        if row is None or (email and row['email'] != email):
+            def statement(connection):
+                self._insert(connection, user_id, email, day)
+                if email:
+                    connection.execute('UPDATE users SET email = ? WHERE user_id = ?', (email, user_id))
+            self._write(statement)
+        return self.get_user(user_id)
+
+    def set_plan(self, user_id, plan):
+        day = today()
+
+        def statement(connection):
+            self._insert(connection, user_id, None, day)
+            connection.execute('UPDATE users SET plan = ? WHERE user_id = ?', (plan, user_id))
+        self._write(statement)
+
+    def try_consume(self, user_id, minutes, limit):
+        day = today()
+
+        def statement(connection):
+            self._insert(connection, user_id, None, day)
+            # Usage from an earlier day counts as zero, so the rollover happens here too
+            updated = connection.execute(
+                """UPDATE users
+                   SET minutes_used = CASE WHEN reset_date = :day THEN minutes_used ELSE 0 END + :minutes,
+                       reset_date = :day
+                   WHERE user_id = :user_id
+                     AND (:limit < 0 OR CASE WHEN reset_date = :day THEN minutes_used ELSE 0 END + :minutes <= :limit)""",
+                {'day': day, 'minutes': minutes, 'user_id': user_id, 'limit': limit}
+            ).rowcount
+            used = connection.execute(
+                'SELECT CASE WHEN reset_date = ? THEN minutes_used ELSE 0 END FROM users WHERE user_id = ?',
+                (day, user_id)
+            ).fetchone()[0]
+            return bool(updated), used
+        return self._write(statement)
+
+    def refund(self, user_id, minutes):
+        day = today()
+
+        def statement(connection):
+            connection.execute(
+                'UPDATE users SET minutes_used = MAX(minutes_used - ?, 0) WHERE user_id = ? AND reset_date = ?',
+                (minutes, user_id, day)
+            )
+        self._write(statement)
+
+    def rollover(self, day=None):
+        day = day or today()
+
+        def statement(connection):
+            # Only rows from earlier days are touched, found through the reset_date index
+            return connection.execute(
+                'UPDATE users SET minutes_used = 0, reset_date = ? WHERE reset_date < ?', (day, day)
+            ).rowcount
+        reset = self._write(statement)
+        if reset:
+            logger.info(f"🌅 Reset daily usage for {reset} users")
+        return reset
+
+    def maybe_rollover(self):
+        now = time.time()
+        if now - self._last_rollover < self.rollover_interval:
+            return 0
+        self._last_rollover = now
+        return self.rollover()
+
+    def snapshot(self):
+        return dict(self.stats, writes_per_batch=round(self.stats['writes'] / max(self.stats['batches'], 1), 2))
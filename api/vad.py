@@ -0,0 +1,190 @@
+import os
+import logging
+import tempfile
+
+import numpy as np
+
+from audio_io import audio_info, iter_blocks, BlockWriter
+from segmented import conform
+from steps import run_steps
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def frame_energies(path, info, frame_seconds=0.02):
+    """Mono energy in dBFS of consecutive ``frame_seconds`` frames, decoded block by block"""
+    frame = max(int(round(info.samplerate * frame_seconds)), 1)
+    energies = []
+    carry = np.zeros(0, dtype=np.float32)
+    for block in iter_blocks(path, info=info):
+        mono = np.concatenate([carry, block.mean(axis=1, dtype=np.float32)])
+        usable = len(mono) - len(mono) % frame
+        if usable:
+            energies.append(np.mean(mono[:usable].reshape(-1, frame) ** 2, axis=1))
+        carry = mono[usable:]
+    if len(carry):
+        energies.append(np.array([np.mean(carry ** 2)], dtype=np.float32))
+    if not energies:
+        return np.zeros(0), frame
+    return 10 * np.log10(np.concatenate(energies) + 1e-12), frame
+
+
+def silent_runs(energies_db, margin_db=10.0, min_range_db=25.0, pad_frames=12, min_frames=50):
+    """(start, end) frame runs of silence at least ``min_frames`` long.
+
+    A frame is voiced when it is louder than both ``margin_db`` above the
+    noise floor (10th percentile) and ``min_range_db`` below the loud level
+    (95th percentile); the lower of the two wins, so continuous speech or
+    music with no real floor is never gated. Voiced frames are widened by
+    ``pad_frames`` on each side to keep onsets and decays.
+    """
+    if len(energies_db) < min_frames:
+        return []
+    floor, loud = np.percentile(energies_db, [10, 95])
+    threshold = min(floor + margin_db, loud - min_range_db)
+    voiced = energies_db > threshold
+    if pad_frames:
+        voiced = np.convolve(voiced, np.ones(2 * pad_frames + 1), mode='same') > 0
+
+    edges = np.diff(np.concatenate([[0], (~voiced).astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    keep = ends - starts >= min_frames
+    return list(zip(starts[keep].tolist(), ends[keep].tolist()))
+
+
+class SilenceSkipper:
+    """Send only the voiced parts of a file to ``enhance_fn``.
+
+    Long silent spans are cut out before the backend call and, on
+    reassembly, filled with the original audio of the span attenuated by
+    ``floor_gain_db`` (a quiet, local noise floor rather than digital
+    silence), faded over ``fade_seconds`` at each edge. Files with less
+    than ``min_skip_fraction`` of silence go to the backend whole.
+    ``enhance`` returns ``(method_used, stats)`` and takes an ``enhance_fn``
+    overriding the constructor's for that call; ``steps`` is the same
+    pipeline as a generator of backend calls (see steps.py).
+    """
+
+    def __init__(self, enhance_fn, min_silence_seconds=1.0, pad_seconds=0.25, margin_db=10.0,
+                 floor_gain_db=-20.0, fade_seconds=0.01, min_skip_fraction=0.05, work_dir=None):
+        self.enhance_fn = enhance_fn
+        self.min_silence_seconds = min_silence_seconds
+        self.pad_seconds = pad_seconds
+        self.margin_db = margin_db
+        self.floor_gain = 10 ** (floor_gain_db / 20)
+        self.fade_seconds = fade_seconds
+        self.min_skip_fraction = min_skip_fraction
+        self.work_dir = work_dir
+
+    def silent_spans(self, path, info):
+        """Silent (start, end) sample-frame spans of ``path``"""
+        energies, frame = frame_energies(path, info)
+        frame_seconds = frame / info.samplerate
+        runs = silent_runs(energies, self.margin_db,
+                           pad_frames=int(round(self.pad_seconds / frame_seconds)),
+                           min_frames=max(int(round(self.min_silence_seconds / frame_seconds)), 1))
+        return [(start * frame, min(end * frame, info.frames)) for start, end in runs]
+
+    def enhance(self, input_path, output_path, enhance_fn=None):
+        return run_steps(self.steps(input_path, output_path), enhance_fn or self.enhance_fn)
+
+    def steps(self, input_path, output_path):
+        try:
+            with metrics.stage_seconds.time(stage='vad'):
+                info = audio_info(input_path)
+                silent = self.silent_spans(input_path, info) if info.frames else []
+        except Exception as e:
+            # Whatever libsndfile cannot decode goes to the backend as it is
+            logger.warning(f"⚠️ Voice activity pass skipped: {str(e)}")
+            return (yield input_path, output_path), {'duration_seconds': 0.0, 'skipped_seconds': 0.0}
+
+        skipped = sum(end - start for start, end in silent)
+        stats = {'duration_seconds': info.frames / info.samplerate, 'skipped_seconds': skipped / info.samplerate}
+        if not silent or skipped < self.min_skip_fraction * info.frames:
+            stats['skipped_seconds'] = 0.0
+            return (yield input_path, output_path), stats
+
+        spans = self._timeline(silent, info.frames)
+        voiced = [(start, end) for start, end, is_silent in spans if not is_silent]
+        if not voiced:
+            self._reassemble(input_path, None, info, spans, output_path)
+            return 'Silence (not enhanced)', stats
+
+        work_dir = self.work_dir or os.path.dirname(output_path)
+        fd, compact_path = tempfile.mkstemp(suffix='_voiced.wav', dir=work_dir)
+        os.close(fd)
+        enhanced_path = compact_path[:-4] + '_enhanced.wav'
+        try:
+            with BlockWriter(compact_path, info.samplerate, info.channels) as writer:
+                for start, end in voiced:
+                    for block in iter_blocks(input_path, start=start, stop=end, info=info):
+                        writer.write(block)
+            method_used = yield compact_path, enhanced_path
+            with metrics.stage_seconds.time(stage='vad_reassemble'):
+                self._reassemble(input_path, enhanced_path, info, spans, output_path)
+        finally:
+            for path in (compact_path, enhanced_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+        logger.info(f"🤫 Skipped {stats['skipped_seconds']:.1f}s of {stats['duration_seconds']:.1f}s as silence")
+        return method_used, stats
+
+    @staticmethod
+    def _timeline(silent, total_frames):
+        """Every frame of the file as ordered (start, end, is_silent) spans"""
+        spans, position = [], 0
+        for start, end in silent:
+            if start > position:
+                spans.append((position, start, False))
+            spans.append((start, end, True))
+            position = end
+        if position < total_frames:
+            spans.append((position, total_frames, False))
+        return spans
+
+    def _reassemble(self, input_path, enhanced_path, info, spans, output_path):
+        if enhanced_path is not None:
+            enhanced = audio_info(enhanced_path)
+            out_rate, out_channels = enhanced.samplerate, enhanced.channels
+        else:
+            out_rate, out_channels = info.samplerate, info.channels
+
+        def to_out(frame):
+            return int(round(frame * out_rate / info.samplerate))
+
+        fade = max(int(round(self.fade_seconds * out_rate)), 1)
+        compact_position = 0
+        with BlockWriter(output_path, out_rate, out_channels) as writer:
+            for start, end, is_silent in spans:
+                target = to_out(end) - to_out(start)
+                if is_silent:
+                    blocks = (conform(block, info.samplerate, out_rate, out_channels) * self.floor_gain
+                              for block in iter_blocks(input_path, start=start, stop=end, info=info))
+                else:
+                    length = end - start
+                    blocks = iter_blocks(enhanced_path, start=to_out(compact_position),
+                                         stop=to_out(compact_position + length), info=enhanced)
+                    compact_position += length
+                written = 0
+                for block in self._exactly(blocks, target, out_channels):
+                    if is_silent:
+                        # Fade the filler in and out so the cuts never click
+                        positions = np.arange(written, written + len(block))
+                        envelope = np.minimum(np.minimum(positions, target - 1 - positions) / fade, 1.0)
+                        block = block * envelope[:, np.newaxis].astype(np.float32)
+                    writer.write(block)
+                    written += len(block)
+
+    @staticmethod
+    def _exactly(blocks, frames, channels):
+        """Blocks trimmed or zero-padded to ``frames`` in total"""
+        remaining = frames
+        for block in blocks:
+            if remaining <= 0:
+                break
+            block = block[:remaining]
+            remaining -= len(block)
+            yield block
+        if remaining > 0:
+            yield np.zeros((remaining, channels), dtype=np.float32)
@@ -0,0 +1,73 @@
+import time
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    """Unseekable write target; zipfile then writes data descriptors instead of seeking back"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    """A ZIP archive produced incrementally, for streaming as a response body.
+
+    Each ``add_*`` call is a generator of the bytes that member adds; no
+    more than one chunk of a member is held in memory at a time, and the
+    central directory is emitted by ``close``. Members are stored, not
+    deflated, by default: enhanced audio barely compresses and the CPU is
+    better spent on the next file.
+    """
+
+    def __init__(self, compression=zipfile.ZIP_STORED):
+        self.compression = compression
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', compression=compression, allowZip64=True)
+
+    def _info(self, arcname, size):
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        info.compress_type = self.compression
+        info.external_attr = 0o644 << 16
+        # A known size lets zipfile decide on zip64 headers up front
+        info.file_size = size
+        return info
+
+    def add_file(self, arcname, fileobj, size):
+        with self._zip.open(self._info(arcname, size), 'w') as member:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                member.write(chunk)
+                data = self._sink.drain()
+                if data:
+                    yield data
+        yield self._sink.drain()
+
+    def add_bytes(self, arcname, data):
+        with self._zip.open(self._info(arcname, len(data)), 'w') as member:
+            member.write(data)
+        yield self._sink.drain()
+
+    def close(self):
+        self._zip.close()
+        yield self._sink.drain()
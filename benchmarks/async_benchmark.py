@@ -0,0 +1,214 @@
+"""Slow enhancements and page availability: gunicorn sync workers against the ASGI server.
+
+Usage: python benchmarks/async_benchmark.py [--enhancements 200] [--latency 5] [--sync-workers 8]
+                                            [--modes sync,asgi] [--output results.json] [--json]
+
+For each mode, starts the stub Space (benchmarks/stub_gradio.py) with a
+fixed ``--latency`` per call and the app under that server, fires
+``--enhancements`` concurrent uploads at /api/enhance, and meanwhile
+probes /, /pricing and /api/health every ``--probe-interval`` seconds
+with a ``--probe-timeout``. Reports enhancement outcomes and wall time,
+probe latency percentiles and failures while enhancements were in
+flight, and the server's peak thread count and RSS. ``sync`` is gunicorn
+with ``--sync-workers`` sync workers, the deployment this replaces;
+``asgi`` is one uvicorn process running ``asgi:create_app``.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+
+import httpx
+
+from stub_gradio import StubGradioServer
+from load_test import ROOT, make_clip, free_port, percentile, process_tree, rss_bytes, git_commit
+
+PROBE_PATHS = ('/', '/pricing', '/api/health')
+
+
+def thread_count(pids):
+    total = 0
+    for pid in pids:
+        try:
+            total += len(os.listdir(f'/proc/{pid}/task'))
+        except OSError:
+            continue
+    return total
+
+
+def start_server(mode, args, stub_url, work_dir, port):
+    env = dict(
+        os.environ,
+        DEEPFILTER_SPACE=stub_url,
+        ENHANCEMENT_BACKEND='remote',
+        FIREBASE_ENABLED='false',
+        USAGE_STORE='memory',
+        PRERENDER_PAGES='true',
+        UPLOAD_FOLDER=work_dir,
+        TMPDIR=os.path.join(work_dir, 'tmp'),
+        GRADIO_TEMP_DIR=os.path.join(work_dir, 'gradio'),
+        HF_HUB_DISABLE_TELEMETRY='1',
+        # Backend slots and client pools sized so the server model is what limits concurrency
+        BACKEND_MAX_CONCURRENT=str(args.enhancements * 2),
+        DEEPFILTER_POOL_SIZE=str(args.enhancements),
+        DEEPFILTER_TIMEOUT_SECONDS=str(args.latency * 10),
+        PYTHONUNBUFFERED='1',
+    )
+    for name in ('TMPDIR', 'GRADIO_TEMP_DIR'):
+        os.makedirs(env[name], exist_ok=True)
+    api_dir = os.path.join(ROOT, 'api')
+    if mode == 'sync':
+        command = ['gunicorn', '--chdir', api_dir, '--workers', str(args.sync_workers), '--worker-class', 'sync',
+                   '--bind', f'127.0.0.1:{port}', '--timeout', '600', 'index:app']
+    else:
+        command = ['uvicorn', '--app-dir', api_dir, '--factory', 'asgi:create_app', '--host', '127.0.0.1',
+                   '--port', str(port), '--log-level', 'warning', '--timeout-keep-alive', '30']
+    log = open(os.path.join(work_dir, 'app.log'), 'wb')
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} server exited with {process.returncode}, see {log.name}')
+        try:
+            if httpx.get(base_url + '/api/health', timeout=2).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not become healthy within 60s')
+
+
+def run_mode(mode, args, clip):
+    work_dir = tempfile.mkdtemp(prefix=f'voiceclean-{mode}-')
+    stub = StubGradioServer(latency=args.latency, seed=args.seed).start()
+    process, base_url = start_server(mode, args, stub.url, work_dir, free_port())
+    enhancements, probes = [], []
+    lock = threading.Lock()
+    in_flight = threading.Event()
+    peak = {'threads': 0, 'rss': 0}
+
+    def enhance(i):
+        started = time.perf_counter()
+        try:
+            # Unique bytes and a fresh demo identity: no cache hits, no per-user limits
+            response = httpx.post(base_url + '/api/enhance',
+                                  files={'audio': (f'clip{i}.wav', clip[:-2] + i.to_bytes(2, 'little'), 'audio/wav')},
+                                  headers={'Authorization': f'Bearer async-bench-{mode}-{i}'},
+                                  timeout=args.latency * 20 + 60)
+            outcome = response.status_code
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        with lock:
+            enhancements.append((outcome, time.perf_counter() - started))
+
+    def probe():
+        with httpx.Client(base_url=base_url, timeout=args.probe_timeout) as client:
+            while in_flight.is_set():
+                for path in PROBE_PATHS:
+                    started = time.perf_counter()
+                    try:
+                        outcome = client.get(path).status_code
+                    except httpx.HTTPError as e:
+                        outcome = type(e).__name__
+                    probes.append((path, outcome, time.perf_counter() - started))
+                time.sleep(args.probe_interval)
+
+    def sample():
+        while in_flight.is_set():
+            pids = process_tree(process.pid)
+            peak['threads'] = max(peak['threads'], thread_count(pids))
+            peak['rss'] = max(peak['rss'], rss_bytes(pids))
+            time.sleep(0.2)
+
+    try:
+        workers = [threading.Thread(target=enhance, args=(i,)) for i in range(args.enhancements)]
+        in_flight.set()
+        watchers = [threading.Thread(target=probe), threading.Thread(target=sample)]
+        started = time.perf_counter()
+        for thread in workers + watchers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        in_flight.clear()
+        for thread in watchers:
+            thread.join()
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        stub.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    ok = sorted(seconds for outcome, seconds in enhancements if outcome == 200)
+    probe_ok = sorted(seconds for _, outcome, seconds in probes if outcome == 200)
+    return {
+        'mode': mode,
+        'elapsed_s': round(elapsed, 2),
+        'enhancements': dict(Counter(str(outcome) for outcome, _ in enhancements)),
+        'enhance_latency_s': {
+            'p50': round(percentile(ok, 50), 2) if ok else None,
+            'max': round(ok[-1], 2) if ok else None,
+        },
+        'probes': len(probes),
+        'probe_failures': sum(outcome != 200 for _, outcome, _ in probes),
+        'probe_outcomes': dict(Counter(str(outcome) for _, outcome, _ in probes)),
+        'probe_latency_ms': {
+            'p50': round(percentile(probe_ok, 50) * 1000, 1) if probe_ok else None,
+            'p95': round(percentile(probe_ok, 95) * 1000, 1) if probe_ok else None,
+            'max': round(probe_ok[-1] * 1000, 1) if probe_ok else None,
+        },
+        'peak_threads': peak['threads'],
+        'peak_rss_mb': round(peak['rss'] / (1024 * 1024), 1),
+        'stub': dict(stub.stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--enhancements', type=int, default=200, help='concurrent uploads to /api/enhance')
+    parser.add_argument('--latency', type=float, default=5.0, help='stub seconds per backend call')
+    parser.add_argument('--seconds', type=float, default=3.0, help='clip length')
+    parser.add_argument('--sync-workers', type=int, default=8, help='gunicorn sync workers')
+    parser.add_argument('--modes', default='sync,asgi')
+    parser.add_argument('--probe-interval', type=float, default=0.25)
+    parser.add_argument('--probe-timeout', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    clip = make_clip(args.seconds, 48000, args.seed)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'json')},
+        'runs': [run_mode(mode, args, clip) for mode in args.modes.split(',')],
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.enhancements} concurrent enhancements, stub {args.latency}s per call, "
+          f"probing {', '.join(PROBE_PATHS)} every {args.probe_interval}s ({args.probe_timeout}s timeout)")
+    for run in report['runs']:
+        probe = run['probe_latency_ms']
+        print(f"  {run['mode']:<5} enhancements {run['enhancements']} in {run['elapsed_s']}s "
+              f"(p50 {run['enhance_latency_s']['p50']}s, max {run['enhance_latency_s']['max']}s)")
+        print(f"        probes {run['probes']}, failed {run['probe_failures']} {run['probe_outcomes']}, "
+              f"ms p50 {probe['p50']}  p95 {probe['p95']}  max {probe['max']}")
+        print(f"        peak threads {run['peak_threads']}, peak RSS {run['peak_rss_mb']} MB")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Decode/encode throughput of the streaming audio layer, per codec.
+
+Usage: python benchmarks/audio_io_benchmark.py [--seconds 120] [--json]
+
+Throughput is reported in MB/s of 16-bit PCM (frames * channels * 2 bytes),
+so codecs are compared on the amount of audio moved rather than file size.
+Peak traced memory during decode shows the pipeline stays bounded by the
+block size regardless of the clip length.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from audio_io import BLOCK_FRAMES, AudioDecodeError, audio_info, iter_blocks, BlockWriter
+
+CODECS = [
+    ('wav', 'WAV', 'PCM_16'),
+    ('flac', 'FLAC', 'PCM_16'),
+    ('ogg', 'OGG', 'VORBIS'),
+    ('mp3', 'MP3', 'MPEG_LAYER_III'),
+]
+
+
+def synth_blocks(seconds, samplerate, channels, block_frames=BLOCK_FRAMES):
+    """Speech-like test signal: modulated tones over noise, generated block by block"""
+    rng = np.random.default_rng(0)
+    total = int(seconds * samplerate)
+    for start in range(0, total, block_frames):
+        t = np.arange(start, min(start + block_frames, total)) / samplerate
+        voice = 0.3 * np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 3 * t) > 0)
+        block = voice[:, np.newaxis] + 0.02 * rng.standard_normal((len(t), channels))
+        yield block.astype(np.float32)
+
+
+def bench_codec(directory, name, format, subtype, seconds, samplerate, channels):
+    path = os.path.join(directory, f'bench.{name}')
+    pcm_bytes = int(seconds * samplerate) * channels * 2
+
+    started = time.perf_counter()
+    with BlockWriter(path, samplerate, channels, format=format, subtype=subtype) as writer:
+        for block in synth_blocks(seconds, samplerate, channels):
+            writer.write(block)
+    encode_seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    frames = 0
+    for block in iter_blocks(path):
+        frames += len(block)
+    decode_seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'codec': name,
+        'file_bytes': os.path.getsize(path),
+        'decoded_frames': frames,
+        'encode_mb_per_s': round(pcm_bytes / encode_seconds / 1e6, 2),
+        'decode_mb_per_s': round(pcm_bytes / decode_seconds / 1e6, 2),
+        'decode_peak_mb': round(peak / 1e6, 2),
+        'probed_duration': round(audio_info(path).duration, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=120.0)
+    parser.add_argument('--samplerate', type=int, default=44100)
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, format, subtype in CODECS:
+            try:
+                results.append(bench_codec(directory, name, format, subtype,
+                                           args.seconds, args.samplerate, args.channels))
+            except (RuntimeError, AudioDecodeError) as e:
+                results.append({'codec': name, 'error': str(e)})
+
+    if args.json:
+        print(json.dumps({'seconds': args.seconds, 'samplerate': args.samplerate,
+                          'channels': args.channels, 'results': results}, indent=2))
+        return
+
+    print(f"{args.seconds:.0f}s of {args.channels}ch {args.samplerate} Hz audio, {BLOCK_FRAMES}-frame blocks")
+    print(f"{'codec':<6} {'encode MB/s':>12} {'decode MB/s':>12} {'peak MB':>8} {'file MB':>8}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['codec']:<6} skipped: {r['error']}")
+            continue
+        print(f"{r['codec']:<6} {r['encode_mb_per_s']:>12} {r['decode_mb_per_s']:>12} "
+              f"{r['decode_peak_mb']:>8} {r['file_bytes'] / 1e6:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Cold-start report: where importing api/index.py spends its time.
+
+Usage: python benchmarks/import_time.py [--top 20] [--json]
+
+Imports the app in a fresh interpreter under ``python -X importtime``
+and reports the total, the slowest imports by cumulative time (nested
+imports are folded into the top-level package that triggered them), and
+the latency of the first requests to a page and /api/health in that same
+cold process. Heavy packages that should only load on the enhancement
+path are flagged if they show up.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+# Only the enhancement path should load these
+DEFERRED = ('gradio_client', 'huggingface_hub', 'httpx', 'numpy', 'soundfile', 'jwt', 'cryptography')
+
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import index
+imported = time.perf_counter() - started
+client = index.app.test_client()
+first = {}
+for path in ('/', '/api/health'):
+    t = time.perf_counter()
+    client.get(path)
+    first[path] = time.perf_counter() - t
+print(json.dumps({'import_s': imported, 'first_request_s': first, 'startup_seconds': index.STARTUP_SECONDS,
+                  'deferred_loaded': sorted(m for m in %r if m in sys.modules)}))
+""" % (DEFERRED,)
+
+
+def cold_import(env):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE], cwd=API_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def breakdown(stderr, root='index'):
+    """Cumulative microseconds of each import made directly by ``root``, plus its own time"""
+    children = []
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        depth = len(indent) // 2
+        # The log lists children before their parent, so collect until root closes
+        if depth == 0:
+            if name == root:
+                return children + [(f'{root} (module body)', int(self_us))]
+            children = []
+        elif depth == 1:
+            children.append((name, int(cumulative_us)))
+    return children
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    env = dict(os.environ, FIREBASE_ENABLED='false', USAGE_STORE='memory', UPLOAD_FOLDER=tempfile.mkdtemp(),
+               HF_HUB_DISABLE_TELEMETRY='1')
+    probe, stderr = cold_import(env)
+    imports = sorted(breakdown(stderr), key=lambda item: -item[1])
+    report = {
+        'import_ms': round(probe['import_s'] * 1000, 1),
+        'module_body_ms': round(probe['startup_seconds'] * 1000, 1),
+        'first_request_ms': {path: round(s * 1000, 1) for path, s in probe['first_request_s'].items()},
+        'deferred_loaded': probe['deferred_loaded'],
+        'imports': [{'module': name, 'ms': round(us / 1000, 1)} for name, us in imports[:args.top]],
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"import index: {report['import_ms']} ms")
+    for path, ms in report['first_request_ms'].items():
+        print(f"first GET {path}: {ms} ms")
+    if report['deferred_loaded']:
+        print(f"loaded at startup but should be deferred: {', '.join(report['deferred_loaded'])}")
+    print(f"\n{'module':<40} {'cumulative ms':>13}")
+    for entry in report['imports']:
+        print(f"{entry['module']:<40} {entry['ms']:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""Load test /api/enhance against a local stub of the DeepFilterNet2 Space.
+
+Usage: python benchmarks/load_test.py [--requests 200] [--concurrency 8] [--durations 5,15,60]
+                                      [--latency 0.5] [--jitter 0.2] [--failure-rate 0.05]
+                                      [--server werkzeug|gunicorn] [--output results.json] [--json]
+
+Starts the stub Space (benchmarks/stub_gradio.py) and the app in a child
+process with Firebase disabled and every temp directory under one work
+directory, then drives concurrent uploads of clips of the given lengths.
+Each upload is made unique so the result cache does not hide backend
+work (see --duplicates). Reports throughput, latency percentiles, status
+and method counts, peak RSS of the app's process tree, peak and leftover
+temp-disk use, and mean time per pipeline stage from /api/metrics.
+--output writes the same report as JSON, tagged with the git commit, so
+runs can be compared across commits.
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import soundfile as sf
+
+from stub_gradio import StubGradioServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STAGE_PATTERN = re.compile(r'^voiceclean_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', re.M)
+
+
+def make_clip(seconds, samplerate, seed):
+    """A WAV of speech-band tones over noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 0.5 * t))
+    buffer = io.BytesIO()
+    sf.write(buffer, (tone + 0.05 * rng.standard_normal(len(t))).astype(np.float32), samplerate,
+             format='WAV', subtype='PCM_16')
+    return buffer.getvalue()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(int(len(ordered) * q / 100), len(ordered) - 1)]
+
+
+def process_tree(root_pid):
+    """``root_pid`` and all of its descendants"""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = {root_pid}, [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        children = [child for child, parent in parents.items() if parent == pid]
+        tree.update(children)
+        frontier.extend(children)
+    return tree
+
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def disk_bytes(directory):
+    """Bytes under ``directory``, counting hard-linked files once"""
+    seen = {}
+    for path, _, files in os.walk(directory):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(path, name))
+            except OSError:
+                continue
+            seen[(st.st_dev, st.st_ino)] = st.st_size
+    return sum(seen.values())
+
+
+class Monitor:
+    """Samples the app's RSS and its work directory size in the background"""
+
+    def __init__(self, pid, directory, interval=0.1):
+        self.pid = pid
+        self.directory = directory
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        tick = 0
+        pids = process_tree(self.pid)
+        while not self._stop.is_set():
+            if tick % 20 == 0:
+                pids = process_tree(self.pid)
+            self.peak_rss = max(self.peak_rss, rss_bytes(pids))
+            if tick % 5 == 0:
+                self.peak_disk = max(self.peak_disk, disk_bytes(self.directory))
+            tick += 1
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak_disk = max(self.peak_disk, disk_bytes(self.directory))
+
+
+def start_app(args, stub_url, work_dir, port):
+    env = dict(
+        os.environ,
+        DEEPFILTER_SPACE=stub_url,
+        ENHANCEMENT_BACKEND=args.backend,
+        FIREBASE_ENABLED='false',
+        UPLOAD_FOLDER=work_dir,
+        TMPDIR=os.path.join(work_dir, 'tmp'),
+        GRADIO_TEMP_DIR=os.path.join(work_dir, 'gradio'),
+        HF_HUB_DISABLE_TELEMETRY='1',
+        RESULT_CACHE_MAX_MB=str(args.cache_mb),
+        PYTHONUNBUFFERED='1',
+    )
+    os.makedirs(env['TMPDIR'], exist_ok=True)
+    api_dir = os.path.join(ROOT, 'api')
+    if args.server == 'gunicorn':
+        command = ['gunicorn', '--chdir', api_dir, '--workers', str(args.workers), '--threads', str(args.threads),
+                   '--bind', f'127.0.0.1:{port}', '--timeout', '300', 'index:app']
+    else:
+        command = [sys.executable, '-c',
+                   f'import sys; sys.path.insert(0, {api_dir!r}); import index; '
+                   f'index.app.run(host="127.0.0.1", port={port}, threaded=True)']
+    log = open(os.path.join(work_dir, 'app.log'), 'wb')
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'App exited with {process.returncode}, see {log.name}')
+        try:
+            if httpx.get(base_url + '/api/health', timeout=2).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('App did not become healthy within 60s')
+
+
+def stage_means(metrics_text):
+    sums, counts = {}, {}
+    for kind, stage, value in STAGE_PATTERN.findall(metrics_text):
+        (sums if kind == 'sum' else counts)[stage] = float(value)
+    return {stage: {'count': int(count), 'mean_ms': round(sums.get(stage, 0.0) / count * 1000, 1)}
+            for stage, count in sorted(counts.items()) if count}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    durations = [float(d) for d in args.durations.split(',')]
+    clips = [make_clip(seconds, args.samplerate, seed) for seed, seconds in enumerate(durations)]
+    rng = random.Random(args.seed)
+
+    def body(i):
+        clip = clips[i % len(clips)]
+        if rng.random() < args.duplicates:
+            return clip
+        # Rewrite the last sample so every upload hashes differently
+        return clip[:-2] + rng.randbytes(2)
+
+    work_dir = tempfile.mkdtemp(prefix='voiceclean-load-')
+    stub = StubGradioServer(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                            rtf=args.rtf, seed=args.seed).start()
+    process, base_url = start_app(args, stub.url, work_dir, free_port())
+    monitor = Monitor(process.pid, work_dir).start()
+    local = threading.local()
+    results = []
+    lock = threading.Lock()
+
+    def send(i):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = httpx.Client(base_url=base_url, timeout=args.timeout)
+        data = body(i)
+        started = time.perf_counter()
+        try:
+            # A fresh demo identity per request keeps per-user limits out of the measurement
+            response = client.post('/api/enhance', files={'audio': (f'clip{i}.wav', data, 'audio/wav')},
+                                   headers={'Authorization': f'Bearer load-test-{i}'})
+            outcome = (response.status_code, response.headers.get('X-Enhancement-Method', ''),
+                       response.headers.get('X-Cache', ''), len(response.content))
+        except httpx.HTTPError as e:
+            outcome = ('error', type(e).__name__, '', 0)
+        elapsed = time.perf_counter() - started
+        with lock:
+            results.append((elapsed, len(data)) + outcome)
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(send, range(args.requests)))
+        elapsed = time.perf_counter() - started
+        metrics_text = httpx.get(base_url + '/api/metrics', timeout=10).text
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        monitor.stop()
+        leftover = disk_bytes(work_dir)
+        stub.stop()
+        if args.keep:
+            print(f"Work directory kept at {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    ok = sorted(r[0] for r in results if r[2] == 200)
+    latencies = sorted(r[0] for r in results)
+    mb = 1024 * 1024
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'json', 'keep')},
+        'elapsed_s': round(elapsed, 2),
+        'requests_per_s': round(len(results) / elapsed, 2),
+        'successful_per_s': round(len(ok) / elapsed, 2),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 1),
+            'p95': round(percentile(latencies, 95) * 1000, 1),
+            'p99': round(percentile(latencies, 99) * 1000, 1),
+            'max': round(latencies[-1] * 1000, 1),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 1),
+        },
+        'status': dict(Counter(str(r[2]) for r in results)),
+        'methods': dict(Counter(r[3] for r in results if r[3])),
+        'cache': dict(Counter(r[4] for r in results if r[4])),
+        'uploaded_mb': round(sum(r[1] for r in results) / mb, 1),
+        'downloaded_mb': round(sum(r[5] for r in results) / mb, 1),
+        'peak_rss_mb': round(monitor.peak_rss / mb, 1),
+        'peak_disk_mb': round(monitor.peak_disk / mb, 1),
+        'leftover_disk_mb': round(leftover / mb, 1),
+        'stub': dict(stub.stats),
+        'stages': stage_means(metrics_text),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--durations', default='5,15,60', help='clip lengths in seconds, cycled')
+    parser.add_argument('--samplerate', type=int, default=48000)
+    parser.add_argument('--duplicates', type=float, default=0.0, help='fraction of uploads repeating a clip')
+    parser.add_argument('--latency', type=float, default=0.5, help='stub seconds per call')
+    parser.add_argument('--jitter', type=float, default=0.2, help='stub mean extra delay (exponential)')
+    parser.add_argument('--rtf', type=float, default=0.0, help='stub extra seconds per second of audio')
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    parser.add_argument('--backend', default='auto', choices=['auto', 'remote', 'local'])
+    parser.add_argument('--server', default='werkzeug', choices=['werkzeug', 'gunicorn'])
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--cache-mb', type=int, default=512)
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the work directory and app log')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    latency = report['latency_ms']
+    print(f"{args.requests} requests, concurrency {args.concurrency}, clips {args.durations}s, "
+          f"stub {args.latency}s + {args.jitter}s jitter, {args.failure_rate:.0%} failures")
+    print(f"  throughput   {report['requests_per_s']} req/s ({report['successful_per_s']} ok/s)")
+    print(f"  latency ms   p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    print(f"  status       {report['status']}")
+    print(f"  methods      {report['methods']}")
+    print(f"  peak RSS     {report['peak_rss_mb']} MB")
+    print(f"  temp disk    peak {report['peak_disk_mb']} MB, left after run {report['leftover_disk_mb']} MB")
+    for stage, values in report['stages'].items():
+        print(f"  {stage:<12} {values['mean_ms']:>9} ms mean over {values['count']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""Local stand-in for the DeepFilterNet2 Gradio Space.
+
+Usage: python benchmarks/stub_gradio.py [--port 7860] [--latency 0.5] [--jitter 0.2] [--failure-rate 0.05] [--queue]
+
+Speaks the Gradio 3.x HTTP API that gradio_client 0.8.1 uses (/config,
+/info, /api/predict/, /file=), and with ``--queue`` the /queue/join
+websocket that replaces /api/predict/ when the queue is on. "Enhancement"
+echoes the input back after a delay of ``latency + rtf * audio_seconds``
+plus an exponential jitter, and a ``failure_rate`` fraction of calls
+answer with an error, so retries, breakers and fallbacks get exercised.
+"""
+import os
+import json
+import time
+import base64
+import struct
+import hashlib
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import soundfile as sf
+
+CONFIG = {
+    'version': '3.50.2',
+    'mode': 'interface',
+    'enable_queue': False,
+    'components': [
+        {'id': 1, 'type': 'audio', 'serializer': 'FileSerializable', 'props': {'label': 'audio'}},
+        {'id': 2, 'type': 'audio', 'serializer': 'FileSerializable', 'props': {'label': 'enhanced'}},
+    ],
+    'dependencies': [
+        {'targets': [3], 'trigger': 'click', 'inputs': [1], 'outputs': [2], 'backend_fn': True,
+         'api_name': 'predict', 'queue': False, 'types': {'continuous': False, 'generator': False}},
+    ],
+}
+
+API_INFO = {
+    'named_endpoints': {
+        '/predict': {
+            'parameters': [{'label': 'audio', 'component': 'Audio',
+                            'python_type': {'type': 'str', 'description': 'filepath'}}],
+            'returns': [{'label': 'enhanced', 'component': 'Audio',
+                         'python_type': {'type': 'str', 'description': 'filepath'}}],
+        }
+    },
+    'unnamed_endpoints': {},
+}
+
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def read_frame(stream):
+    """One client websocket frame: ``(opcode, payload)``; client frames are always masked"""
+    first, second = stream.read(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', stream.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', stream.read(8))[0]
+    mask = stream.read(4)
+    payload = bytearray(stream.read(length))
+    for i in range(length):
+        payload[i] ^= mask[i % 4]
+    return first & 0x0F, bytes(payload)
+
+
+def write_frame(stream, payload, opcode=0x1):
+    if len(payload) < 126:
+        header = struct.pack('>BB', 0x80 | opcode, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack('>BBH', 0x80 | opcode, 126, len(payload))
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, 127, len(payload))
+    stream.write(header + payload)
+    stream.flush()
+
+
+class StubGradioServer:
+    """Threaded HTTP server emulating the Space; ``stats`` counts calls and failures"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.5, jitter=0.0, failure_rate=0.0, rtf=0.0, seed=None,
+                 queue=False, version='3.50.2'):
+        self.config = json.loads(json.dumps(CONFIG))
+        self.config.update(version=version, enable_queue=queue)
+        # A dependency on the queue says null; false opts it out
+        self.config['dependencies'][0]['queue'] = None if queue else False
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rtf = rtf
+        self.random = random.Random(seed)
+        self.directory = tempfile.mkdtemp(prefix='stub-gradio-')
+        self.stats = {'config': 0, 'predict': 0, 'failures': 0, 'downloads': 0, 'queued': 0}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _delay(self, audio_seconds):
+        with self._lock:
+            jitter = self.random.expovariate(1.0 / self.jitter) if self.jitter > 0 else 0.0
+            fail = self.random.random() < self.failure_rate
+        return self.latency + self.rtf * audio_seconds + jitter, fail
+
+    def predict(self, payload):
+        """Decode the base64 upload, wait, and answer with a file reference (or an error)"""
+        item = payload['data'][0]
+        encoded = item['data'].split(',', 1)[-1]
+        fd, path = tempfile.mkstemp(suffix='.wav', dir=self.directory)
+        with os.fdopen(fd, 'wb') as output:
+            output.write(base64.b64decode(encoded))
+        try:
+            audio_seconds = sf.info(path).duration
+        except RuntimeError:
+            audio_seconds = 0.0
+
+        delay, fail = self._delay(audio_seconds)
+        time.sleep(delay)
+        self._count('predict')
+        if fail:
+            os.unlink(path)
+            self._count('failures')
+            return 500, {'error': 'Stub failure injected'}
+        return 200, {
+            'data': [{'name': path, 'data': None, 'is_file': True, 'orig_name': 'enhanced.wav',
+                      'size': os.path.getsize(path)}],
+            'is_generating': False,
+            'duration': delay,
+            'average_duration': delay,
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/config':
+                    server._count('config')
+                    return self._json(200, server.config)
+                if self.path.rstrip('/') == '/queue/join' and server.config['enable_queue']:
+                    return self._queue()
+                if self.path.startswith('/info'):
+                    return self._json(200, API_INFO)
+                if self.path.startswith('/file='):
+                    path = os.path.realpath(unquote(self.path[len('/file='):]))
+                    if os.path.dirname(path) != os.path.realpath(server.directory) or not os.path.exists(path):
+                        return self._json(404, {'detail': 'Not Found'})
+                    server._count('downloads')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'audio/wav')
+                    self.send_header('Content-Length', str(os.path.getsize(path)))
+                    self.end_headers()
+                    with open(path, 'rb') as f:
+                        shutil.copyfileobj(f, self.wfile)
+                    os.unlink(path)
+                    return
+                self._json(404, {'detail': 'Not Found'})
+
+            def _queue(self):
+                """The 3.x queue handshake: send_hash, estimation, send_data, process_completed"""
+                key = self.headers['Sec-WebSocket-Key']
+                accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+                self.send_response(101)
+                self.send_header('Upgrade', 'websocket')
+                self.send_header('Connection', 'Upgrade')
+                self.send_header('Sec-WebSocket-Accept', accept)
+                self.end_headers()
+                self.close_connection = True
+                server._count('queued')
+
+                def send(message):
+                    write_frame(self.wfile, json.dumps(message).encode('utf-8'))
+
+                send({'msg': 'send_hash'})
+                read_frame(self.rfile)
+                send({'msg': 'estimation', 'rank': 0, 'queue_size': 1, 'rank_eta': server.latency})
+                send({'msg': 'send_data'})
+                payload = json.loads(read_frame(self.rfile)[1])
+                send({'msg': 'process_starts'})
+                status, output = server.predict(payload)
+                send({'msg': 'process_completed', 'output': output, 'success': status == 200})
+                # Answer the client's close frame, as a websocket server must
+                opcode, _ = read_frame(self.rfile)
+                if opcode == 0x8:
+                    write_frame(self.wfile, struct.pack('>H', 1000), opcode=0x8)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.rstrip('/') != '/api/predict':
+                    return self._json(404, {'detail': 'Not Found'})
+                payload = json.loads(body)
+                # gradio_client 0.8.1 sends the payload JSON-encoded twice
+                if isinstance(payload, str):
+                    payload = json.loads(payload)
+                self._json(*server.predict(payload))
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7860)
+    parser.add_argument('--latency', type=float, default=0.5, help='base seconds per call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='mean of the exponential extra delay')
+    parser.add_argument('--rtf', type=float, default=0.0, help='extra seconds per second of audio')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--queue', action='store_true', help='serve predictions over the /queue/join websocket')
+    parser.add_argument('--version', default='3.50.2', help='Gradio version the config reports')
+    args = parser.parse_args()
+
+    server = StubGradioServer(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.rtf,
+                              queue=args.queue, version=args.version)
+    print(f"Stub DeepFilterNet2 Space on {server.url} (set DEEPFILTER_SPACE={server.url})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
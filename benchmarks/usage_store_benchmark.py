@@ -0,0 +1,107 @@
+"""Quota checks and usage writes per second against the SQLite usage store.
+
+Usage: python benchmarks/usage_store_benchmark.py [--processes 4] [--threads 8] [--seconds 5] [--json]
+
+Each process opens its own store on a shared database file, like gunicorn
+workers do, and every thread loops over random users doing one read
+(get_user) and one atomic try_consume. The run is repeated with group
+commit disabled (max_batch=1) to show what batching buys under load.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from usage_store import SQLiteUsageStore
+
+
+def worker(path, threads, seconds, users, max_batch, results):
+    store = SQLiteUsageStore(path, max_batch=max_batch)
+    counts = {'checks': 0, 'writes': 0, 'rejected': 0}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def loop():
+        rng = random.Random()
+        checks = writes = rejected = 0
+        while time.monotonic() < stop_at:
+            user_id = f'user_{rng.randrange(users)}'
+            store.get_user(user_id)
+            checks += 1
+            allowed, _ = store.try_consume(user_id, 0.5, 600)
+            writes += 1
+            rejected += not allowed
+        with lock:
+            counts['checks'] += checks
+            counts['writes'] += writes
+            counts['rejected'] += rejected
+
+    pool = [threading.Thread(target=loop) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    counts.update(store.snapshot())
+    results.put(counts)
+
+
+def run(processes, threads, seconds, users, max_batch):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'usage.sqlite3')
+        SQLiteUsageStore(path)  # create the schema before the workers race for it
+        # spawn, not fork: the store above already runs a writer thread
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        pool = [context.Process(target=worker, args=(path, threads, seconds, users, max_batch, results))
+                for _ in range(processes)]
+        started = time.monotonic()
+        for process in pool:
+            process.start()
+        totals = [results.get() for _ in pool]
+        for process in pool:
+            process.join()
+        elapsed = time.monotonic() - started
+
+    writes = sum(t['writes'] for t in totals)
+    batches = sum(t['batches'] for t in totals)
+    return {
+        'max_batch': max_batch,
+        'checks_per_s': round(sum(t['checks'] for t in totals) / elapsed),
+        'writes_per_s': round(writes / elapsed),
+        'rejected': sum(t['rejected'] for t in totals),
+        'writes_per_batch': round(writes / max(batches, 1), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    results = [run(args.processes, args.threads, args.seconds, args.users, max_batch)
+               for max_batch in (256, 1)]
+
+    if args.json:
+        print(json.dumps({'processes': args.processes, 'threads': args.threads,
+                          'seconds': args.seconds, 'results': results}, indent=2))
+        return
+
+    print(f"{args.processes} processes x {args.threads} threads, {args.users} users, {args.seconds:.0f}s")
+    print(f"{'max_batch':>9} {'checks/s':>10} {'writes/s':>10} {'writes/batch':>13}")
+    for r in results:
+        print(f"{r['max_batch']:>9} {r['checks_per_s']:>10} {r['writes_per_s']:>10} {r['writes_per_batch']:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Admission control: backend slot accounting, stale leases, token buckets, async slots, and one slot per backend call
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+from unittest import mock
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from admission import AdmissionController, AdmissionRejected
+from segmented import SegmentedEnhancer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def controller(**kwargs):
+    return AdmissionController(os.path.join(tempfile.mkdtemp(), 'admission.sqlite3'), poll_interval=0.01, **kwargs)
+
+
+def test_slots_are_capped_and_released():
+    admission = controller(max_concurrent=2)
+    with admission.slot(), admission.slot():
+        assert admission.snapshot()['in_use'] == 2
+        started = time.monotonic()
+        with pytest.raises(AdmissionRejected) as rejected:
+            with admission.slot(max_wait=0.1):
+                pass
+        assert 0.1 <= time.monotonic() - started < 0.5
+        assert rejected.value.status == 503 and rejected.value.retry_after >= 1
+    assert admission.snapshot()['in_use'] == 0
+    assert admission.snapshot()['rejected'] == 1
+
+
+def test_slot_is_released_when_the_block_raises():
+    admission = controller(max_concurrent=1)
+    with pytest.raises(ValueError):
+        with admission.slot():
+            raise ValueError('backend exploded')
+    assert admission.snapshot()['in_use'] == 0
+    with admission.slot(max_wait=0):
+        pass
+
+
+def test_stale_slot_is_reclaimed_after_its_lease():
+    clock = Clock()
+    admission = controller(max_concurrent=1, lease_seconds=60, clock=clock)
+    # A holder that never releases, like a worker process that died mid-call
+    crashed = admission.slot()
+    crashed.__enter__()
+    with pytest.raises(AdmissionRejected):
+        with admission.slot(max_wait=0):
+            pass
+
+    clock.now += 61
+    assert admission.snapshot()['in_use'] == 0
+    with admission.slot(max_wait=0):
+        # The old holder's late release must not free the new holder's slot
+        crashed.__exit__(None, None, None)
+        assert admission.snapshot()['in_use'] == 1
+    assert admission.snapshot()['in_use'] == 0
+
+
+def test_keep_waiting_lifts_the_wait_limit():
+    admission = controller(max_concurrent=1)
+    under_way = threading.Event()
+    holder = admission.slot()
+    holder.__enter__()
+    threading.Timer(0.3, holder.__exit__, (None, None, None)).start()
+    under_way.set()
+    started = time.monotonic()
+    with admission.slot(max_wait=0.05, keep_waiting=under_way.is_set):
+        assert time.monotonic() - started >= 0.25
+
+
+def test_token_bucket_bursts_then_refills():
+    clock = Clock()
+    admission = controller(clock=clock)
+    for _ in range(3):
+        admission.take_token('user', per_minute=6, burst=3)
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.take_token('user', per_minute=6, burst=3)
+    assert rejected.value.status == 429 and rejected.value.retry_after == 10
+    # Fractional costs share the same bucket
+    admission.take_token('other', per_minute=6, burst=1, cost=0.5)
+    admission.take_token('other', per_minute=6, burst=1, cost=0.5)
+    clock.now += 10
+    admission.take_token('user', per_minute=6, burst=3)
+
+
+def test_async_slots_wait_on_the_loop_and_release():
+    admission = controller(max_concurrent=1)
+
+    async def hold(seconds):
+        async with admission.slot_async(max_wait=None):
+            await asyncio.sleep(seconds)
+
+    async def run():
+        # Ten holders in turn on one slot; the loop keeps ticking meanwhile
+        ticks = []
+
+        async def tick():
+            while len(ticks) < 1000:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.ensure_future(tick())
+        await asyncio.gather(*(hold(0.02) for _ in range(10)))
+        ticker.cancel()
+        return max(b - a for a, b in zip(ticks, ticks[1:]))
+
+    assert asyncio.run(run()) < 0.1
+    assert admission.snapshot()['in_use'] == 0 and admission.snapshot()['admitted'] == 10
+
+
+def test_cancelled_async_acquire_gives_the_slot_back():
+    admission = controller(max_concurrent=1)
+    try_acquire = admission._try_acquire
+
+    def slow_acquire(holder):
+        time.sleep(0.2)
+        return try_acquire(holder)
+
+    async def run():
+        task = asyncio.ensure_future(admission.slot_async(max_wait=None).__aenter__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.4)
+
+    with mock.patch.object(admission, '_try_acquire', slow_acquire):
+        asyncio.run(run())
+    assert admission.snapshot()['in_use'] == 0
+
+
+def write_clip(seconds, samplerate=16000):
+    path = os.path.join(tempfile.mkdtemp(), 'clip.wav')
+    sf.write(path, np.zeros(int(seconds * samplerate), np.float32), samplerate)
+    return path
+
+
+def test_each_segment_takes_its_own_slot():
+    admission = controller(max_concurrent=2)
+    lock = threading.Lock()
+    running, peak, calls = [0], [0], [0]
+
+    def enhance(segment_path, result_path):
+        with admission.slot(max_wait=None):
+            with lock:
+                running[0] += 1
+                calls[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            data, samplerate = sf.read(segment_path)
+            sf.write(result_path, data, samplerate)
+            with lock:
+                running[0] -= 1
+        return 'fake'
+
+    input_path = write_clip(8.0)
+    enhancer = SegmentedEnhancer(enhance, max_workers=4, segment_seconds=1.0, overlap_seconds=0.1,
+                                 work_dir=os.path.dirname(input_path))
+    stats = enhancer.enhance_file(input_path, input_path + '.out.wav')
+    assert stats['failed_segments'] == 0 and calls[0] == stats['segments'] > 4
+    # Four segment workers, but never more backend calls than slots
+    assert peak[0] == 2
+    assert admission.snapshot()['in_use'] == 0
+
+
+def test_rejected_segment_aborts_the_file_without_retries():
+    calls = []
+
+    def enhance(segment_path, result_path):
+        calls.append(segment_path)
+        raise AdmissionRejected('busy', 503, 5)
+
+    input_path = write_clip(3.0)
+    enhancer = SegmentedEnhancer(enhance, max_workers=1, segment_seconds=1.0, overlap_seconds=0.1,
+                                 work_dir=os.path.dirname(input_path), fatal_errors=(AdmissionRejected,))
+    with pytest.raises(AdmissionRejected):
+        enhancer.enhance_file(input_path, input_path + '.out.wav')
+    # Only the segments already in the window were tried, each once
+    assert len(calls) <= 2
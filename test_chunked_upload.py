@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Chunked uploads: assembly order, ownership, resuming after assembly, concurrent finalise, and expiry of busy uploads
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from chunked_upload import ChunkedUploadStore, UploadError
+
+
+def new_store(**options):
+    return ChunkedUploadStore(tempfile.mkdtemp(), **options)
+
+
+def send(store, index, data, owner='alice', upload_id='upload-1', total=3, **options):
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return store.save_chunk(upload_id, index, total, 'talk.wav', path, owner, **options)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_out_of_order_chunks_assemble_in_index_order():
+    store = new_store()
+    for index in (2, 0, 1):
+        status = send(store, index, f'<{index}>'.encode())
+    assert status['complete'] and status['received_bytes'] == 9
+    assert read(store.assemble('upload-1', 'alice')) == b'<0><1><2>'
+
+
+def test_missing_chunks_are_reported_and_block_assembly():
+    store = new_store()
+    send(store, 0, b'a')
+    status = send(store, 2, b'c')
+    assert status['missing_chunks'] == [1] and not status['complete']
+    with pytest.raises(UploadError) as error:
+        store.assemble('upload-1', 'alice')
+    assert error.value.status == 409
+
+
+def test_uploads_belong_to_their_first_sender():
+    store = new_store()
+    send(store, 0, b'a')
+    for call in (lambda: send(store, 1, b'b', owner='mallory'),
+                 lambda: store.status('upload-1', 'mallory'),
+                 lambda: store.assemble('upload-1', 'mallory'),
+                 lambda: store.busy('upload-1', 'mallory').__enter__()):
+        with pytest.raises(UploadError) as error:
+            call()
+        assert error.value.status == 404
+    assert store.status('upload-1', 'alice')['received_chunks'] == 1
+
+
+def test_size_limit_counts_retried_chunks_once():
+    store = new_store()
+    send(store, 0, b'a' * 60, max_bytes=100)
+    send(store, 0, b'a' * 60, max_bytes=100)
+    with pytest.raises(UploadError) as error:
+        send(store, 1, b'b' * 50, max_bytes=100)
+    assert error.value.status == 413
+
+
+def test_assembled_upload_still_reports_complete():
+    store = new_store()
+    for index in range(3):
+        send(store, index, b'x')
+    path = store.assemble('upload-1', 'alice')
+
+    status = store.status('upload-1', 'alice')
+    assert status['complete'] and status['assembled'] and status['missing_chunks'] == []
+    # A chunk retried after its response was lost changes nothing
+    assert send(store, 1, b'late')['assembled']
+    assert store.assemble('upload-1', 'alice') == path and read(path) == b'xxx'
+
+
+def test_concurrent_finalise_assembles_once():
+    store = new_store()
+    for index in range(3):
+        send(store, index, bytes([65 + index]) * 100000)
+    paths, errors = [], []
+
+    def finalise():
+        try:
+            paths.append(store.assemble('upload-1', 'alice'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=finalise) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == [] and len(set(paths)) == 1
+    assert read(paths[0]) == b'A' * 100000 + b'B' * 100000 + b'C' * 100000
+
+
+def test_busy_upload_is_neither_refinalised_nor_expired():
+    store = new_store(ttl_seconds=60)
+    send(store, 0, b'a', total=1)
+    send(store, 0, b'b', total=1, upload_id='upload-2')
+    with store.busy('upload-1', 'alice'):
+        with pytest.raises(UploadError) as error:
+            store.busy('upload-1', 'alice').__enter__()
+        assert error.value.status == 409
+        assert store.expire(time.time() + 120) == 1
+        assert store.status('upload-1', 'alice')['complete']
+    with pytest.raises(UploadError):
+        store.status('upload-2', 'alice')
+    assert store.expire(time.time() + 120) == 1
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Cold-start budget: importing the app stays fast and leaves heavy dependencies unloaded
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+import subprocess
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+sys.path.insert(0, API_DIR)
+from lazy import Lazy
+
+# Seconds; the best of a few fresh interpreters must come in under it
+COLD_IMPORT_BUDGET = float(os.getenv('COLD_IMPORT_BUDGET_SECONDS', '0.5'))
+DEFERRED = ('gradio_client', 'huggingface_hub', 'numpy', 'soundfile', 'jwt', 'cryptography')
+
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import index
+imported = time.perf_counter() - started
+client = index.app.test_client()
+statuses = [client.get(path).status_code for path in ('/', '/pricing', '/api/health')]
+print(json.dumps({'import_s': imported, 'statuses': statuses, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (DEFERRED,)
+
+
+def cold_start():
+    env = dict(os.environ, FIREBASE_ENABLED='false', USAGE_STORE='memory', UPLOAD_FOLDER=tempfile.mkdtemp(),
+               PRERENDER_PAGES='false')
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=API_DIR, env=env,
+                            capture_output=True, text=True, check=True, timeout=120)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cold_import_is_within_budget():
+    fastest = min(cold_start()['import_s'] for _ in range(3))
+    assert fastest < COLD_IMPORT_BUDGET, \
+        f'import index took {fastest:.3f}s, budget {COLD_IMPORT_BUDGET:.3f}s (see benchmarks/import_time.py)'
+
+
+def test_pages_and_health_do_not_load_heavy_dependencies():
+    probe = cold_start()
+    assert probe['statuses'] == [200, 200, 200]
+    assert probe['loaded'] == []
+
+
+def test_lazy_builds_once_under_concurrency():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return {'built': True}
+
+    lazy = Lazy(factory)
+    assert not lazy.loaded
+    threads = [threading.Thread(target=lambda: lazy.get()) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert lazy.loaded
+    assert lazy.get() == {'built': True}
+    assert lazy.keys() == {'built': True}.keys()
+    assert len(calls) == 1
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Native async Gradio calls against the stub Space: HTTP predict, the queue websocket, and version gating
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+from gradio_async import AsyncSpaceClient, gradio_version
+from stub_gradio import StubGradioServer
+
+
+def write_clip():
+    path = os.path.join(tempfile.mkdtemp(), 'clip.wav')
+    sf.write(path, (0.1 * np.random.default_rng(0).standard_normal(16000)).astype(np.float32), 16000)
+    return path
+
+
+def predict(server, audio_path):
+    async def run():
+        client = AsyncSpaceClient(server.url, output_dir=tempfile.mkdtemp())
+        try:
+            supported = await client.supported()
+            return supported, (await client.predict(audio_path) if supported else None)
+        finally:
+            await client.aclose()
+    return asyncio.run(run())
+
+
+def run_stub(**kwargs):
+    return StubGradioServer(latency=0.01, **kwargs).start()
+
+
+def test_http_predict_when_the_queue_is_off():
+    server = run_stub()
+    try:
+        audio_path = write_clip()
+        supported, result_path = predict(server, audio_path)
+        assert supported
+        with open(result_path, 'rb') as result, open(audio_path, 'rb') as original:
+            assert result.read() == original.read()
+        assert server.stats['predict'] == 1 and server.stats['queued'] == 0
+    finally:
+        server.stop()
+
+
+def test_queue_websocket_when_the_queue_is_on():
+    server = run_stub(queue=True)
+    try:
+        audio_path = write_clip()
+        supported, result_path = predict(server, audio_path)
+        assert supported
+        with open(result_path, 'rb') as result, open(audio_path, 'rb') as original:
+            assert result.read() == original.read()
+        assert server.stats['queued'] == 1 and server.stats['predict'] == 1
+    finally:
+        server.stop()
+
+
+def test_gradio_client_agrees_with_the_stub_queue():
+    from gradio_client import Client
+    server = run_stub(queue=True)
+    try:
+        audio_path = write_clip()
+        result_path = Client(server.url, verbose=False).predict(audio_path, api_name='/predict')
+        assert sf.info(result_path).frames == 16000
+        assert server.stats['queued'] == 1
+    finally:
+        server.stop()
+
+
+def test_queue_before_3_2_posts_instead():
+    server = run_stub(queue=True, version='3.1.7')
+    try:
+        supported, _ = predict(server, write_clip())
+        assert supported and server.stats['queued'] == 0 and server.stats['predict'] == 1
+    finally:
+        server.stop()
+
+
+def test_other_gradio_versions_are_left_to_gradio_client():
+    assert gradio_version({'version': '4.8.0'}) == (4, 8) and gradio_version({}) == (2, 0)
+    server = run_stub(version='4.8.0')
+    try:
+        supported, _ = predict(server, write_clip())
+        assert not supported and server.stats['predict'] == 0
+    finally:
+        server.stop()
+
+
+def test_inline_base64_result_is_decoded_to_a_file():
+    async def run():
+        client = AsyncSpaceClient('http://127.0.0.1:9', output_dir=tempfile.mkdtemp())
+        try:
+            return await client._save({'data': 'data:audio/wav;base64,UklGRg==', 'orig_name': 'out.wav'})
+        finally:
+            await client.aclose()
+    path = asyncio.run(run())
+    assert os.path.basename(path) == 'out.wav'
+    with open(path, 'rb') as result:
+        assert result.read() == b'RIFF'
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Job queue: claims, requeueing from stopped workers, abandonment after max_attempts, and cleanup of failed jobs
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from jobs import JobStore, JobQueue
+
+
+def new_queue(handler=None, **options):
+    store = JobStore(tempfile.mkdtemp())
+    failures = []
+    queue = JobQueue(store, handler or (lambda job, progress: {}), stale_after=10,
+                     on_failure=lambda job, error: failures.append((job['id'], error)), **options)
+    return store, queue, failures
+
+
+def submit(queue):
+    fd, path = tempfile.mkstemp(suffix='.wav')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(b'audio')
+    return queue.submit(path, 'a.wav', {'user_id': 'u', 'minutes': 1.5}, move=True)
+
+
+def stop_worker(store, job_id, attempts):
+    """Claim ``job_id`` as a worker that then died without a heartbeat"""
+    assert store.claim_next() == job_id
+    store.update(job_id, status='running', attempts=attempts)
+    claimed = os.path.join(store.root, 'claimed', job_id)
+    os.utime(claimed, (time.time() - 60, time.time() - 60))
+
+
+def test_jobs_are_claimed_in_submission_order():
+    store, queue, _ = new_queue()
+    first, second = submit(queue), submit(queue)
+    assert store.claim_next() == first['id']
+    assert store.claim_next() == second['id']
+    assert store.claim_next() is None
+
+
+def test_stopped_worker_job_is_requeued():
+    store, queue, failures = new_queue()
+    job = submit(queue)
+    stop_worker(store, job['id'], attempts=1)
+
+    queue._sweep()
+    assert store.load(job['id'])['status'] == 'queued'
+    assert store.claim_next() == job['id']
+    assert failures == []
+
+
+def test_abandoned_job_fails_once_and_is_purged():
+    store, queue, failures = new_queue(max_attempts=2)
+    job = submit(queue)
+    stop_worker(store, job['id'], attempts=2)
+    # A second worker process sweeping the same directory
+    other = JobQueue(store, queue.handler, stale_after=10, max_attempts=2,
+                     on_failure=lambda job, error: failures.append((job['id'], error)))
+
+    queue._sweep()
+    other._sweep()
+    record = store.load(job['id'])
+    assert record['status'] == 'failed'
+    assert record['finished_at'] <= time.time()
+    assert failures == [(job['id'], 'Worker stopped responding')]
+    assert store.claim_next() is None
+
+    queue.retention = 0
+    queue._sweep()
+    assert store.load(job['id']) is None
+    assert not os.path.exists(job['input_path'])
+
+
+def test_handler_failure_runs_the_same_cleanup():
+    def handler(job, progress):
+        raise RuntimeError('backend down')
+
+    store, queue, failures = new_queue(handler)
+    job = submit(queue)
+    queue._run(store.claim_next())
+    record = store.load(job['id'])
+    assert record['status'] == 'failed' and record['error'] == 'backend down'
+    assert 'finished_at' in record
+    assert failures == [(job['id'], 'backend down')]
+    assert os.listdir(os.path.join(store.root, 'claimed')) == []
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Upload preprocessing: polyphase resampling, and what actually goes to the remote model
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from preprocess import PolyphaseResampler, UploadPreparer
+from engines import DeepFilterBackend
+
+
+def resample(samples, from_rate, to_rate, block=None):
+    resampler = PolyphaseResampler(from_rate, to_rate)
+    step = block or len(samples)
+    output = [resampler.process(samples[i:i + step]) for i in range(0, len(samples), step)]
+    output.append(resampler.process(np.zeros(0, np.float32), final=True))
+    return np.concatenate(output)
+
+
+def test_resampler_is_accurate_and_block_size_independent():
+    for from_rate in (96000, 44100):
+        frames = from_rate * 2 + 17
+        tone = np.sin(2 * np.pi * 1000 * np.arange(frames) / from_rate).astype(np.float32)
+        whole = resample(tone, from_rate, 48000)
+        assert len(whole) == round(frames * 48000 / from_rate)
+        assert np.array_equal(whole, resample(tone, from_rate, 48000, block=4099))
+        expected = np.sin(2 * np.pi * 1000 * np.arange(len(whole)) / 48000)
+        assert np.abs(whole[1000:-1000] - expected[1000:-1000]).max() < 1e-3
+
+
+def test_resampler_filters_out_what_the_new_rate_cannot_carry():
+    tone = np.sin(2 * np.pi * 30000 * np.arange(96000) / 96000).astype(np.float32)
+    output = resample(tone, 96000, 48000)
+    assert np.sqrt(np.mean(output[500:-500] ** 2)) < 1e-3
+
+
+def test_stereo_hires_upload_is_compacted_and_layout_restored():
+    work_dir = tempfile.mkdtemp()
+    input_path = os.path.join(work_dir, 'input.wav')
+    t = np.arange(96000 * 3) / 96000
+    sf.write(input_path, 0.5 * np.stack([np.sin(2 * np.pi * 440 * t), np.sin(2 * np.pi * 660 * t)], axis=1),
+             96000, subtype='PCM_24')
+    uploaded = []
+
+    def predict(path):
+        uploaded.append(sf.info(path))
+        result_dir = tempfile.mkdtemp()
+        return shutil.copy(path, os.path.join(result_dir, 'result.wav'))
+
+    stats = {}
+    output_path = os.path.join(work_dir, 'output.wav')
+    DeepFilterBackend(predict, UploadPreparer(work_dir=work_dir)).enhance(input_path, output_path, stats)
+
+    assert (uploaded[0].samplerate, uploaded[0].channels, uploaded[0].subtype) == (48000, 1, 'PCM_16')
+    assert stats['sent_bytes'] * 5 < stats['original_bytes']
+    result = sf.info(output_path)
+    assert result.channels == 2 and abs(result.duration - 3.0) < 1e-3
+    assert sorted(os.listdir(work_dir)) == ['input.wav', 'output.wav']
+
+
+def test_opus_output_at_44k_is_resampled_not_vorbis():
+    from audio_io import encode_file
+    work_dir = tempfile.mkdtemp()
+    try:
+        input_path = os.path.join(work_dir, 'in.wav')
+        t = np.arange(44100 * 3) / 44100
+        stereo = np.stack([np.sin(2 * np.pi * 440 * t), np.sin(2 * np.pi * 1000 * t)], axis=1)
+        sf.write(input_path, (0.3 * stereo).astype(np.float32), 44100)
+        sizes = []
+        for kbps in (24, 96):
+            output_path = os.path.join(work_dir, f'out_{kbps}.opus')
+            assert encode_file(input_path, output_path, 'opus', kbps)['codec'] == 'opus'
+            info = sf.info(output_path)
+            assert (info.subtype, info.samplerate, info.channels) == ('OPUS', 48000, 2)
+            assert abs(info.duration - 3.0) < 0.02
+            sizes.append(os.path.getsize(output_path))
+        # The requested bitrate is honoured
+        assert sizes[1] > 2 * sizes[0]
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Header duration probes: billed minutes must match what the decoder will actually play
+"""
+
+import os
+import sys
+import struct
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from probe import probe_duration
+
+
+def write_audio(seconds, samplerate=48000, channels=1, **kwargs):
+    fd, path = tempfile.mkstemp(suffix='.' + kwargs.get('format', 'wav').lower())
+    os.close(fd)
+    rng = np.random.default_rng(0)
+    samples = (0.1 * rng.standard_normal((int(seconds * samplerate), channels))).astype(np.float32)
+    sf.write(path, samples, samplerate, **kwargs)
+    return path
+
+
+def write_bytes(data):
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def mp3_frames(count, first=b''):
+    """MPEG-1 layer III, 128 kbps, 44.1 kHz stereo frames of 417 bytes"""
+    frame = b'\xff\xfb\x90\x00'
+    return b''.join(frame + (first if i == 0 else b'').ljust(413, b'\0') for i in range(count))
+
+
+def test_pcm_wav_matches_the_decoder():
+    for kwargs in ({}, {'channels': 2, 'subtype': 'PCM_24'}, {'subtype': 'FLOAT'}):
+        path = write_audio(3.0, **kwargs)
+        assert abs(probe_duration(path) - sf.info(path).duration) < 1e-6
+        os.unlink(path)
+
+
+def test_forged_wav_byte_rate_is_not_billed():
+    path = write_audio(60.0)
+    with open(path, 'r+b') as f:
+        header = f.read(64)
+        f.seek(header.index(b'fmt ') + 16)
+        f.write(struct.pack('<I', 0x7FFFFFFF))
+    assert abs(sf.info(path).duration - 60.0) < 1e-6
+    assert abs(probe_duration(path) - 60.0) < 1e-3
+    os.unlink(path)
+
+
+def test_rf64_wav():
+    path = write_audio(2.5, format='RF64')
+    with open(path, 'rb') as f:
+        assert f.read(4) == b'RF64'
+    assert abs(probe_duration(path) - 2.5) < 1e-6
+    os.unlink(path)
+
+
+def test_cbr_mp3():
+    path = write_bytes(mp3_frames(200))
+    assert abs(probe_duration(path, 'mp3') - 200 * 1152 / 44100) < 0.05
+    os.unlink(path)
+
+
+def test_xing_mp3_frame_count():
+    # Xing header after the 32-byte side info of a stereo MPEG-1 frame
+    path = write_bytes(mp3_frames(100, b'\0' * 32 + b'Xing' + struct.pack('>II', 1, 5000)))
+    assert abs(probe_duration(path, 'mp3') - 5000 * 1152 / 44100) < 1e-6
+    os.unlink(path)
+
+
+def test_forged_xing_mp3_is_held_to_its_size():
+    path = write_bytes(mp3_frames(1000, b'\0' * 32 + b'Xing' + struct.pack('>II', 1, 1)))
+    # 1000 frames at 128 kbps cannot be shorter than their bytes at 320 kbps
+    assert probe_duration(path, 'mp3') >= 1000 * 417 * 8 / 320000
+    os.unlink(path)
+
+
+def test_encoded_mp3_matches_the_decoder():
+    path = write_audio(4.0, 44100, format='MP3')
+    assert abs(probe_duration(path) - sf.info(path).duration) < 0.1
+    os.unlink(path)
+
+
+def test_ogg_vorbis_and_opus():
+    for subtype in ('VORBIS', 'OPUS'):
+        path = write_audio(3.0, format='OGG', subtype=subtype)
+        assert abs(probe_duration(path) - 3.0) < 0.05
+        os.unlink(path)
+
+
+def test_flac():
+    path = write_audio(3.0, 44100, format='FLAC')
+    assert abs(probe_duration(path) - 3.0) < 1e-6
+    os.unlink(path)
+
+
+def box(kind, body):
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def test_mp4_movie_header_at_either_end():
+    ftyp = box(b'ftyp', b'M4A \0\0\0\0')
+    mdat = box(b'mdat', b'\0' * 1000)
+    mvhd_v0 = box(b'mvhd', b'\0' * 12 + struct.pack('>II', 1000, 12345) + b'\0' * 80)
+    mvhd_v1 = box(b'mvhd', b'\x01\0\0\0' + b'\0' * 16 + struct.pack('>IQ', 48000, 48000 * 7) + b'\0' * 80)
+    for layout in (ftyp + mdat + box(b'moov', mvhd_v0), ftyp + box(b'moov', mvhd_v1) + mdat):
+        path = write_bytes(layout)
+        expected = 12.345 if layout.endswith(box(b'moov', mvhd_v0)) else 7.0
+        assert abs(probe_duration(path) - expected) < 1e-6
+        os.unlink(path)
+
+
+def test_forged_flac_sample_count_is_held_to_its_size():
+    path = write_audio(3.0, 44100, format='FLAC')
+    with open(path, 'r+b') as f:
+        f.seek(18)
+        packed = int.from_bytes(f.read(8), 'big')
+        f.seek(18)
+        f.write(((packed & ~0xFFFFFFFFF) | 1).to_bytes(8, 'big'))
+    size = os.path.getsize(path)
+    assert (size - 8192) * 8 / 5e6 < probe_duration(path) <= size * 8 / 5e6
+    os.unlink(path)
+
+
+def test_forged_ogg_granule_is_held_to_its_size():
+    path = write_audio(3.0, format='OGG', subtype='OPUS')
+    with open(path, 'r+b') as f:
+        data = f.read()
+        f.seek(data.rfind(b'OggS') + 6)
+        f.write(struct.pack('<q', 1))
+    assert abs(probe_duration(path) - len(data) * 8 / 512000) < 1e-6
+    os.unlink(path)
+
+
+def test_forged_mp4_movie_header_is_held_to_its_size():
+    mvhd = box(b'mvhd', b'\0' * 12 + struct.pack('>II', 1000, 1) + b'\0' * 80)
+    mdat = box(b'mdat', b'\0' * 640000)
+    for codec, expected in ((b'mp4a', 8.0), (b'alac', 640000 * 8 / 5e6)):
+        stsd = box(b'stsd', b'\0' * 4 + struct.pack('>I', 1) + box(codec, b'\0' * 28))
+        trak = box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', stsd))))
+        path = write_bytes(box(b'ftyp', b'M4A \0\0\0\0') + box(b'moov', mvhd + trak) + mdat)
+        size = os.path.getsize(path)
+        assert abs(probe_duration(path) - size * 8 / (640000 if codec == b'mp4a' else 5e6)) < 1e-6
+        assert probe_duration(path) >= expected
+        os.unlink(path)
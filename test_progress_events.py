@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Progress event bus: replay, resume, terminal events, delivery across workers, and the cost of idle watchers
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from events import EventBus, EventBusFull
+
+IDLE_WATCHERS = int(os.getenv('IDLE_WATCHERS', '500'))
+
+
+def new_bus(**kwargs):
+    return EventBus(os.path.join(tempfile.mkdtemp(), 'progress.sqlite3'), **kwargs)
+
+
+def drain(subscription):
+    return [(entry[1], entry[2]) for entry in subscription if entry]
+
+
+def test_late_subscriber_gets_history_and_stops_at_terminal_event():
+    bus = new_bus()
+    bus.publish('upload-1234', 'received', bytes=10)
+    bus.publish('upload-1234', 'segments', done=1, total=2)
+    bus.publish('upload-1234', 'ready', download_url='/api/results/x')
+    bus.publish('upload-1234', 'segments', done=2, total=2)
+    assert drain(bus.subscribe('upload-1234')) == [
+        ('received', {'bytes': 10}),
+        ('segments', {'done': 1, 'total': 2}),
+        ('ready', {'download_url': '/api/results/x'}),
+    ]
+
+
+def test_resume_after_last_event_id_and_heartbeats():
+    bus = new_bus()
+    bus.publish('upload-1234', 'received')
+    bus.publish('upload-1234', 'spooled')
+    subscription = bus.subscribe('upload-1234', last_event_id=1, heartbeat=0.01)
+    assert next(subscription)[1] == 'spooled'
+    assert next(subscription) is None
+    bus.publish('upload-1234', 'failed', error='boom')
+    assert next(subscription) == (3, 'failed', {'error': 'boom'})
+
+
+def test_events_reach_watchers_in_another_worker():
+    # Two buses on one database stand in for two worker processes
+    publisher = new_bus()
+    watcher = EventBus(publisher.path, poll_interval=0.05)
+    subscription = watcher.subscribe('upload-5678', heartbeat=5)
+    received = []
+    thread = threading.Thread(target=lambda: received.extend(drain(subscription)))
+    thread.start()
+    publisher.publish('upload-5678', 'segments', done=1, total=1)
+    publisher.publish('upload-5678', 'ready', method='local')
+    thread.join(5)
+    assert received == [('segments', {'done': 1, 'total': 1}), ('ready', {'method': 'local'})]
+    assert watcher.last_event('upload-5678')[1] == 'ready'
+
+
+def test_full_bus_rejects_new_subscribers_and_drops_events():
+    bus = new_bus(max_channels=2, linger_seconds=60)
+    bus.publish('channel-a', 'received')
+    bus.publish('channel-b', 'received')
+    bus.publish('channel-c', 'received')
+    assert bus.stats['dropped'] == 1
+    try:
+        bus.subscribe('channel-d')
+        assert False, 'expected EventBusFull'
+    except EventBusFull:
+        pass
+
+
+def test_idle_watchers_cost_nothing_and_publish_wakes_only_its_channel():
+    bus = new_bus()
+    received = {}
+
+    def watch(name):
+        received[name] = drain(bus.subscribe(name, heartbeat=60))
+
+    threads = [threading.Thread(target=watch, args=(f'watcher-{i:04d}',), daemon=True) for i in range(IDLE_WATCHERS)]
+    for thread in threads:
+        thread.start()
+    while bus.snapshot()['subscribers'] < IDLE_WATCHERS:
+        time.sleep(0.01)
+
+    cpu_before = time.process_time()
+    time.sleep(0.5)
+    idle_cpu = time.process_time() - cpu_before
+    assert idle_cpu < 0.05, f'{IDLE_WATCHERS} idle watchers used {idle_cpu:.3f}s of CPU in 0.5s'
+
+    bus.publish('watcher-0007', 'ready')
+    threads[7].join(5)
+    assert received == {'watcher-0007': [('ready', {})]}
+    assert bus.snapshot()['subscribers'] == IDLE_WATCHERS - 1
+
+    for i in range(IDLE_WATCHERS):
+        bus.publish(f'watcher-{i:04d}', 'ready')
+    for thread in threads:
+        thread.join(5)
+    assert bus.snapshot()['subscribers'] == 0
+
+
+def test_channels_are_bound_to_their_first_owner():
+    bus = new_bus()
+    assert bus.claim('upload-1234', 'alice')
+    assert bus.claim('upload-1234', 'alice')
+    assert not bus.claim('upload-1234', 'mallory')
+    # Opened by an internal publish (a job id): the first claimant takes it
+    bus.publish('job-5678', 'queued')
+    assert bus.claim('job-5678', 'alice')
+    assert not bus.claim('job-5678', 'mallory')
+
+
+def test_only_the_authenticated_owner_publishes_to_a_progress_id():
+    os.environ.update(FIREBASE_ENABLED='false', USAGE_STORE='memory', ENHANCEMENT_BACKEND='local')
+    os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp())
+    import index
+    client = index.app.test_client()
+
+    def post(channel, token=None):
+        headers = {'X-Progress-Id': channel}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        return client.post('/api/enhance', data={}, headers=headers)
+
+    assert post('anon-channel-1', None).status_code == 401
+    assert index.event_bus.last_event('anon-channel-1') is None
+
+    post('owned-channel-1', 'demo-alice')
+    before = index.event_bus.last_event('owned-channel-1')
+    assert before is not None
+    post('owned-channel-1', 'demo-mallory')
+    assert index.event_bus.last_event('owned-channel-1') == before
+
+    index.job_store.save({'id': 'existingjob1', 'status': 'queued'})
+    post('existingjob1', 'demo-alice')
+    assert index.event_bus.last_event('existingjob1') is None
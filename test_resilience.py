@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Backend resilience: circuit breaker states, failover, deadlines and hedging, sync and async
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, Endpoint, ResilientCaller
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def first_choice(candidates, weights):
+    # Endpoint choice is weighted random; tests that need an order pick the first candidate
+    return candidates[:1]
+
+
+def failing(*args):
+    raise RuntimeError('backend down')
+
+
+def answering(value, delay=0.0):
+    def call(*args):
+        time.sleep(delay)
+        return value
+    return call
+
+
+def test_breaker_closed_open_half_open():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=clock)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    # After the reset timeout exactly one trial call goes through
+    clock.now = 30
+    assert breaker.allow() and breaker.state == 'half_open'
+    assert not breaker.allow()
+
+    # A failed trial reopens straight away, without another three failures
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    clock.now = 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow() and breaker.allow()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+
+def test_failover_to_the_next_endpoint():
+    down = Endpoint('down', failing)
+    up = Endpoint('up', answering('enhanced'))
+    caller = ResilientCaller([down, up], deadline=5)
+    with mock.patch('resilience.random.choices', first_choice):
+        for _ in range(3):
+            assert caller.call('in.wav') == 'enhanced'
+    assert down.stats['failures'] == down.stats['calls'] == 3
+    assert up.stats['calls'] == 3
+
+
+def test_open_breakers_short_circuit_without_calling():
+    calls = []
+    endpoint = Endpoint('only', lambda *args: calls.append(args), CircuitBreaker(failure_threshold=1))
+    endpoint.breaker.record_failure()
+    caller = ResilientCaller([endpoint])
+    with pytest.raises(CircuitOpenError):
+        caller.call('in.wav')
+    assert calls == [] and caller.stats['short_circuited'] == 1
+
+
+def test_last_error_is_raised_when_every_endpoint_fails():
+    caller = ResilientCaller([Endpoint('a', failing), Endpoint('b', failing)])
+    with pytest.raises(RuntimeError, match='backend down'):
+        caller.call('in.wav')
+
+
+def test_deadline_returns_before_a_hung_backend():
+    hung = Endpoint('hung', answering('late', delay=1.0))
+    caller = ResilientCaller([hung], deadline=0.2)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        caller.call('in.wav')
+    assert time.monotonic() - started < 0.6
+    assert hung.stats['timeouts'] == 1 and caller.stats['deadline_exceeded'] == 1
+    assert hung.breaker._failures == 1
+
+
+def test_slow_primary_is_hedged_and_the_first_answer_wins():
+    # The first call made is slow, whichever endpoint gets it; later calls are fast
+    lock = threading.Lock()
+    calls = []
+
+    def call(name):
+        def run(*args):
+            with lock:
+                calls.append(name)
+                first = len(calls) == 1
+            time.sleep(1.0 if first else 0.01)
+            return name
+        return run
+
+    endpoints = [Endpoint('a', call('a')), Endpoint('b', call('b'))]
+    for endpoint in endpoints:
+        for _ in range(20):
+            endpoint.latency.add(0.01)
+    caller = ResilientCaller(endpoints, deadline=5, hedge=True, hedge_min_delay=0.05)
+
+    started = time.monotonic()
+    result = caller.call('in.wav')
+    assert time.monotonic() - started < 0.5
+    assert result == calls[1] != calls[0]
+    assert caller.stats['hedges'] == 1 and caller.stats['hedge_wins'] == 1
+
+
+def test_no_hedge_without_latency_history():
+    endpoints = [Endpoint('a', answering('a', 0.2)), Endpoint('b', answering('b', 0.2))]
+    caller = ResilientCaller(endpoints, deadline=5, hedge=True, hedge_min_delay=0.01)
+    caller.call('in.wav')
+    assert caller.stats['hedges'] == 0
+
+
+def async_endpoint(name, value=None, delay=0.0, error=None, cancelled=None):
+    async def call(*args):
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.append(name)
+            raise
+        if error:
+            raise error
+        return value
+    return Endpoint(name, failing, call_async=call)
+
+
+def test_call_async_fails_over_and_records_breakers():
+    down = async_endpoint('down', error=RuntimeError('backend down'))
+    up = async_endpoint('up', value='enhanced')
+    caller = ResilientCaller([down, up], deadline=5)
+
+    async def run():
+        return [await caller.call_async('in.wav') for _ in range(3)]
+
+    with mock.patch('resilience.random.choices', first_choice):
+        assert asyncio.run(run()) == ['enhanced'] * 3
+    assert down.stats['failures'] == down.stats['calls'] == 3
+    assert up.breaker.state == 'closed'
+
+
+def test_call_async_deadline_cancels_the_call():
+    cancelled = []
+    slow = async_endpoint('slow', value='late', delay=5.0, cancelled=cancelled)
+    caller = ResilientCaller([slow], deadline=0.1)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(caller.call_async('in.wav'))
+    assert cancelled == ['slow']
+    assert slow.stats['timeouts'] == 1 and caller.stats['deadline_exceeded'] == 1
+
+
+def test_call_async_short_circuits_on_open_breakers():
+    endpoint = async_endpoint('only', value='x')
+    endpoint.breaker = CircuitBreaker(failure_threshold=1)
+    endpoint.breaker.record_failure()
+    caller = ResilientCaller([endpoint])
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(caller.call_async('in.wav'))
+    assert endpoint.stats['calls'] == 0
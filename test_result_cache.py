@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Result cache: shared size limit, LRU eviction, TTL from the write time, degraded entries, private links, single flight
+"""
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from result_cache import ResultCache
+
+
+def write(root, data):
+    fd, path = tempfile.mkstemp(dir=root, suffix='.wav')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def store(cache, key, data, meta=None):
+    os.unlink(cache.put(key, write(os.path.dirname(cache.root), data), meta or {}))
+
+
+def new_cache(**options):
+    return ResultCache(os.path.join(tempfile.mkdtemp(), 'cache'), **options)
+
+
+def test_least_recently_read_entry_is_evicted_first():
+    cache = new_cache(max_bytes=250)
+    store(cache, 'a', b'a' * 100)
+    store(cache, 'b', b'b' * 100)
+    os.utime(cache._path('a'), (time.time() - 60, time.time() - 60))
+    os.utime(cache._path('b'), (time.time() - 30, time.time() - 30))
+    os.unlink(cache.get('a')[0])
+
+    store(cache, 'c', b'c' * 100)
+    assert cache.get('b') is None
+    assert read(cache.get('a')[0]) == b'a' * 100
+    assert cache.snapshot()['evictions'] == 1
+    assert cache.snapshot()['bytes'] == 200
+
+
+def test_size_limit_covers_entries_written_by_other_workers():
+    root = os.path.join(tempfile.mkdtemp(), 'cache')
+    first, second = ResultCache(root, max_bytes=250), ResultCache(root, max_bytes=250)
+    store(first, 'a', b'a' * 100)
+    os.utime(first._path('a'), (time.time() - 60, time.time() - 60))
+    store(second, 'b', b'b' * 100)
+    store(second, 'c', b'c' * 100)
+
+    assert sorted(name for name in os.listdir(root) if name.endswith('.bin')) == ['b.bin', 'c.bin']
+    assert first.get('a') is None
+
+
+def test_reads_do_not_extend_the_ttl():
+    cache = new_cache(ttl_seconds=100)
+    with mock.patch('time.time', return_value=1000.0):
+        store(cache, 'a', b'audio')
+    with mock.patch('time.time', return_value=1090.0):
+        os.unlink(cache.get('a')[0])
+    with mock.patch('time.time', return_value=1101.0):
+        assert cache.get('a') is None
+    assert cache.snapshot()['expirations'] == 1
+    assert not os.path.exists(cache._path('a'))
+
+
+def test_degraded_results_expire_sooner():
+    cache = new_cache(ttl_seconds=1000, degraded_ttl_seconds=10)
+    with mock.patch('time.time', return_value=1000.0):
+        store(cache, 'local', b'gated', {'degraded': True})
+        store(cache, 'remote', b'clean')
+    with mock.patch('time.time', return_value=1011.0):
+        assert cache.get('local') is None
+        assert cache.get('remote') is not None
+
+
+def test_returned_path_survives_eviction():
+    cache = new_cache(max_bytes=150)
+    store(cache, 'a', b'a' * 100)
+    path, _ = cache.get('a')
+    store(cache, 'b', b'b' * 100)
+
+    assert not os.path.exists(cache._path('a'))
+    assert read(path) == b'a' * 100
+
+
+def test_stale_links_are_swept():
+    cache = new_cache(stale_seconds=60)
+    store(cache, 'a', b'audio')
+    leaked, _ = cache.get('a')
+    os.utime(cache._path('a'), (time.time() - 120, time.time() - 120))
+    store(cache, 'b', b'audio')
+    assert not os.path.exists(leaked)
+
+
+def test_concurrent_misses_share_one_computation():
+    cache = new_cache()
+    calls, release = [], threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return write(os.path.dirname(cache.root), b'enhanced'), {'method': 'test'}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('k', compute)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while cache.snapshot()['coalesced'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    paths = {path for path, _, _ in results}
+    assert len(paths) == 4
+    assert all(read(path) == b'enhanced' and meta == {'method': 'test'} and not hit for path, meta, hit in results)
+
+    path, meta, hit = cache.get_or_compute('k', compute)
+    assert hit and read(path) == b'enhanced'
+
+
+def test_failed_computation_reaches_every_waiter():
+    cache = new_cache()
+    release = threading.Event()
+
+    def compute():
+        release.wait(5)
+        raise RuntimeError('backend down')
+
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_compute('k', compute)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while cache.snapshot()['coalesced'] < 2:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == ['backend down'] * 3
+    assert cache.get('k') is None
+
+
+def test_async_waiters_share_one_computation():
+    cache = new_cache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return write(os.path.dirname(cache.root), b'enhanced'), {}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_compute_async('k', compute) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert len({path for path, _, _ in results}) == 3
+    assert all(read(path) == b'enhanced' for path, _, _ in results)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Result downloads: full responses, byte ranges (206), unsatisfiable ranges (416), revalidation and expiry
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from results import ResultStore
+
+AUDIO = bytes(range(256)) * 4
+
+
+def app_client():
+    os.environ.update(FIREBASE_ENABLED='false', USAGE_STORE='memory', ENHANCEMENT_BACKEND='local')
+    os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp())
+    import index
+    return index, index.app.test_client()
+
+
+def stored_result(index):
+    fd, path = tempfile.mkstemp(suffix='.wav')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(AUDIO)
+    return index.result_store.put_file(path, 'enhanced_talk.wav', 'audio/wav', move=True)
+
+
+def test_full_result_advertises_ranges():
+    index, client = app_client()
+    response = client.get(f'/api/results/{stored_result(index)}')
+    assert response.status_code == 200
+    assert response.data == AUDIO
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Type'] == 'audio/wav'
+    assert 'private' in response.headers['Cache-Control']
+    assert response.headers['ETag']
+
+
+def test_byte_range_is_served_as_partial_content():
+    index, client = app_client()
+    url = f'/api/results/{stored_result(index)}'
+
+    response = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == AUDIO[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(AUDIO)}'
+    assert response.headers['Content-Length'] == '100'
+
+    # Open-ended and suffix ranges, as a player seeking to the end sends them
+    response = client.get(url, headers={'Range': 'bytes=1000-'})
+    assert response.status_code == 206 and response.data == AUDIO[1000:]
+    response = client.get(url, headers={'Range': 'bytes=-24'})
+    assert response.status_code == 206 and response.data == AUDIO[-24:]
+
+
+def test_range_past_the_end_is_not_satisfiable():
+    index, client = app_client()
+    response = client.get(f'/api/results/{stored_result(index)}', headers={'Range': f'bytes={len(AUDIO)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(AUDIO)}'
+
+
+def test_matching_etag_revalidates_without_a_body():
+    index, client = app_client()
+    url = f'/api/results/{stored_result(index)}'
+    etag = client.get(url).headers['ETag']
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.data == b''
+
+
+def test_unknown_and_malformed_ids_are_not_found():
+    _, client = app_client()
+    assert client.get('/api/results/0123456789abcdef').status_code == 404
+    assert client.get('/api/results/..%2Fusage.sqlite3').status_code == 404
+
+
+def test_expired_results_are_removed():
+    store = ResultStore(tempfile.mkdtemp(), ttl_seconds=60)
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    download_id = store.put_file(path, 'a.wav', 'audio/wav', move=True)
+    assert store.expire(time.time() + 30) == 0
+    assert store.get(download_id) is not None
+    assert store.expire(time.time() + 120) == 1
+    assert store.get(download_id) is None
+    assert os.listdir(store.root) == []
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Local ID-token verification tests, signed with a locally generated keyset
+"""
+
+import os
+import sys
+import time
+import threading
+import hashlib
+import datetime
+
+import jwt
+import pytest
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from token_verify import KeyCache, TokenVerifier, TokenError
+
+PROJECT_ID = 'voiceclean-test'
+
+
+def make_keypair():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'securetoken.test')])
+    now = datetime.datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return key, certificate.public_bytes(serialization.Encoding.PEM).decode('utf-8')
+
+
+class FakeKeyEndpoint:
+    """Stands in for Google's x509 endpoint; counts fetches"""
+
+    def __init__(self, keys, max_age=3600):
+        self.keys = keys
+        self.max_age = max_age
+        self.fetches = 0
+
+    def __call__(self, url):
+        self.fetches += 1
+        return {kid: pem for kid, (_, pem) in self.keys.items()}, self.max_age
+
+
+def sign(private_key, kid, **overrides):
+    now = int(time.time())
+    claims = {
+        'iss': f'https://securetoken.google.com/{PROJECT_ID}',
+        'aud': PROJECT_ID,
+        'sub': 'firebase-uid-123',
+        'email': 'person@example.com',
+        'iat': now,
+        'auth_time': now,
+        'exp': now + 3600
+    }
+    claims.update(overrides)
+    return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': kid})
+
+
+@pytest.fixture(scope='module')
+def keyset():
+    return {'key-1': make_keypair(), 'key-2': make_keypair()}
+
+
+@pytest.fixture
+def endpoint(keyset):
+    return FakeKeyEndpoint({'key-1': keyset['key-1']})
+
+
+@pytest.fixture
+def verifier(endpoint):
+    return TokenVerifier(PROJECT_ID, KeyCache(fetch=endpoint), cache_size=8)
+
+
+def test_valid_token_returns_claims(verifier, keyset):
+    claims = verifier.verify(sign(keyset['key-1'][0], 'key-1'))
+    assert claims['sub'] == 'firebase-uid-123'
+    assert claims['email'] == 'person@example.com'
+
+
+def test_repeat_verification_is_served_from_cache(verifier, endpoint, keyset):
+    token = sign(keyset['key-1'][0], 'key-1')
+    for _ in range(5):
+        verifier.verify(token)
+    assert verifier.stats['misses'] == 1
+    assert verifier.stats['hits'] == 4
+    assert endpoint.fetches == 1
+
+
+def test_cache_entry_expires_with_token(endpoint, keyset):
+    now = [time.time()]
+    verifier = TokenVerifier(PROJECT_ID, KeyCache(fetch=endpoint), clock=lambda: now[0])
+    token = sign(keyset['key-1'][0], 'key-1', exp=int(now[0]) + 30)
+    verifier.verify(token)
+    now[0] += 31
+    assert verifier._cached(hashlib.sha256(token.encode()).digest()) is None
+
+
+def test_lru_is_bounded(verifier, keyset):
+    for i in range(20):
+        verifier.verify(sign(keyset['key-1'][0], 'key-1', sub=f'user-{i}'))
+    assert verifier.snapshot()['entries'] == 8
+
+
+@pytest.mark.parametrize('overrides', [
+    {'exp': int(time.time()) - 3600},
+    {'aud': 'some-other-project'},
+    {'iss': 'https://securetoken.google.com/some-other-project'},
+    {'sub': ''},
+])
+def test_invalid_claims_are_rejected(verifier, keyset, overrides):
+    with pytest.raises(TokenError):
+        verifier.verify(sign(keyset['key-1'][0], 'key-1', **overrides))
+    assert verifier.snapshot()['entries'] == 0
+
+
+def test_forged_signature_is_rejected(verifier, keyset):
+    # Signed by key-2's private key but claiming to be key-1
+    with pytest.raises(TokenError):
+        verifier.verify(sign(keyset['key-2'][0], 'key-1'))
+
+
+def test_non_rs256_tokens_are_rejected(verifier):
+    token = jwt.encode({'sub': 'x'}, 'a-shared-secret-that-is-long-enough', algorithm='HS256', headers={'kid': 'key-1'})
+    with pytest.raises(TokenError):
+        verifier.verify(token)
+
+
+def test_malformed_token_is_rejected(verifier):
+    with pytest.raises(TokenError):
+        verifier.verify('not-a-jwt')
+
+
+def test_unknown_kid_refreshes_keys_after_rotation(verifier, endpoint, keyset):
+    verifier.verify(sign(keyset['key-1'][0], 'key-1'))
+    endpoint.keys['key-2'] = keyset['key-2']
+    verifier.keys.min_refresh_interval = 0
+
+    claims = verifier.verify(sign(keyset['key-2'][0], 'key-2'))
+    assert claims['sub'] == 'firebase-uid-123'
+    assert endpoint.fetches == 2
+
+
+def test_unknown_kid_refreshes_are_rate_limited(verifier, endpoint, keyset):
+    verifier.verify(sign(keyset['key-1'][0], 'key-1'))
+    for i in range(5):
+        with pytest.raises(TokenError):
+            verifier.verify(sign(keyset['key-2'][0], f'forged-{i}'))
+    assert endpoint.fetches == 1
+
+
+def test_keys_refresh_when_max_age_passes(endpoint, keyset):
+    now = [time.time()]
+    endpoint.max_age = 60
+    keys = KeyCache(fetch=endpoint, clock=lambda: now[0])
+    assert keys.get('key-1') is not None
+    now[0] += 61
+    assert keys.get('key-1') is not None
+    assert endpoint.fetches == 2
+
+
+def test_failed_refresh_serves_stale_keys_and_backs_off(endpoint, keyset):
+    now = [time.time()]
+    endpoint.max_age = 60
+    keys = KeyCache(fetch=endpoint, clock=lambda: now[0], min_refresh_interval=30)
+    assert keys.get('key-1') is not None
+
+    def down(url):
+        endpoint.fetches += 1
+        raise OSError('certificate endpoint unreachable')
+
+    keys.fetch = down
+    now[0] += 61
+    for _ in range(5):
+        assert keys.get('key-1') is not None
+    assert endpoint.fetches == 2
+    now[0] += 31
+    assert keys.get('key-1') is not None
+    assert endpoint.fetches == 3
+    assert keys.stats['refresh_failures'] == 2
+
+
+def test_one_fetch_at_a_time_outside_the_lock(endpoint, keyset):
+    release = threading.Event()
+
+    def slow(url):
+        release.wait(5)
+        return endpoint(url)
+
+    keys = KeyCache(fetch=slow)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(keys.get('key-1'))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while keys._fetching is None:
+        time.sleep(0.01)
+    # The lock is free while the fetch is in flight
+    assert keys._lock.acquire(timeout=1)
+    keys._lock.release()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert endpoint.fetches == 1
+    assert len(results) == 4 and all(key is not None for key in results)
+
+
+def test_known_kid_does_not_wait_for_a_refresh(endpoint, keyset):
+    now = [time.time()]
+    endpoint.max_age = 60
+    keys = KeyCache(fetch=endpoint, clock=lambda: now[0])
+    assert keys.get('key-1') is not None
+    release = threading.Event()
+    keys.fetch = lambda url: (release.wait(5), endpoint(url))[1]
+    now[0] += 61
+
+    refresher = threading.Thread(target=keys.get, args=('key-1',))
+    refresher.start()
+    while keys._fetching is None:
+        time.sleep(0.01)
+    started = time.time()
+    assert keys.get('key-1') is not None
+    assert time.time() - started < 1
+    release.set()
+    refresher.join()
+    assert endpoint.fetches == 2
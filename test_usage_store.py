@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Usage store: atomic quota charges under group commit, and a writer that survives failed batches
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from usage_store import SQLiteUsageStore
+
+
+def new_store(**options):
+    return SQLiteUsageStore(os.path.join(tempfile.mkdtemp(), 'usage.sqlite3'), **options)
+
+
+def test_concurrent_charges_never_pass_the_limit():
+    store = new_store()
+    allowed = []
+
+    def charge():
+        allowed.append(store.try_consume('user', 1.0, 10)[0])
+
+    threads = [threading.Thread(target=charge) for _ in range(25)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert allowed.count(True) == 10
+    assert store.get_user('user')['daily_minutes_used'] == 10
+    assert store.snapshot()['batches'] <= 25
+
+
+def test_failed_write_leaves_the_rest_of_its_batch():
+    store = new_store()
+
+    def failing(connection):
+        raise ValueError('bad write')
+
+    with pytest.raises(ValueError):
+        store._write(failing)
+    store.try_consume('user', 2.0, -1)
+    assert store.get_user('user')['daily_minutes_used'] == 2.0
+
+
+class BrokenRollback:
+    """A connection whose savepoint rollback fails, as on a disk I/O error"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, *args):
+        if sql.startswith('ROLLBACK TO'):
+            raise sqlite3.OperationalError('disk I/O error')
+        return self.connection.execute(sql, *args)
+
+
+def test_writer_survives_a_broken_batch():
+    store = new_store()
+    real = store._connection
+
+    def failing(connection):
+        raise ValueError('bad write')
+
+    with mock.patch.object(store, '_connection', lambda: BrokenRollback(real())):
+        with pytest.raises(sqlite3.OperationalError):
+            store._write(failing)
+    assert store.try_consume('user', 1.0, -1) == (True, 1.0)
+
+
+def test_write_times_out_instead_of_hanging():
+    store = new_store(write_timeout=0.2)
+    release = threading.Event()
+    store._writes.put(mock.Mock(statement=lambda connection: release.wait(5), args=(), error=None))
+    try:
+        with pytest.raises(TimeoutError):
+            store.try_consume('user', 1.0, -1)
+    finally:
+        release.set()
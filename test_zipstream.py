@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Streamed ZIP archives: what the batch endpoint sends must open with zipfile, CRCs and sizes intact
+"""
+
+import io
+import os
+import sys
+import zlib
+import struct
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+from zipstream import ZipStream, CHUNK_SIZE
+
+
+def build(members):
+    archive = ZipStream()
+    chunks = []
+    for name, data in members:
+        chunks.extend(archive.add_file(name, io.BytesIO(data), len(data)))
+    chunks.extend(archive.add_bytes('manifest.json', b'{"files": []}'))
+    chunks.extend(archive.close())
+    return chunks
+
+
+def test_round_trip_crcs_and_sizes():
+    members = [('a_enhanced.wav', os.urandom(3 * CHUNK_SIZE + 17)), ('b_enhanced.wav', b''),
+               ('c_enhanced.flac', os.urandom(100))]
+    chunks = build(members)
+    # A large member is sent as it is read, not in one piece
+    assert max(len(chunk) for chunk in chunks) <= CHUNK_SIZE + 1024
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [name for name, _ in members] + ['manifest.json']
+        for name, data in members:
+            info = archive.getinfo(name)
+            assert (info.file_size, info.compress_size, info.CRC) == (len(data), len(data), zlib.crc32(data))
+            assert info.compress_type == zipfile.ZIP_STORED
+            assert archive.read(name) == data
+        assert archive.read('manifest.json') == b'{"files": []}'
+
+
+def test_large_members_get_zip64_records():
+    # Lower zipfile's 2 GiB threshold so a small member takes the ZIP64 path
+    data = os.urandom(4 * CHUNK_SIZE)
+    with mock.patch.object(zipfile, 'ZIP64_LIMIT', CHUNK_SIZE):
+        body = b''.join(build([('long_enhanced.wav', data)]))
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            assert archive.testzip() is None
+            assert archive.read('long_enhanced.wav') == data
+
+    # The local header of the first member carries a ZIP64 extra field (id 0x0001)
+    name_length, extra_length = struct.unpack('<HH', body[26:30])
+    extra = body[30 + name_length:30 + name_length + extra_length]
+    assert struct.unpack('<H', extra[:2])[0] == 0x0001
+    assert b'PK\x06\x06' in body and b'PK\x06\x07' in body